@@ -1,236 +1,385 @@
 import streamlit as st
 import os
-import zipfile
-import tempfile
 import pandas as pd
-import json
 import time
-from main import process_file  # Your custom processor
-from utils import get_token_usage_summary, reset_token_tracker, print_token_summary
+import threading
+from main import DEFAULT_MAX_WORKERS, DEFAULT_BATCH_SIZE  # Your custom processor
+from utils import get_token_usage_summary, print_token_summary, get_latency_summary, get_stage_summary, TokenTracker
+from cache import get_cache_summary
+from ingest import iter_uploaded_files, count_uploaded_files
+from jobs import JobQueue
+from engine import start_engine, get_engine, forget_engine
+from schema import flatten_result
+import local_ocr
+import metrics
+from exports import ExportCache, EXPORT_FORMATS
+from result_store import ResultStore, AMOUNT_COLUMN, DATETIME_COLUMN
+from validation import payment_index, DOCUMENT_COLUMNS
+import archive
+from archive import invoice_archive
 
-# Add imports at the top if not already present
-from io import BytesIO, StringIO
+# Seconds between progress redraws while a batch runs in the background
+PROGRESS_REFRESH_SECONDS = 1.0
 
-def calculate_price(input_tokens, output_tokens, num_images):
-    """
-    Calculate total price for Gemini 2.0 Flash based on:
-    - Fixed prompt: 3000 characters
-    - Variable number of images
-    - Fixed output: 1000 characters per image
-    """
-    # Gemini 2.0 Flash pricing
-    INPUT_TEXT_PRICE = 0.0375 / 1_000_000  # $0.0375 per 1M characters
-    INPUT_IMAGE_PRICE = 0.0001935  # $0.0001935 per image
-    OUTPUT_TEXT_PRICE = 0.15 / 1_000_000  # $0.15 per 1M characters
-    
-    # Calculate costs
-    input_text_cost = 3000 * INPUT_TEXT_PRICE  # Fixed 3000 characters
-    input_image_cost = num_images * INPUT_IMAGE_PRICE
-    output_text_cost = (1000 * num_images) * OUTPUT_TEXT_PRICE  # 1000 chars per image
-    
-    total_cost = input_text_cost + input_image_cost + output_text_cost
-    
-    return {
-        'input_text_cost': input_text_cost,
-        'input_image_cost': input_image_cost,
-        'output_text_cost': output_text_cost,
-        'total_cost': total_cost
-    }
-
-def get_price_summary():
-    """Get pricing summary for all processed files"""
-    token_summary = get_token_usage_summary()
-    if token_summary['file_count'] == 0:
-        return {'file_count': 0, 'total_cost': 0, 'details': []}
-    
-    total_cost = 0
-    details = []
-    
-    for usage in token_summary['details']:
-        # Each file is 1 image based on your use case
-        num_images = 1
-        
-        price_calc = calculate_price(
-            usage['input_tokens'], 
-            usage['output_tokens'], 
-            num_images
-        )
-        
-        total_cost += price_calc['total_cost']
-        
-        details.append({
+def get_price_summary(tracker):
+    """Get pricing summary for the files of this session's batch, priced from their real token counts"""
+    token_summary = get_token_usage_summary(tracker)
+    details = [
+        {
             'filename': usage['filename'],
             'file_type': usage.get('file_type', 'Unknown'),
-            'num_images': num_images,
-            'cost': price_calc['total_cost'],
-            'file_size': usage.get('file_size', 'Unknown')
-        })
-    
+            'input_tokens': usage['input_tokens'],
+            'output_tokens': usage['output_tokens'],
+            'cost': usage['cost'],
+            'file_size': usage.get('file_size', 'Unknown'),
+            'bytes_saved': usage.get('bytes_saved', 0)
+        }
+        for usage in token_summary['details']
+    ]
     return {
         'file_count': token_summary['file_count'],
-        'total_cost': total_cost,
+        'total_cost': token_summary['total_cost'],
+        'budget_reached': token_summary['refused_requests'] > 0 or tracker.budget_exceeded(),
         'details': details
     }
 
-def flatten_json_result(json_result):
-    """Flatten nested JSON structure for sender and recipient"""
-    flattened = {}
-    
-    # Copy top-level fields
-    top_level_fields = ['transaction_id', 'transaction_number', 'payment_method', 
-                       'invoice_date', 'invoice_time', 'amount', 'currency', 
-                       'additional_data', 'image_type']
-    
-    for field in top_level_fields:
-        flattened[field] = json_result.get(field, "")
-    
-    # Flatten sender fields
-    sender = json_result.get('sender', {})
-    flattened['sender_name'] = sender.get('name', "")
-    flattened['sender_cnpj_cpf'] = sender.get('cnpj/cpf', "")
-    flattened['sender_institution'] = sender.get('institution', "")
-    flattened['sender_institution_cnpj'] = sender.get('institution_cnpj', "")
-    
-    # Flatten recipient fields
-    recipient = json_result.get('recipient', {})
-    flattened['recipient_name'] = recipient.get('name', "")
-    flattened['recipient_cnpj_cpf'] = recipient.get('cnpj/cpf', "")
-    flattened['recipient_institution'] = recipient.get('institution', "")
-    flattened['recipient_pix_key'] = recipient.get('pix_key', "")
-    
-    return flattened
-
-def filter_dataframe_by_image_type(df, selected_filter):
-    """Filter dataframe based on selected image type"""
-    if selected_filter == "All":
-        return df
-    elif selected_filter == "Others":
-        # Filter for image types that are not replay, screenshot, or live
-        return df[~df['image_type'].str.lower().isin(['replay', 'screenshot', 'live'])]
-    else:
-        # Filter for specific image type (case insensitive)
-        return df[df['image_type'].str.lower() == selected_filter.lower()]
+def set_results(rows):
+    """Replace the session's results; the store's version bump invalidates cached exports"""
+    st.session_state.result_store.reset()
+    st.session_state.result_store.append(rows)
+
+def new_token_tracker(max_cost=0.0, max_tokens=0):
+    """Fresh per-batch tracker for this session; a limit of 0 means none"""
+    return TokenTracker(max_cost=max_cost or None, max_tokens=max_tokens or None)
+
+def format_brl(value):
+    """6790.0 -> 'R$ 6.790,00'"""
+    return "R$ " + f"{value:,.2f}".replace(",", "_").replace(".", ",").replace("_", ".")
+
+def build_result_rows(name, result, duplicate_of="", error=""):
+    """Turn one stored OCR outcome into flat results rows, one per receipt (videos and PDFs can hold several)"""
+    filename = os.path.basename(name)
+    if result is None:
+        return [{"filename": filename, "source": name, "duplicate_of": duplicate_of, "error": error or "Processing failed"}]
+    try:
+        rows = flatten_result(result, filename, source=name)
+        for row in rows:
+            row["duplicate_of"] = duplicate_of
+        return rows
+    except Exception as e:
+        return [{"filename": filename, "source": name, "duplicate_of": duplicate_of, "error": str(e)}]
+
+def stage_timings_frame(stage_rows):
+    """Table of per-stage timings, with each stage's share of the time spent in all stages"""
+    timings_df = pd.DataFrame(stage_rows, columns=['stage', 'count', 'total', 'mean', 'p95'])
+    total_time = timings_df['total'].sum()
+    timings_df['share'] = (timings_df['total'] / total_time * 100).round(1) if total_time else 0.0
+    timings_df['mean'] = (timings_df['mean'] * 1000).round(1)
+    timings_df['p95'] = (timings_df['p95'].astype(float) * 1000).round(0)
+    timings_df['total'] = timings_df['total'].round(2)
+    return timings_df.rename(columns={
+        'stage': 'Stage',
+        'count': 'Calls',
+        'total': 'Total (s)',
+        'mean': 'Mean (ms)',
+        'p95': 'p95 (ms)',
+        'share': 'Share (%)'
+    })
+
+def add_uploads_to_job(job_id, uploaded_files):
+    """Runs on a helper thread so OCR starts while later archive members are still being stored"""
+    job_queue = JobQueue()
+    try:
+        job_queue.add_tasks(job_id, iter_uploaded_files(uploaded_files), seal=False)
+    finally:
+        job_queue.seal(job_id)
+        job_queue.close()
+
+def show_archive_search():
+    """Search page over every archived batch; queries go to the SQLite indexes, so no OCR is re-run"""
+    st.title("🔎 Search Invoice Archive")
+    stats = invoice_archive.stats()
+    stats_col1, stats_col2, stats_col3 = st.columns(3)
+    stats_col1.metric("Archived invoices", f"{stats['invoices']:,}")
+    stats_col2.metric("Batches", f"{stats['batches']:,}")
+    stats_col3.metric("Invoice dates", f"{stats['first_day']} → {stats['last_day']}" if stats['first_day'] else "—")
+
+    with st.form("archive_search_form"):
+        text = st.text_input("Name or institution", help="Matches word beginnings in sender/recipient names and institutions")
+        key_col1, key_col2 = st.columns(2)
+        with key_col1:
+            pix_key = st.text_input("Recipient Pix key")
+        with key_col2:
+            transaction_id = st.text_input("Transaction ID")
+        date_col, amount_col1, amount_col2 = st.columns(3)
+        with date_col:
+            date_range = st.date_input("Invoice dates", value=(), help="Pick a first and last day, or leave empty for any date")
+        with amount_col1:
+            min_amount = st.number_input("Min amount (R$)", min_value=0.0, value=0.0, step=10.0, help="0 means no minimum")
+        with amount_col2:
+            max_amount = st.number_input("Max amount (R$)", min_value=0.0, value=0.0, step=10.0, help="0 means no maximum")
+        limit = st.number_input("Max results", min_value=10, max_value=10_000, value=archive.DEFAULT_SEARCH_LIMIT, step=100)
+        search_button = st.form_submit_button("Search")
+
+    if not search_button:
+        return
+    date_from = date_range[0] if len(date_range) > 0 else None
+    date_to = date_range[1] if len(date_range) > 1 else date_from
+    start_time = time.perf_counter()
+    matches = invoice_archive.search(
+        text,
+        pix_key=pix_key,
+        transaction_id=transaction_id,
+        date_from=date_from,
+        date_to=date_to,
+        min_amount=min_amount or None,
+        max_amount=max_amount or None,
+        limit=int(limit)
+    )
+    elapsed_ms = (time.perf_counter() - start_time) * 1000
+
+    result_col1, result_col2 = st.columns(2)
+    result_col1.metric("Matches", f"{len(matches):,}" + (" (limit reached)" if len(matches) == limit else ""))
+    result_col2.metric("Total Amount", format_brl(matches['amount_value'].sum()))
+    st.caption(f"Query took {elapsed_ms:.1f} ms")
+    st.dataframe(matches, hide_index=True, use_container_width=True)
+    if len(matches):
+        st.download_button(
+            label=EXPORT_FORMATS['csv'][0],
+            data=EXPORT_FORMATS['csv'][3](matches),
+            file_name="archive_search.csv",
+            mime=EXPORT_FORMATS['csv'][2]
+        )
+
+def load_job_results(job_queue, job_id, result_store, usage_tracker, registry):
+    """Load a finished job into result_store, check it for repeated payments and archive it
+
+    Every session attached to the job calls this for its own store; recording
+    and archiving replace the job's earlier rows, so repeating it is harmless.
+    """
+    # Rows are buffered by the store and typed in one vectorized pass when the table is first shown
+    result_store.reset()
+    for row in job_queue.results(job_id):
+        with registry.span("flatten", file=row['name']):
+            result_store.append(build_result_rows(row['name'], row['result'], row['duplicate_of'], row['error']))
+    # Check the batch against itself and every earlier batch, then remember it for the next one
+    result_store.annotate(lambda frame: payment_index.flag(frame, job_id))
+    payment_index.record(result_store.frame(), job_id)
+    # Keyed by job, so resuming a job updates its archived rows instead of adding copies
+    invoice_archive.ingest_frame(result_store.frame(), job_id)
+
+    # Print token summary to console
+    print_token_summary(usage_tracker)
+    return len(result_store)
+
+def start_job(job_id, total_files, process_options):
+    """Hand a job to a background engine; the page only polls its progress from now on
+
+    Usage is counted against this session's tracker, so other sessions on the
+    same server never see or reset it. A session resuming a job that is
+    already running attaches to its engine instead.
+    """
+    start_engine(job_id, total_files, usage_tracker=st.session_state.token_tracker, **process_options)
+    st.session_state.job_id = job_id
+    st.rerun()
+
+@st.fragment(run_every=PROGRESS_REFRESH_SECONDS)
+def show_progress(job_id):
+    """Redraw a compact progress snapshot at a fixed interval, however fast files complete"""
+    engine = get_engine(job_id)
+    snapshot = engine.snapshot()
+    st.info(f"🆔 Job ID: `{job_id}` — use it to resume this batch after a refresh or restart")
+    st.progress(min(1.0, snapshot['processed'] / max(1, snapshot['total'])))
+
+    if snapshot['state'] == "failed":
+        st.error(f"Processing stopped: {snapshot['error']}")
+        forget_engine(job_id)
+        return
+    if snapshot['state'] == "finished":
+        # Each session loads its own copy, whichever one started the engine
+        with st.spinner("Checking and archiving results..."):
+            job_queue = JobQueue()
+            try:
+                load_job_results(job_queue, job_id, st.session_state.result_store, st.session_state.token_tracker, engine.registry)
+            finally:
+                job_queue.close()
+        st.session_state.processing_complete = True
+        st.rerun(scope="app")  # Swap the progress view for the results
+
+    if snapshot['state'] == "waiting":
+        st.info("⏳ Waiting for other workers to finish their part of this job...")
+    eta = f"`{snapshot['eta']:.1f}` seconds" if snapshot['eta'] is not None else "estimating..."
+    st.markdown(
+        f"**Processed:** {snapshot['processed']}/{snapshot['total']} | "
+        f"**Rate:** {snapshot['rate']:.2f} files/s | ⏳ Est. time left: {eta}"
+    )
+
+    progress_col1, progress_col2 = st.columns(2)
+    with progress_col1:
+        st.markdown("### ✅ Recently Completed")
+        st.markdown("\n".join(f"`{name}` {'✅' if ok else '🔁'}" for name, ok in snapshot['recent']) or "—")
+    with progress_col2:
+        st.markdown("### ⏱️ Pipeline Timings")
+        st.dataframe(stage_timings_frame(get_stage_summary(engine.registry)), hide_index=True, use_container_width=True)
 
 st.set_page_config(page_title="File Processor", layout="wide")
+# METRICS_PORT / METRICS_TRACE_PATH turn on the Prometheus endpoint and the span trace
+metrics.configure_from_env()
+
+page = st.sidebar.radio("Page", ["Process files", "Search archive"])
+if page == "Search archive":
+    show_archive_search()
+    st.stop()
+
 st.title("📄 Upload Images, PDFs, or a Folder (ZIP)")
 
 # Initialize session state to persist results
-if 'results' not in st.session_state:
-    st.session_state.results = []
+if 'result_store' not in st.session_state:
+    st.session_state.result_store = ResultStore()
 if 'processing_complete' not in st.session_state:
     st.session_state.processing_complete = False
 if 'temp_files_path' not in st.session_state:
     st.session_state.temp_files_path = None
+if 'job_id' not in st.session_state:
+    st.session_state.job_id = None
+if 'export_cache' not in st.session_state:
+    st.session_state.export_cache = ExportCache()
+if 'token_tracker' not in st.session_state:
+    st.session_state.token_tracker = new_token_tracker()
 
+running_job = st.session_state.job_id if not st.session_state.processing_complete and get_engine(st.session_state.job_id) else None
+if running_job:
+    show_progress(running_job)
 # Only show upload form if not already processed or user wants to start over
-if not st.session_state.processing_complete:
+elif not st.session_state.processing_complete:
     with st.form("upload_form"):
         uploaded_files = st.file_uploader(
-            "Upload one or more images, PDFs, or a ZIP folder",
-            type=["jpg", "jpeg", "png", "pdf", "zip"],
+            "Upload one or more images, PDFs, videos, or a ZIP/7z folder",
+            type=["jpg", "jpeg", "png", "pdf", "mp4", "mov", "3gp", "zip", "7z"],
             accept_multiple_files=True
         )
+        max_workers = st.number_input(
+            "Parallel workers",
+            min_value=1,
+            max_value=32,
+            value=DEFAULT_MAX_WORKERS,
+            help="Number of files sent to Gemini at the same time"
+        )
+        batch_size = st.number_input(
+            "Images per request",
+            min_value=1,
+            max_value=16,
+            value=DEFAULT_BATCH_SIZE,
+            help="Pack several images into one Gemini request so the instructions are only sent once"
+        )
+        use_cache = st.checkbox(
+            "Use result cache",
+            value=True,
+            help="Reuse earlier results for files that were already processed instead of calling Gemini again"
+        )
+        dedupe = st.checkbox(
+            "Skip near-duplicate images",
+            value=True,
+            help="Send re-compressed or resized copies of the same receipt to Gemini only once"
+        )
+        use_local_ocr = st.checkbox(
+            "Read standard Pix receipts locally",
+            value=local_ocr.LOCAL_OCR_CONFIG['enabled'] and local_ocr.is_available(),
+            disabled=not local_ocr.is_available(),
+            help="Screenshots whose fields Tesseract reads confidently are not sent to Gemini (needs tesseract installed)"
+        )
+        budget_col1, budget_col2 = st.columns(2)
+        with budget_col1:
+            max_cost = st.number_input(
+                "Spend limit (USD)",
+                min_value=0.0,
+                value=0.0,
+                step=0.5,
+                help="Stop sending files to Gemini once this batch has cost this much; 0 means no limit"
+            )
+        with budget_col2:
+            max_tokens = st.number_input(
+                "Token limit",
+                min_value=0,
+                value=0,
+                step=100_000,
+                help="Stop sending files to Gemini once this batch has used this many tokens; 0 means no limit"
+            )
         submit_button = st.form_submit_button("Process Files")
 
+    with st.expander("🔁 Resume a previous job"):
+        resume_job_id = st.text_input("Job ID", help="Shown when a batch starts; finished files are not processed again")
+        resume_button = st.button("Resume Job")
+
+    process_options = {
+        'max_workers': max_workers,
+        'use_cache': use_cache,
+        'dedupe': dedupe,
+        'batch_size': batch_size,
+        'use_local_ocr': use_local_ocr
+    }
+
     if submit_button:
         if uploaded_files:
             # Reset session state for new processing
-            st.session_state.results = []
+            set_results([])
             st.session_state.processing_complete = False
-            reset_token_tracker()  # Reset token tracking
+            st.session_state.token_tracker = new_token_tracker(max_cost, max_tokens)
             
-            with tempfile.TemporaryDirectory() as temp_dir:
-                files_to_process = []
-
-                for uploaded_file in uploaded_files:
-                    file_path = os.path.join(temp_dir, uploaded_file.name)
-
-                    with open(file_path, "wb") as f:
-                        f.write(uploaded_file.getbuffer())
-
-                    if uploaded_file.name.endswith(".zip"):
-                        with zipfile.ZipFile(file_path, 'r') as zip_ref:
-                            zip_ref.extractall(temp_dir)
-                        for root, _, files in os.walk(temp_dir):
-                            for file in files:
-                                if file.lower().endswith((".jpg", ".jpeg", ".png", ".pdf")):
-                                    files_to_process.append(os.path.join(root, file))
-                    else:
-                        if uploaded_file.name.lower().endswith((".jpg", ".jpeg", ".png", ".pdf")):
-                            files_to_process.append(file_path)
-                        else:
-                            st.warning(f"Unsupported file type: {uploaded_file.name}")
-
-                if files_to_process:
-                    total_files = len(files_to_process)
-                    progress_bar = st.progress(0)
-                    status_text = st.empty()
-                    completed_files_box = st.empty()
-                    processed_files = 0
-                    file_time_estimates = []
-                    completed_filenames = []
-
-                    status_text.info(f"⏳ Starting processing of {total_files} files...")
-
-                    for idx, fpath in enumerate(files_to_process):
-                        start_time = time.time()
-                        result = process_file(fpath)
-                        end_time = time.time()
-                        duration = end_time - start_time
-                        file_time_estimates.append(duration)
-
-                        if result is None:
-                            st.session_state.results.append({"filename": os.path.basename(fpath), "error": "Processing failed"})
-                        else:
-                            try:
-                                json_result = json.loads(result) if isinstance(result, str) else result
-                                
-                                # Flatten the nested JSON structure
-                                flattened_result = flatten_json_result(json_result)
-                                flattened_result["filename"] = os.path.basename(fpath)
-                                
-                                st.session_state.results.append(flattened_result)
-                            except Exception as e:
-                                st.session_state.results.append({"filename": os.path.basename(fpath), "error": str(e)})
-
-                        processed_files += 1
-                        completed_filenames.append(f"`{os.path.basename(fpath)}` ✅")
-                        progress_bar.progress(processed_files / total_files)
-
-                        avg_time = sum(file_time_estimates) / len(file_time_estimates)
-                        remaining_time = avg_time * (total_files - processed_files)
-
-                        status_text.markdown(
-                            f"**Processed:** {processed_files}/{total_files} | ⏳ Est. time left: `{remaining_time:.1f}` seconds"
-                        )
-                        completed_files_box.markdown("### ✅ Completed Files\n" + "\n".join(completed_filenames))
-                        time.sleep(0.1)  # Optional: give Streamlit time to refresh UI
-
-                    # Mark processing as complete
-                    st.session_state.processing_complete = True
-                    
-                    # Print token summary to console
-                    print_token_summary()
-                    
-                    st.rerun()  # Refresh to show results section
-                else:
-                    st.warning("No valid files found to process.")
+            # Archives are counted from their listings and decoded lazily while OCR runs
+            total_files = count_uploaded_files(
+                uploaded_files,
+                on_unsupported=lambda name: st.warning(f"Unsupported file type: {name}")
+            )
+
+            if total_files:
+                # Uploads are stored in the job table so a refresh or crash does not lose the batch
+                job_queue = JobQueue()
+                job_id = job_queue.create_job()
+                threading.Thread(target=add_uploads_to_job, args=(job_id, uploaded_files), daemon=True).start()
+                start_job(job_id, total_files, process_options)
+            else:
+                st.warning("No valid files found to process.")
         else:
             st.warning("Please upload at least one file before pressing 'Process Files'.")
 
+    if resume_button:
+        job_id = resume_job_id.strip()
+        job_queue = JobQueue()
+        if not job_queue.job_exists(job_id):
+            st.error(f"Unknown job ID: {job_id}")
+        else:
+            set_results([])
+            st.session_state.token_tracker = new_token_tracker(max_cost, max_tokens)
+            # The session that was adding files to this job is gone, so nothing more will arrive
+            job_queue.seal(job_id)
+            start_job(job_id, job_queue.progress(job_id)['total'], process_options)
+
 # Show results and editing interface after processing is complete
-if st.session_state.processing_complete and st.session_state.results:
-    st.success("✅ All files processed successfully!")
-    
+if st.session_state.processing_complete and len(st.session_state.result_store):
     # Display pricing summary
-    price_summary = get_price_summary()
+    price_summary = get_price_summary(st.session_state.token_tracker)
+    if price_summary['budget_reached']:
+        st.warning("⚠️ Budget reached: the remaining files were not sent to Gemini. Resume the job with a higher limit to finish it.")
+    else:
+        st.success("✅ All files processed successfully!")
+    if st.session_state.job_id:
+        st.caption(f"Job ID: `{st.session_state.job_id}`")
+    
+    cache_summary = get_cache_summary(st.session_state.token_tracker)
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Files Processed", f"{price_summary['file_count']}")
+    with col2:
+        st.metric("Total Cost", f"${price_summary['total_cost']:.6f}")
+    with col3:
+        st.metric(
+            "Cache Hits",
+            f"{cache_summary['hits']}/{cache_summary['hits'] + cache_summary['misses']}",
+            help="Files answered from the local result cache at no cost"
+        )
+
     if price_summary['file_count'] > 0:
-        col1, col2 = st.columns(2)
-        with col1:
-            st.metric("Files Processed", f"{price_summary['file_count']}")
-        with col2:
-            st.metric("Total Cost", f"${price_summary['total_cost']:.6f}")
-        
         # Expandable detailed pricing breakdown
         with st.expander("💰 Detailed Cost Breakdown by File"):
             price_df = pd.DataFrame(price_summary['details'])
@@ -238,18 +387,39 @@ if st.session_state.processing_complete and st.session_state.results:
                 # Format cost column to show more decimal places
                 price_df['cost_formatted'] = price_df['cost'].apply(lambda x: f"${x:.6f}")
                 st.dataframe(
-                    price_df[['filename', 'file_type', 'num_images', 'cost_formatted', 'file_size']].rename(columns={
+                    price_df[['filename', 'file_type', 'input_tokens', 'output_tokens', 'cost_formatted', 'file_size', 'bytes_saved']].rename(columns={
                         'filename': 'File Name',
                         'file_type': 'File Type', 
-                        'num_images': 'Images',
+                        'input_tokens': 'Input Tokens',
+                        'output_tokens': 'Output Tokens',
                         'cost_formatted': 'Cost',
-                        'file_size': 'File Size'
+                        'file_size': 'File Size',
+                        'bytes_saved': 'Bytes Saved'
                     }),
                     use_container_width=True
                 )
+
+    latency_summary = get_latency_summary()
+    if latency_summary['count']:
+        with st.expander("⏱️ Gemini Request Latency"):
+            st.caption(
+                f"p50 {latency_summary['p50']:.2f}s | p95 {latency_summary['p95']:.2f}s | p99 {latency_summary['p99']:.2f}s | "
+                f"{latency_summary['hedged']} of {latency_summary['requests']} requests hedged "
+                f"({latency_summary['hedge_wins']} answered by the hedge)"
+            )
+            latency_df = pd.DataFrame(latency_summary['buckets'])
+            latency_df['le'] = latency_df['le'].round(2)
+            st.bar_chart(latency_df, x='le', y='count', x_label="Seconds (bucket upper bound)", y_label="Requests")
+
+    if st.session_state.job_id:
+        registry = metrics.job_metrics(st.session_state.job_id, create=False)
+        stage_rows = get_stage_summary(registry) if registry is not None else []
+        if stage_rows:
+            with st.expander("⏱️ Pipeline Timings"):
+                st.caption("Time spent in each stage of this job, summed over all workers")
+                st.dataframe(stage_timings_frame(stage_rows), hide_index=True, use_container_width=True)
     
-    # Convert results to DataFrame
-    df = pd.DataFrame(st.session_state.results)
+    result_store = st.session_state.result_store
     
     # Add filter section above the dataframe
     st.markdown("### 🔍 Filter Results")
@@ -268,17 +438,66 @@ if st.session_state.processing_complete and st.session_state.results:
             key="image_type_filter"
         )
     
-    # Filter the dataframe
-    filtered_df = filter_dataframe_by_image_type(df, selected_filter)
+    # Filter on the categorical image_type column
+    filtered_df = result_store.filtered(selected_filter)
+    totals = ResultStore.totals(filtered_df)
     
-    # Show count of filtered results
+    # Show count and totals of filtered results
     with filter_col2:
-        st.metric("Showing", f"{len(filtered_df)}/{len(df)}")
+        st.metric("Showing", f"{totals['rows']}/{len(result_store)}")
+    with filter_col3:
+        st.metric(
+            "Total Amount",
+            format_brl(totals['amount_total']),
+            help=f"Sum of the {totals['amounts_parsed']} amounts that could be read as numbers"
+        )
     
-    # Display the filtered results in a dataframe
+    # Check digits, E2E IDs and resubmitted payments, computed once per chunk and batch by the store
+    full_df = result_store.frame()
+    invalid_documents = sum(
+        int((full_df[f"{column}_status"] == "invalid").sum()) for column in DOCUMENT_COLUMNS if f"{column}_status" in full_df.columns
+    )
+    flag_counts = full_df['payment_flag'].value_counts() if 'payment_flag' in full_df.columns else pd.Series(dtype=int)
+    if invalid_documents or flag_counts.get("duplicate", 0) or flag_counts.get("suspicious", 0):
+        with st.expander("🛡️ Payment Checks", expanded=True):
+            check_col1, check_col2, check_col3 = st.columns(3)
+            with check_col1:
+                st.metric("Invalid CNPJ/CPF", invalid_documents, help="Check digits do not match; masked numbers are not counted")
+            with check_col2:
+                st.metric("Duplicate Payments", int(flag_counts.get("duplicate", 0)), help="Same transaction ID seen earlier in this or a previous batch")
+            with check_col3:
+                st.metric("Suspicious Payments", int(flag_counts.get("suspicious", 0)), help="Different transaction ID with the same amount, date and Pix key")
+            flagged = full_df['payment_flag'] != ""
+            for column in DOCUMENT_COLUMNS:
+                if f"{column}_status" in full_df.columns:
+                    flagged |= full_df[f"{column}_status"] == "invalid"
+            check_columns = [column for column in ('filename', 'transaction_id', 'amount', 'invoice_date', 'sender_cnpj_cpf', 'sender_cnpj_cpf_status',
+                                                   'recipient_cnpj_cpf', 'recipient_cnpj_cpf_status', 'payment_flag', 'payment_flag_source')
+                             if column in full_df.columns]
+            st.dataframe(full_df.loc[flagged, check_columns].head(1000), hide_index=True, use_container_width=True)
+    
+    # Display one page of the filtered results; sending every row on each rerun stalls large batches
     st.markdown("### 📊 Results")
+    sort_options = {
+        "Upload order": None,
+        "Amount (highest first)": AMOUNT_COLUMN,
+        "Date (newest first)": DATETIME_COLUMN
+    }
+    page_col1, page_col2, page_col3 = st.columns([1, 1, 1])
+    with page_col1:
+        sort_by = st.selectbox("Sort by", options=list(sort_options), key="results_sort")
+    with page_col2:
+        page_size = st.selectbox("Rows per page", options=[50, 100, 500, 1000], index=1, key="results_page_size")
+    page_count = max(1, -(-len(filtered_df) // page_size))
+    if st.session_state.get("results_page", 1) > page_count:
+        st.session_state.results_page = 1
+    with page_col3:
+        page = st.number_input(f"Page (of {page_count})", min_value=1, max_value=page_count, value=1, key="results_page")
+    view_df = filtered_df
+    if sort_options[sort_by] is not None:
+        view_df = view_df.sort_values(sort_options[sort_by], ascending=False, na_position="last")
     st.dataframe(
-        filtered_df,
+        view_df.iloc[(page - 1) * page_size:page * page_size],
         use_container_width=True
     )
     
@@ -289,40 +508,24 @@ if st.session_state.processing_complete and st.session_state.results:
     if selected_filter != "All":
         st.info(f"💡 Downloads will include **filtered results only** ({selected_filter})")
     
-    # Download Excel (filtered data)
-    excel_buffer = BytesIO()
-    with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
-        filtered_df.to_excel(writer, index=False, sheet_name='Results')
-    excel_buffer.seek(0)
-    
-    download_filename_excel = f"results_{selected_filter.lower()}.xlsx" if selected_filter != "All" else "results_all.xlsx"
-    
-    st.download_button(
-        label="📥 Download Excel",
-        data=excel_buffer,
-        file_name=download_filename_excel,
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        use_container_width=True
-    )
-    
-    # Download CSV (filtered data)
-    csv_buffer = StringIO()
-    filtered_df.to_csv(csv_buffer, index=False)
-    csv_buffer.seek(0)
-    
-    download_filename_csv = f"results_{selected_filter.lower()}.csv" if selected_filter != "All" else "results_all.csv"
-    
-    st.download_button(
-        label="📄 Download CSV",
-        data=csv_buffer.getvalue(),
-        file_name=download_filename_csv,
-        mime="text/csv",
-        use_container_width=True
-    )
+    # Exports are built on the first click, in the background, and cached per (results version, filter, format)
+    export_cache = st.session_state.export_cache
+    results_version = result_store.version
+    for export_format, (label, extension, mime, _) in EXPORT_FORMATS.items():
+        st.download_button(
+            label=label,
+            data=lambda export_format=export_format: export_cache.get(
+                results_version, selected_filter, export_format, lambda: filtered_df
+            ),
+            file_name=f"results_{selected_filter.lower()}.{extension}",
+            mime=mime,
+            use_container_width=True
+        )
     
     # Process new files button
     if st.button("🔄 Process New Files", use_container_width=True):
-        st.session_state.results = []
+        set_results([])
         st.session_state.processing_complete = False
-        reset_token_tracker()  # Reset token tracking
+        st.session_state.job_id = None
+        st.session_state.token_tracker = new_token_tracker()
         st.rerun()
\ No newline at end of file
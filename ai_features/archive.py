@@ -0,0 +1,253 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import threading
+import pandas as pd
+from schema import InvoiceResult, flatten_result
+from result_store import ResultStore, AMOUNT_COLUMN, DATETIME_COLUMN
+
+DEFAULT_ARCHIVE_PATH = os.environ.get(
+    "INVOICE_ARCHIVE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "archive.sqlite")
+)
+# Text columns of InvoiceResult.flatten(), stored as extracted
+RESULT_COLUMNS = tuple(InvoiceResult().flatten())
+FTS_COLUMNS = ("sender_name", "sender_institution", "recipient_name", "recipient_institution")
+INGEST_CHUNK_SIZE = 1000
+DEFAULT_SEARCH_LIMIT = 500
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS invoices (
+    id INTEGER PRIMARY KEY,
+    batch TEXT NOT NULL,
+    source TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    {", ".join(f"{column} TEXT NOT NULL DEFAULT ''" for column in RESULT_COLUMNS)},
+    amount_value REAL,
+    invoice_day TEXT,
+    archived_at REAL NOT NULL,
+    UNIQUE (batch, source)
+);
+CREATE INDEX IF NOT EXISTS idx_invoices_transaction ON invoices (transaction_id);
+CREATE INDEX IF NOT EXISTS idx_invoices_pix_key_day ON invoices (recipient_pix_key, invoice_day);
+CREATE INDEX IF NOT EXISTS idx_invoices_day ON invoices (invoice_day);
+CREATE INDEX IF NOT EXISTS idx_invoices_amount ON invoices (amount_value);
+CREATE VIRTUAL TABLE IF NOT EXISTS invoices_fts USING fts5(
+    {", ".join(FTS_COLUMNS)}, content='invoices', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS invoices_fts_insert AFTER INSERT ON invoices BEGIN
+    INSERT INTO invoices_fts (rowid, {", ".join(FTS_COLUMNS)}) VALUES (new.id, {", ".join(f"new.{c}" for c in FTS_COLUMNS)});
+END;
+CREATE TRIGGER IF NOT EXISTS invoices_fts_delete AFTER DELETE ON invoices BEGIN
+    INSERT INTO invoices_fts (invoices_fts, rowid, {", ".join(FTS_COLUMNS)}) VALUES ('delete', old.id, {", ".join(f"old.{c}" for c in FTS_COLUMNS)});
+END;
+CREATE TRIGGER IF NOT EXISTS invoices_fts_update AFTER UPDATE ON invoices BEGIN
+    INSERT INTO invoices_fts (invoices_fts, rowid, {", ".join(FTS_COLUMNS)}) VALUES ('delete', old.id, {", ".join(f"old.{c}" for c in FTS_COLUMNS)});
+    INSERT INTO invoices_fts (rowid, {", ".join(FTS_COLUMNS)}) VALUES (new.id, {", ".join(f"new.{c}" for c in FTS_COLUMNS)});
+END;
+"""
+
+def fts_query(text):
+    """Turn free text into an FTS5 query that matches every word as a prefix"""
+    words = [word.replace('"', '""') for word in text.split()]
+    return " ".join(f'"{word}"*' for word in words)
+
+class InvoiceArchive:
+    """Extracted invoices kept in SQLite, indexed for lookups by ID, Pix key, date, amount and names"""
+    def __init__(self, path=DEFAULT_ARCHIVE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+
+    @property
+    def conn(self):
+        # Opened on first use, so importing the module never touches the disk
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def ingest_frame(self, df, batch):
+        """Upsert rows of a ResultStore frame in chunked transactions; returns the number of rows written
+
+        Rows are keyed by (batch, source), the full item name, so ingesting a
+        batch again updates it instead of adding copies while files that only
+        share a basename stay apart. Frames without a source column fall back
+        to filename. Failed rows are skipped.
+        """
+        if df.empty:
+            return 0
+        if "error" in df.columns:
+            df = df[df["error"].isna() | (df["error"].astype("string") == "")]
+        columns = ["source", "filename", *RESULT_COLUMNS]
+        text = pd.DataFrame({
+            column: df[column].astype("string").fillna("") if column in df.columns else ""
+            for column in columns
+        }, index=df.index)
+        if "source" not in df.columns:
+            text["source"] = text["filename"]
+        amounts = df[AMOUNT_COLUMN].astype("float64") if AMOUNT_COLUMN in df.columns else pd.Series(float("nan"), index=df.index)
+        days = df[DATETIME_COLUMN].dt.strftime("%Y-%m-%d") if DATETIME_COLUMN in df.columns else pd.Series(None, index=df.index)
+
+        now = time.time()
+        rows = [
+            (batch, *values, None if pd.isna(amount) else amount, None if pd.isna(day) else day, now)
+            for values, amount, day in zip(text.itertuples(index=False, name=None), amounts.tolist(), days.tolist())
+        ]
+        placeholders = ", ".join("?" * (len(columns) + 4))
+        updates = ", ".join(f"{column} = excluded.{column}" for column in ("filename", *RESULT_COLUMNS, "amount_value", "invoice_day", "archived_at"))
+        sql = (
+            f"INSERT INTO invoices (batch, {', '.join(columns)}, amount_value, invoice_day, archived_at) VALUES ({placeholders})"
+            f" ON CONFLICT (batch, source) DO UPDATE SET {updates}"
+        )
+        with self._lock:
+            for start in range(0, len(rows), INGEST_CHUNK_SIZE):
+                with self.conn:
+                    self.conn.executemany(sql, rows[start:start + INGEST_CHUNK_SIZE])
+        return len(rows)
+
+    def ingest_results(self, results, batch):
+        """Archive (filename, result JSON) pairs, e.g. outcomes of process_files"""
+        store = ResultStore()
+        rows = []
+        for filename, result in results:
+            if result is None:
+                continue
+            try:
+                rows.extend(flatten_result(result, os.path.basename(filename), source=filename))
+            except ValueError:
+                continue
+        store.append(rows)
+        return self.ingest_frame(store.frame(), batch)
+
+    def search(self, text="", pix_key="", transaction_id="", date_from=None, date_to=None,
+               min_amount=None, max_amount=None, image_type="", limit=DEFAULT_SEARCH_LIMIT, offset=0):
+        """Return matching invoices as a DataFrame, newest first
+
+        Every given filter must hold. text is matched as word prefixes against
+        sender/recipient names and institutions; dates are 'YYYY-MM-DD' strings
+        or dates and both ends are inclusive.
+        """
+        clauses = []
+        params = []
+        if text.strip():
+            clauses.append("id IN (SELECT rowid FROM invoices_fts WHERE invoices_fts MATCH ?)")
+            params.append(fts_query(text))
+        if pix_key.strip():
+            clauses.append("recipient_pix_key = ?")
+            params.append(pix_key.strip())
+        if transaction_id.strip():
+            clauses.append("transaction_id = ?")
+            params.append(transaction_id.strip().replace(" ", ""))
+        if date_from:
+            clauses.append("invoice_day >= ?")
+            params.append(str(date_from))
+        if date_to:
+            clauses.append("invoice_day <= ?")
+            params.append(str(date_to))
+        if min_amount is not None:
+            clauses.append("amount_value >= ?")
+            params.append(min_amount)
+        if max_amount is not None:
+            clauses.append("amount_value <= ?")
+            params.append(max_amount)
+        if image_type:
+            clauses.append("image_type = ?")
+            params.append(image_type.lower())
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        sql = (
+            f"SELECT batch, source, filename, {', '.join(RESULT_COLUMNS)}, amount_value, invoice_day FROM invoices {where}"
+            f" ORDER BY invoice_day DESC, id DESC LIMIT ? OFFSET ?"
+        )
+        with self._lock:
+            return pd.read_sql_query(sql, self.conn, params=[*params, limit, offset])
+
+    def stats(self):
+        with self._lock:
+            count, batches, total, first_day, last_day = self.conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT batch), COALESCE(SUM(amount_value), 0), MIN(invoice_day), MAX(invoice_day) FROM invoices"
+            ).fetchone()
+        return {
+            'invoices': count,
+            'batches': batches,
+            'amount_total': total,
+            'first_day': first_day,
+            'last_day': last_day
+        }
+
+# Global instance, shared like the payment index
+invoice_archive = InvoiceArchive()
+
+def _read_jsonl(path):
+    """(file, result JSON) pairs from main.py batch output"""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                if record.get('result') is not None:
+                    yield record['file'], json.dumps(record['result'], ensure_ascii=False)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local archive of extracted invoices.")
+    parser.add_argument("--db", default=DEFAULT_ARCHIVE_PATH, help="Path of the archive database")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ingest_parser = commands.add_parser("ingest", help="Archive the JSON lines written by main.py, or a finished job")
+    ingest_parser.add_argument("source", help="A main.py output file, or a job ID with --job")
+    ingest_parser.add_argument("--job", action="store_true", help="source is a job ID in the jobs database")
+    ingest_parser.add_argument("--batch", help="Batch name to file the results under (defaults to the file name or job ID)")
+
+    search_parser = commands.add_parser("search", help="Print matching invoices as JSON lines")
+    search_parser.add_argument("text", nargs="?", default="", help="Words matched against names and institutions")
+    search_parser.add_argument("--pix-key", default="")
+    search_parser.add_argument("--transaction-id", default="")
+    search_parser.add_argument("--from", dest="date_from", help="First invoice date, YYYY-MM-DD")
+    search_parser.add_argument("--to", dest="date_to", help="Last invoice date, YYYY-MM-DD")
+    search_parser.add_argument("--min-amount", type=float)
+    search_parser.add_argument("--max-amount", type=float)
+    search_parser.add_argument("--limit", type=int, default=DEFAULT_SEARCH_LIMIT)
+
+    commands.add_parser("stats", help="Show archive totals")
+    args = parser.parse_args()
+
+    archive = InvoiceArchive(args.db)
+    if args.command == "ingest":
+        if args.job:
+            from jobs import JobQueue
+            queue = JobQueue()
+            results = [(row['name'], row['result']) for row in queue.results(args.source)]
+            batch = args.batch or args.source
+        else:
+            results = _read_jsonl(args.source)
+            batch = args.batch or os.path.basename(args.source)
+        print(f"Archived {archive.ingest_results(results, batch):,} invoices as {batch}", file=sys.stderr)
+    elif args.command == "search":
+        start_time = time.perf_counter()
+        matches = archive.search(
+            args.text,
+            pix_key=args.pix_key,
+            transaction_id=args.transaction_id,
+            date_from=args.date_from,
+            date_to=args.date_to,
+            min_amount=args.min_amount,
+            max_amount=args.max_amount,
+            limit=args.limit
+        )
+        for record in matches.to_dict(orient="records"):
+            print(json.dumps(record, ensure_ascii=False, default=str))
+        print(f"{len(matches):,} matches in {(time.perf_counter() - start_time) * 1000:.1f} ms", file=sys.stderr)
+    else:
+        print(archive.stats())
+    archive.close()
@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import random
+import hashlib
+import threading
+from types import SimpleNamespace
+from schema import InvoiceResult
+
+# An OCR backend is anything with the generate_content(contents, generation_config=None,
+# request_options=None) signature of genai.GenerativeModel, returning an object with
+# .text and .usage_metadata. utils.set_ocr_backend() swaps the one every request goes through.
+
+DEFAULT_CASSETTE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cassettes", "invoice_data.jsonl")
+# Rough prompt cost of one image or PDF page, for answers made up without a recording
+SYNTHETIC_TOKENS_PER_PART = 258
+SYNTHETIC_LATENCY_SECONDS = 1.5
+
+def request_key(contents, generation_config=None):
+    """Stable hash of everything that decides the answer: uploaded bytes, prompt text and schema"""
+    digest = hashlib.sha256()
+    for part in contents:
+        if "data" in part:
+            digest.update(b"data:" + part.get("mime_type", "").encode() + b":")
+            digest.update(hashlib.sha256(part["data"]).digest())
+        else:
+            digest.update(b"text:" + part.get("text", "").encode("utf-8"))
+        digest.update(b"\0")
+    schema = (generation_config or {}).get("response_schema")
+    digest.update(json.dumps(schema, sort_keys=True).encode())
+    return digest.hexdigest()
+
+def make_response(text, prompt_tokens, output_tokens):
+    return SimpleNamespace(
+        text=text,
+        usage_metadata=SimpleNamespace(
+            prompt_token_count=prompt_tokens,
+            candidates_token_count=output_tokens,
+            total_token_count=prompt_tokens + output_tokens
+        )
+    )
+
+class Cassette:
+    """Recorded answers in a JSON-lines file, one request per line"""
+    def __init__(self, path=DEFAULT_CASSETTE_PATH):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries[entry['key']] = entry
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def add(self, entry):
+        with self._lock:
+            self.entries[entry['key']] = entry
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+class RecordingBackend:
+    """Passes requests to a real backend and stores every answer in a cassette"""
+    def __init__(self, backend, cassette):
+        self.backend = backend
+        self.cassette = cassette
+
+    def generate_content(self, contents, generation_config=None, request_options=None):
+        start_time = time.monotonic()
+        response = self.backend.generate_content(contents, generation_config=generation_config, request_options=request_options)
+        usage = response.usage_metadata
+        self.cassette.add({
+            'key': request_key(contents, generation_config),
+            'text': response.text,
+            'prompt_tokens': usage.prompt_token_count,
+            'output_tokens': usage.candidates_token_count,
+            'latency': time.monotonic() - start_time
+        })
+        return response
+
+class ReplayBackend:
+    """Offline stand-in for Gemini that answers from a cassette
+
+    latency=None replays the recorded latency (times latency_scale);
+    a number replaces it with that mean and log-normal jitter. error_rate
+    and rate_limit_rate inject retryable 503 and 429 errors. Requests missing
+    from the cassette get an empty schema-valid answer when synthesize is
+    on, otherwise a LookupError.
+    """
+    def __init__(self, cassette=None, latency=None, latency_scale=1.0, jitter=0.3,
+                 error_rate=0.0, rate_limit_rate=0.0, synthesize=True, seed=None):
+        self.cassette = cassette
+        self.latency = latency
+        self.latency_scale = latency_scale
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.synthesize = synthesize
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.replayed = 0
+        self.synthesized = 0
+        self.injected_errors = 0
+
+    def _draw(self):
+        with self._lock:
+            return self._random.random(), self._random.lognormvariate(0, self.jitter) if self.jitter else 1.0
+
+    def generate_content(self, contents, generation_config=None, request_options=None):
+        from google.api_core import exceptions
+
+        key = request_key(contents, generation_config)
+        entry = self.cassette.get(key) if self.cassette is not None else None
+        if entry is None and not self.synthesize:
+            raise LookupError(f"Request {key[:12]} is not in the cassette")
+
+        if self.latency is not None:
+            latency = self.latency
+        elif entry is not None:
+            latency = entry['latency'] * self.latency_scale
+        else:
+            latency = SYNTHETIC_LATENCY_SECONDS * self.latency_scale
+        roll, factor = self._draw()
+        time.sleep(latency * factor)
+
+        if roll < self.rate_limit_rate + self.error_rate:
+            with self._lock:
+                self.injected_errors += 1
+            if roll < self.rate_limit_rate:
+                raise exceptions.TooManyRequests("Injected rate limit")
+            raise exceptions.ServiceUnavailable("Injected server error")
+
+        with self._lock:
+            if entry is not None:
+                self.replayed += 1
+            else:
+                self.synthesized += 1
+        if entry is not None:
+            return make_response(entry['text'], entry['prompt_tokens'], entry['output_tokens'])
+        return self._synthetic_response(contents, generation_config)
+
+    def _synthetic_response(self, contents, generation_config):
+        parts = sum(1 for part in contents if "data" in part)
+        prompt_tokens = parts * SYNTHETIC_TOKENS_PER_PART + sum(len(part.get("text", "")) // 4 for part in contents)
+        result = InvoiceResult(image_type="screenshot").to_dict()
+        schema = (generation_config or {}).get("response_schema") or {}
+        if schema.get("type") == "array":
+            text = json.dumps([{"image_index": index, **result} for index in range(parts)], separators=(",", ":"))
+        else:
+            text = json.dumps(result, separators=(",", ":"))
+        return make_response(text, prompt_tokens, len(text) // 4)
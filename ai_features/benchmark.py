@@ -0,0 +1,132 @@
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import contextlib
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "invoice_data")
+DEFAULT_INPUTS = [os.path.join(DATA_DIR, name) for name in ("others", "pdfs", "screenshots", "small_sample")]
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def run_benchmark(inputs=DEFAULT_INPUTS, repeat=1, **process_options):
+    """Push every file in inputs through process_files repeat times and return throughput/latency/memory figures
+
+    The result cache is always bypassed so each run measures the full pipeline.
+    """
+    from main import process_files, _percentile
+    from ingest import iter_input_paths
+    from utils import TokenTracker
+
+    usage_tracker = TokenTracker()
+    durations = []
+    files = 0
+    failed = 0
+    start_time = time.time()
+    for _ in range(repeat):
+        for outcome in process_files(iter_input_paths(inputs), use_cache=False, usage_tracker=usage_tracker, **process_options):
+            if outcome['skipped_budget']:
+                continue
+            files += 1
+            if outcome['result'] is None:
+                failed += 1
+            durations.append(outcome['duration'])
+    elapsed_time = time.time() - start_time
+
+    durations.sort()
+    token_summary = usage_tracker.get_summary()
+    return {
+        'files': files,
+        'failed': failed,
+        'elapsed_seconds': elapsed_time,
+        'files_per_second': files / elapsed_time if elapsed_time else 0.0,
+        'latency_p50': _percentile(durations, 0.50),
+        'latency_p95': _percentile(durations, 0.95),
+        'latency_p99': _percentile(durations, 0.99),
+        'peak_rss_mb': peak_rss_mb(),
+        'total_tokens': token_summary['total_tokens'],
+        'tokens_per_file': token_summary['total_tokens'] / max(1, files),
+        'cost_per_1000_files': token_summary['total_cost'] / max(1, files) * 1000
+    }
+
+def print_report(report, stream=sys.stderr):
+    print("\n" + "="*50, file=stream)
+    print(f"⏱️ BENCHMARK ({report['backend']})", file=stream)
+    print("="*50, file=stream)
+    print(f"Files: {report['files']:,} ({report['failed']:,} failed) in {report['elapsed_seconds']:.1f}s", file=stream)
+    print(f"Throughput: {report['files_per_second']:.2f} files/s", file=stream)
+    print(f"Latency p50: {report['latency_p50']:.2f}s | p95: {report['latency_p95']:.2f}s | p99: {report['latency_p99']:.2f}s", file=stream)
+    print(f"Peak RSS: {report['peak_rss_mb']:.0f} MB", file=stream)
+    print(f"Tokens per file: {report['tokens_per_file']:.1f} ({report['total_tokens']:,} total)", file=stream)
+    print(f"Cost per 1,000 files: ${report['cost_per_1000_files']:.4f}", file=stream)
+    print("="*50, file=stream)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure pipeline throughput over invoice_data/ against Gemini or a recorded stand-in.")
+    parser.add_argument("inputs", nargs="*", default=DEFAULT_INPUTS, help="Defaults to invoice_data/ others, pdfs, screenshots and small_sample")
+    parser.add_argument("--backend", choices=["replay", "record", "gemini"], default="replay",
+                        help="replay answers offline from the cassette; record calls Gemini and stores its answers")
+    parser.add_argument("--cassette", help="Cassette file (JSON lines)")
+    parser.add_argument("--strict", action="store_true", help="Fail requests missing from the cassette instead of synthesizing an answer")
+    parser.add_argument("--latency", type=float, help="Replace recorded latencies with this mean, in seconds")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="Multiply recorded latencies")
+    parser.add_argument("--jitter", type=float, default=0.3, help="Log-normal sigma applied to every replayed latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests failing with a retryable 503")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Share of requests failing with a 429")
+    parser.add_argument("--seed", type=int, help="Seed for latency and error injection")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--no-dedupe", action="store_true")
+    parser.add_argument("--no-local-ocr", action="store_true")
+    parser.add_argument("--json", help="Also write the report to this file")
+    args = parser.parse_args()
+
+    if args.backend == "replay":
+        # The stand-in never talks to Gemini, so no real key is needed
+        os.environ.setdefault("GEMINI_API_KEY", "offline")
+
+    import utils
+    from backends import Cassette, RecordingBackend, ReplayBackend, DEFAULT_CASSETTE_PATH
+
+    cassette = Cassette(args.cassette or DEFAULT_CASSETTE_PATH)
+    if args.backend == "replay":
+        backend = ReplayBackend(
+            cassette,
+            latency=args.latency,
+            latency_scale=args.latency_scale,
+            jitter=args.jitter,
+            error_rate=args.error_rate,
+            rate_limit_rate=args.rate_limit_rate,
+            synthesize=not args.strict,
+            seed=args.seed
+        )
+        utils.set_ocr_backend(backend)
+    elif args.backend == "record":
+        utils.set_ocr_backend(RecordingBackend(utils.vision_model, cassette))
+
+    # Per-file diagnostics go to stderr so stdout carries only the JSON report
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run_benchmark(
+            args.inputs,
+            repeat=args.repeat,
+            max_workers=args.workers,
+            batch_size=args.batch_size,
+            dedupe=not args.no_dedupe,
+            use_local_ocr=False if args.no_local_ocr else None
+        )
+    report['backend'] = args.backend
+    if args.backend == "replay":
+        report['replayed'] = backend.replayed
+        report['synthesized'] = backend.synthesized
+        report['injected_errors'] = backend.injected_errors
+    print_report(report)
+    print(json.dumps(report))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,125 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "results.sqlite")
+DEFAULT_MAX_ENTRIES = 50_000
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024  # 200 MB of stored responses
+DEFAULT_MAX_AGE_DAYS = 90
+EVICT_EVERY_N_PUTS = 100
+
+def make_cache_key(data, prompt, model_name, schema_version=""):
+    """Hash the file bytes together with the prompt, model and result schema version that produced the answer"""
+    digest = hashlib.sha256()
+    for part in (str(schema_version).encode("utf-8"), model_name.encode("utf-8"), prompt.encode("utf-8"), data):
+        # Length-prefix each part so different splits can never collide
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+class ResultCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES,
+                 max_bytes=DEFAULT_MAX_BYTES, max_age_days=DEFAULT_MAX_AGE_DAYS, enabled=True):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_days * 24 * 3600
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._conn = None
+        self._puts_since_evict = 0
+
+    def _connect(self):
+        # Opened lazily so importing the module never touches the disk
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_results_accessed ON results (accessed_at)")
+            self._evict_locked()
+        return self._conn
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT value, created_at FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            now = time.time()
+            if row is None or now - row[1] > self.max_age_seconds:
+                return None
+            conn.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+            conn.commit()
+            return row[0]
+
+    def put(self, key, value):
+        if not self.enabled or value is None:
+            return
+        with self._lock:
+            conn = self._connect()
+            now = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value.encode("utf-8")), now, now)
+            )
+            conn.commit()
+            self._puts_since_evict += 1
+            if self._puts_since_evict >= EVICT_EVERY_N_PUTS:
+                self._evict_locked()
+
+    def _evict_locked(self):
+        """Drop expired entries, then least recently used ones until under the size limits"""
+        conn = self._conn
+        conn.execute("DELETE FROM results WHERE created_at < ?", (time.time() - self.max_age_seconds,))
+
+        count, total_size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+        if count > self.max_entries or total_size > self.max_bytes:
+            # Walk from the least recently used end and find where the kept entries start
+            excess_count = max(0, count - self.max_entries)
+            excess_size = max(0, total_size - self.max_bytes)
+            dropped_count = 0
+            dropped_size = 0
+            cutoff = None
+            for accessed_at, size in conn.execute("SELECT accessed_at, size FROM results ORDER BY accessed_at"):
+                if dropped_count >= excess_count and dropped_size >= excess_size:
+                    break
+                dropped_count += 1
+                dropped_size += size
+                cutoff = accessed_at
+            if cutoff is not None:
+                conn.execute("DELETE FROM results WHERE accessed_at <= ?", (cutoff,))
+
+        conn.commit()
+        self._puts_since_evict = 0
+
+    def clear(self):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM results")
+            conn.commit()
+
+# Global instance; hits and misses are counted by each batch's TokenTracker, not here
+result_cache = ResultCache()
+
+def get_cache_summary(tracker):
+    """Cache hit/miss counters of one batch's tracker for display in Streamlit"""
+    summary = tracker.get_summary()
+    lookups = summary['cache_hits'] + summary['cache_misses']
+    return {
+        'enabled': result_cache.enabled,
+        'hits': summary['cache_hits'],
+        'misses': summary['cache_misses'],
+        'hit_rate': summary['cache_hits'] / lookups if lookups else 0.0
+    }
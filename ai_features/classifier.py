@@ -0,0 +1,58 @@
+from io import BytesIO
+import numpy as np
+from PIL import Image
+
+# Local screenshot check that routes rendered receipts to the Tesseract tier.
+# There is no local non-receipt skip: on held-out images (evaluate_classifier.py)
+# no colour-statistics model caught a non-receipt without also dropping receipts.
+
+# Long edge of the thumbnail the features are measured on
+THUMBNAIL_SIZE = 256
+
+# Rendered receipts use a handful of flat colours; camera photos of paper or screens use many more
+SCREENSHOT_MAX_COLOURS = 10
+
+def image_features(image_data):
+    """Cheap colour statistics of an image; receipts are mostly plain paper or a flat app background"""
+    image = Image.open(BytesIO(image_data))
+    image.draft("RGB", (THUMBNAIL_SIZE * 2, THUMBNAIL_SIZE * 2))
+    image = image.convert("RGB")
+    image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+    pixels = np.asarray(image, dtype=np.float32)
+
+    red, green, blue = pixels[..., 0], pixels[..., 1], pixels[..., 2]
+    # Hasler and Suesstrunk colourfulness, scaled to roughly 0..1
+    red_green = red - green
+    yellow_blue = 0.5 * (red + green) - blue
+    colourfulness = (np.hypot(red_green.std(), yellow_blue.std())
+                     + 0.3 * np.hypot(red_green.mean(), yellow_blue.mean())) / 100
+
+    # Colours covering at least 0.5% of the image, on a 3-bit-per-channel palette
+    levels = pixels.astype(np.int32) >> 5
+    palette = np.bincount((levels[..., 0] * 64 + levels[..., 1] * 8 + levels[..., 2]).ravel(), minlength=512)
+    colour_count = (palette > 0.005 * palette.sum()).sum() / 32
+
+    # Bright, nearly grey pixels: paper or a light receipt background
+    brightest = pixels.max(axis=2)
+    paper_fraction = ((brightest > 180) & (brightest - pixels.min(axis=2) < 40)).mean()
+
+    return {
+        'colourfulness': float(colourfulness),
+        'colour_count': float(colour_count),
+        'paper_fraction': float(paper_fraction)
+    }
+
+def looks_like_screenshot(features):
+    return features['colour_count'] * 32 <= SCREENSHOT_MAX_COLOURS
+
+def classify_image(image_data):
+    """Return {'image_type', 'features'}
+
+    image_type is 'screenshot' for a rendered image and '' when it is left
+    for Gemini to decide.
+    """
+    features = image_features(image_data)
+    return {
+        'image_type': "screenshot" if looks_like_screenshot(features) else "",
+        'features': features
+    }
@@ -0,0 +1,121 @@
+from io import BytesIO
+import numpy as np
+from PIL import Image
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+# 8x8 difference hash -> 64 bit fingerprint
+HASH_SIZE = 8
+# Re-compressed or resized copies of one receipt usually land within a few bits
+DEFAULT_MAX_DISTANCE = 10
+
+# Receipts from the same bank share a layout and often hash within a few bits
+# of each other, so every hash match is confirmed on a larger thumbnail where
+# a different amount or ID shows up as one strongly changed block.
+THUMBNAIL_SIZE = (64, 128)
+THUMBNAIL_BLOCK = 4
+MAX_BLOCK_DIFFERENCE = 9.0
+MAX_ASPECT_DIFFERENCE = 0.03
+
+def _open_grayscale(image_data, size):
+    image = Image.open(BytesIO(image_data))
+    # Let the JPEG decoder downscale while decoding instead of inflating the full photo
+    image.draft("L", (size[0] * 4, size[1] * 4))
+    return image.convert("L")
+
+def _dhash(image, hash_size=HASH_SIZE):
+    """Difference hash: compares each pixel with its right neighbour on a tiny grayscale thumbnail"""
+    pixels = np.asarray(image.resize((hash_size + 1, hash_size), Image.BILINEAR), dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+def dhash(image_data, hash_size=HASH_SIZE):
+    return _dhash(_open_grayscale(image_data, (hash_size, hash_size)), hash_size)
+
+def fingerprint(image_data):
+    """Return (dhash, aspect ratio, verification thumbnail) for an image"""
+    image = _open_grayscale(image_data, THUMBNAIL_SIZE)
+    aspect_ratio = image.width / image.height
+    thumbnail = np.asarray(image.resize(THUMBNAIL_SIZE, Image.BOX), dtype=np.uint8)
+    return _dhash(image), aspect_ratio, thumbnail
+
+def block_difference(thumbnail_a, thumbnail_b, block=THUMBNAIL_BLOCK):
+    """Largest mean absolute difference over any block of two equally sized thumbnails"""
+    diff = np.abs(thumbnail_a.astype(np.int16) - thumbnail_b.astype(np.int16))
+    height, width = diff.shape
+    blocks = diff.reshape(height // block, block, width // block, block)
+    return float(blocks.mean(axis=(1, 3)).max())
+
+def hamming_distance(hash_a, hash_b):
+    return (hash_a ^ hash_b).bit_count()
+
+class BKTree:
+    """Burkhard-Keller tree over Hamming distance, so lookups only visit branches that can match"""
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, hash_value, item):
+        self.size += 1
+        node = [hash_value, item, {}]
+        if self.root is None:
+            self.root = node
+            return
+        current = self.root
+        while True:
+            distance = hamming_distance(hash_value, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def find(self, hash_value, max_distance):
+        """Return (distance, item) pairs within max_distance, closest first"""
+        matches = []
+        if self.root is None:
+            return matches
+        candidates = [self.root]
+        while candidates:
+            node_hash, item, children = candidates.pop()
+            distance = hamming_distance(hash_value, node_hash)
+            if distance <= max_distance:
+                matches.append((distance, item))
+            # Triangle inequality: only children in [d - max, d + max] can hold matches
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    candidates.append(child)
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+class DuplicateIndex:
+    """Groups near-duplicate images; the first image seen in a group is its canonical member"""
+    def __init__(self, max_distance=DEFAULT_MAX_DISTANCE, max_block_difference=MAX_BLOCK_DIFFERENCE):
+        self.max_distance = max_distance
+        self.max_block_difference = max_block_difference
+        self.tree = BKTree()
+        self.discarded = set()
+
+    def match_or_add(self, key, image_data):
+        """Return the canonical key this image duplicates, or None after registering it as a new group"""
+        try:
+            hash_value, aspect_ratio, thumbnail = fingerprint(image_data)
+        except Exception as e:
+            print(f"Could not hash {key}, treating it as unique: {e}")
+            return None
+
+        # Hash hits are only candidates; a wrong merge would silently drop a payment
+        for _, (canonical_key, canonical_aspect, canonical_thumbnail) in self.tree.find(hash_value, self.max_distance):
+            if canonical_key in self.discarded:
+                continue
+            if abs(aspect_ratio - canonical_aspect) > MAX_ASPECT_DIFFERENCE * canonical_aspect:
+                continue
+            if block_difference(thumbnail, canonical_thumbnail) <= self.max_block_difference:
+                return canonical_key
+
+        self.tree.add(hash_value, (key, aspect_ratio, thumbnail))
+        return None
+
+    def discard(self, key):
+        """Stop matching images against key, e.g. because processing it failed"""
+        self.discarded.add(key)
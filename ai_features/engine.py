@@ -0,0 +1,159 @@
+import os
+import time
+import queue
+import threading
+from collections import deque
+import metrics
+from jobs import JobQueue, drain_job
+
+# Completions kept for the "recently finished" list; older ones only count towards the totals
+RECENT_COMPLETIONS = 10
+# How often the engine re-reads job counts, which include files finished by other workers
+PROGRESS_QUERY_SECONDS = 1.0
+# Finished engines stay attachable this long, so every session polling the job sees it finish
+FINISHED_ENGINE_SECONDS = 600
+
+class BatchEngine:
+    """Drains one job on a background thread and reports progress through an event queue
+
+    The worker thread only puts small events on the queue; snapshot() folds
+    them into counters when the UI polls, so processing never waits for the
+    browser to render. Results are not loaded here: several sessions can
+    attach to one engine, and each reads the finished job from the job queue.
+    """
+    def __init__(self, job_id, total_files, usage_tracker=None, **process_options):
+        self.job_id = job_id
+        self.total_files = total_files
+        self.usage_tracker = usage_tracker
+        self.process_options = process_options
+        # Timings are kept per job, so other sessions and earlier batches do not mix in
+        self.registry = metrics.job_metrics(job_id)
+        self.events = queue.Queue()
+        self._lock = threading.Lock()
+        self.state = "starting"
+        self.error = ""
+        self.processed = 0
+        self.failed = 0
+        self.completed_here = 0
+        self.start_time = time.time()
+        self.finished_at = None
+        self.already_processed = None
+        self.recent = deque(maxlen=RECENT_COMPLETIONS)
+        self.thread = threading.Thread(target=self._run, name=f"engine-{job_id}", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def is_alive(self):
+        return self.thread.is_alive()
+
+    def _put_progress(self, job_queue):
+        counts = job_queue.progress(self.job_id)
+        self.events.put(("progress", counts['done'] + counts['failed'], counts['failed']))
+
+    def _run(self):
+        # Own connection; the SQLite handle of the script thread is never shared
+        job_queue = JobQueue()
+        try:
+            self._put_progress(job_queue)
+            self.events.put(("state", "running"))
+            last_query = time.time()
+            for outcome in drain_job(job_queue, job_id=self.job_id, metrics_registry=self.registry,
+                                     usage_tracker=self.usage_tracker, **self.process_options):
+                if not outcome['skipped_budget']:
+                    self.events.put(("done", os.path.basename(outcome['name']), outcome['result'] is not None))
+                if time.time() - last_query >= PROGRESS_QUERY_SECONDS:
+                    last_query = time.time()
+                    self._put_progress(job_queue)
+
+            # Other workers may still hold the last few tasks of this job; after a budget stop the rest stays pending
+            budget_reached = self.usage_tracker is not None and self.usage_tracker.budget_exceeded()
+            while not budget_reached and not job_queue.is_finished(self.job_id):
+                self.events.put(("state", "waiting"))
+                self._put_progress(job_queue)
+                time.sleep(PROGRESS_QUERY_SECONDS)
+            self._put_progress(job_queue)
+            self.events.put(("finished",))
+        except Exception as e:
+            print(f"Engine for job {self.job_id} failed: {e}")
+            self.events.put(("failed", str(e)))
+        finally:
+            job_queue.close()
+            self.finished_at = time.time()
+
+    def _apply_events(self):
+        while True:
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                return
+            kind = event[0]
+            if kind == "done":
+                self.completed_here += 1
+                self.recent.append((event[1], event[2]))
+            elif kind == "progress":
+                self.processed, self.failed = event[1], event[2]
+                if self.already_processed is None:
+                    self.already_processed = self.processed
+            elif kind == "state":
+                self.state = event[1]
+            elif kind == "finished":
+                self.state = "finished"
+            elif kind == "failed":
+                self.state = "failed"
+                self.error = event[1]
+
+    def snapshot(self):
+        """Compact progress view: counts, rate, ETA and the last few completions"""
+        with self._lock:
+            self._apply_events()
+            # Job counts are re-read about once a second; files finished here since then are added on top
+            processed = min(self.total_files, max(self.processed, (self.already_processed or 0) + self.completed_here))
+            elapsed = time.time() - self.start_time
+            done_here = processed - (self.already_processed or 0)
+            rate = done_here / elapsed if elapsed > 0 and done_here > 0 else 0.0
+            remaining = max(0, self.total_files - processed)
+            return {
+                'job_id': self.job_id,
+                'state': self.state,
+                'total': self.total_files,
+                'processed': processed,
+                'failed': self.failed,
+                'rate': rate,
+                'eta': remaining / rate if rate else None,
+                'elapsed': elapsed,
+                'recent': list(reversed(self.recent)),
+                'error': self.error
+            }
+
+# job_id -> running or finished engine, so a rerun or a resume attaches instead of starting a second one
+_engines = {}
+_engines_lock = threading.Lock()
+
+def _prune_engines():
+    now = time.time()
+    for job_id, engine in list(_engines.items()):
+        if engine.finished_at is not None and now - engine.finished_at > FINISHED_ENGINE_SECONDS:
+            del _engines[job_id]
+
+def start_engine(job_id, total_files, usage_tracker=None, **process_options):
+    """Return the live engine of job_id, starting a new one if there is none"""
+    with _engines_lock:
+        _prune_engines()
+        engine = _engines.get(job_id)
+        if engine is None or not engine.is_alive():
+            engine = BatchEngine(job_id, total_files, usage_tracker=usage_tracker, **process_options)
+            _engines[job_id] = engine.start()
+        return engine
+
+def get_engine(job_id):
+    with _engines_lock:
+        return _engines.get(job_id)
+
+def forget_engine(job_id):
+    """Drop a stopped engine, e.g. after a failure was shown; finished ones are pruned after FINISHED_ENGINE_SECONDS"""
+    with _engines_lock:
+        engine = _engines.get(job_id)
+        if engine is not None and not engine.is_alive():
+            del _engines[job_id]
@@ -0,0 +1,152 @@
+import os
+import csv
+import time
+import argparse
+import numpy as np
+from ingest import iter_input_paths
+from dedup import IMAGE_EXTENSIONS
+from classifier import classify_image
+
+DEFAULT_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "invoice_data")
+
+# Images under invoice_data/ that are not receipts; every other image is one.
+# The other fake_non_TRK samples are receipts that do not belong to TRKBIT, which is Gemini's call.
+NON_RECEIPTS = {
+    "fake_non_TRK/123.jpg",
+    "fake_non_TRK/Screenshot-nonreceipt2.png",
+    "fake_non_TRK/replay-non-receipt.png",
+    "fake_non_TRK/replay-nonreceipt.jpeg",
+    "fake_non_TRK/screenshot-non-receipt3.jpg"
+}
+
+# Rendered app screenshots, which classify_image should route to local OCR
+SCREENSHOT_DIR = "screenshots/"
+
+SWEEP_THRESHOLDS = (0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9)
+# A lost receipt costs more than a wasted call
+RECEIPT_WEIGHT = 3.0
+# Below this held-out recall a non-receipt skip saves too few calls to pay for itself
+MIN_USEFUL_RECALL = 0.5
+
+def load_labels(path):
+    """Read a CSV of relative_path,label[,screenshot] rows where label is 'receipt' or 'others'
+
+    Returns {relative_path: (is_non_receipt, is_screenshot)}.
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        return {
+            row[0]: (row[1].strip() == "others", len(row) > 2 and row[2].strip() == "screenshot")
+            for row in csv.reader(f) if row
+        }
+
+def score_images(data_dir, labels=None):
+    """Return (relative_path, is_non_receipt, is_screenshot, detected, milliseconds, features) for every image in data_dir"""
+    scores = []
+    for name, data in iter_input_paths([data_dir]):
+        # Archive members duplicate the loose files
+        if not name.lower().endswith(IMAGE_EXTENSIONS) or ".zip/" in name or ".7z/" in name:
+            continue
+        relative_path = os.path.relpath(name, data_dir).replace(os.sep, "/")
+        start_time = time.perf_counter()
+        classification = classify_image(data)
+        milliseconds = (time.perf_counter() - start_time) * 1000
+        if labels is not None:
+            is_non_receipt, is_screenshot = labels.get(relative_path, (False, False))
+        else:
+            is_non_receipt, is_screenshot = relative_path in NON_RECEIPTS, relative_path.startswith(SCREENSHOT_DIR)
+        detected = classification['image_type'] == "screenshot"
+        scores.append((relative_path, is_non_receipt, is_screenshot, detected, milliseconds, classification['features']))
+    return scores
+
+def fit_weights(features, labels, iterations=20000, learning_rate=5.0, l2=0.001):
+    """Weighted logistic regression by gradient descent; returns (weights by feature, bias)"""
+    names = sorted(features[0])
+    x = np.array([[row[name] for name in names] for row in features])
+    y = np.array(labels, dtype=float)
+    sample_weight = np.where(y == 1, 1.0, RECEIPT_WEIGHT)
+    sample_weight /= sample_weight.sum()
+    weights = np.zeros(len(names))
+    bias = 0.0
+    for _ in range(iterations):
+        error = (1 / (1 + np.exp(-(x @ weights + bias))) - y) * sample_weight
+        weights -= learning_rate * (x.T @ error + l2 * weights)
+        bias -= learning_rate * error.sum()
+    return dict(zip(names, weights.tolist())), float(bias)
+
+def held_out_scores(scores):
+    """Leave-one-out non-receipt confidences as (relative_path, is_non_receipt, confidence)
+
+    Each image is scored by weights fitted on all the others, which shows
+    whether the features could support a local non-receipt skip at all.
+    """
+    held_out = []
+    for index, (relative_path, label, *_, features) in enumerate(scores):
+        rest = scores[:index] + scores[index + 1:]
+        weights, bias = fit_weights([score[-1] for score in rest], [score[1] for score in rest])
+        logit = bias + sum(weight * features[name] for name, weight in weights.items())
+        held_out.append((relative_path, label, 1 / (1 + np.exp(-logit))))
+    return held_out
+
+def choose_threshold(scores, thresholds=SWEEP_THRESHOLDS):
+    """Lowest threshold that skips no receipt, with its (precision, recall, receipts skipped)"""
+    for threshold in sorted(thresholds):
+        precision, recall, lost = precision_recall(scores, threshold)
+        if lost == 0:
+            return threshold, (precision, recall, lost)
+    return None, None
+
+def precision_recall(scores, threshold):
+    """Precision and recall of the 'others' decision, plus the number of receipts it would drop
+
+    Precision is None when nothing reaches the threshold.
+    """
+    true_positives = sum(1 for _, label, confidence in scores if label and confidence >= threshold)
+    false_positives = sum(1 for _, label, confidence in scores if not label and confidence >= threshold)
+    false_negatives = sum(1 for _, label, confidence in scores if label and confidence < threshold)
+    precision = true_positives / (true_positives + false_positives) if true_positives + false_positives else None
+    recall = true_positives / (true_positives + false_negatives) if true_positives + false_negatives else 0.0
+    return precision, recall, false_positives
+
+def _format_precision(precision):
+    return "n/a" if precision is None else f"{precision:.2f}"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure local screenshot detection and whether a non-receipt skip could work.")
+    parser.add_argument("data_dir", nargs="?", default=DEFAULT_DATA_DIR)
+    parser.add_argument("--labels", help="CSV of relative_path,label[,screenshot] (receipt/others); defaults to the invoice_data labels")
+    parser.add_argument("--verbose", "-v", action="store_true", help="List every image with its labels and held-out confidence")
+    args = parser.parse_args()
+
+    scores = score_images(args.data_dir, load_labels(args.labels) if args.labels else None)
+    if not scores:
+        raise SystemExit(f"No images found in {args.data_dir}")
+    # Every non-receipt number below comes from images the weights were not fitted on
+    held_out = held_out_scores(scores)
+
+    if args.verbose:
+        for (relative_path, label, is_screenshot, detected, milliseconds, _), (_, _, confidence) in sorted(
+                zip(scores, held_out), key=lambda pair: -pair[1][2]):
+            print(f"{confidence:.3f}  {'others ' if label else 'receipt'}  "
+                  f"{'screenshot' if is_screenshot else '          '}  {'detected' if detected else '        '}  "
+                  f"{milliseconds:5.1f}ms  {relative_path}")
+        print()
+
+    non_receipts = sum(1 for score in scores if score[1])
+    print(f"Images: {len(scores)} ({non_receipts} non-receipts) | "
+          f"mean {sum(score[4] for score in scores) / len(scores):.1f}ms per image")
+
+    screenshots = sum(1 for score in scores if score[2])
+    detected = sum(1 for score in scores if score[2] and score[3])
+    false_alarms = sum(1 for score in scores if not score[2] and score[3])
+    print(f"Screenshots detected: {detected}/{screenshots} | other images sent to local OCR: {false_alarms}")
+
+    print("\nNon-receipt skip, held out (leave-one-out):\nthreshold  precision  recall  receipts skipped")
+    for threshold in SWEEP_THRESHOLDS:
+        precision, recall, lost = precision_recall(held_out, threshold)
+        print(f"{threshold:9.2f}  {_format_precision(precision):>9}  {recall:6.2f}  {lost:16d}")
+
+    threshold, chosen = choose_threshold(held_out)
+    if threshold is None or chosen[1] < MIN_USEFUL_RECALL:
+        print(f"\nNo threshold skips non-receipts with held-out recall >= {MIN_USEFUL_RECALL:.2f} without losing receipts")
+    else:
+        print(f"\nA skip could work at {threshold:.2f} (held-out precision {_format_precision(chosen[0])} | recall {chosen[1]:.2f})")
@@ -0,0 +1,59 @@
+import threading
+from io import BytesIO
+from openpyxl import Workbook
+
+# Rows handed to the XLSX writer at a time, so the DataFrame is never copied whole into Python objects
+XLSX_CHUNK_ROWS = 5000
+
+def to_xlsx_bytes(df, sheet_name="Results"):
+    """Write df with openpyxl's write-only mode, which streams rows instead of keeping a cell grid in memory"""
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(sheet_name)
+    sheet.append([str(column) for column in df.columns])
+    for start in range(0, len(df), XLSX_CHUNK_ROWS):
+        chunk = df.iloc[start:start + XLSX_CHUNK_ROWS]
+        # openpyxl would store NaN as a number; None leaves the cell empty
+        chunk = chunk.astype(object).where(chunk.notna(), None)
+        for row in chunk.itertuples(index=False, name=None):
+            sheet.append(row)
+    buffer = BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+def to_csv_bytes(df):
+    # utf-8-sig so Excel opens accented names correctly when the CSV is double-clicked
+    return df.to_csv(index=False).encode("utf-8-sig")
+
+def to_parquet_bytes(df):
+    buffer = BytesIO()
+    df.to_parquet(buffer, index=False)
+    return buffer.getvalue()
+
+# format -> (button label, file extension, MIME type, writer)
+EXPORT_FORMATS = {
+    'xlsx': ("📥 Download Excel", "xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", to_xlsx_bytes),
+    'csv': ("📄 Download CSV", "csv", "text/csv", to_csv_bytes),
+    'parquet': ("🧱 Download Parquet", "parquet", "application/vnd.apache.parquet", to_parquet_bytes)
+}
+
+class ExportCache:
+    """Built exports keyed by (results version, filter, format); a new results version drops the old ones"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version = None
+        self.exports = {}
+
+    def get(self, version, selected_filter, export_format, build_frame):
+        """Return the export bytes, building them from build_frame() only on the first request"""
+        key = (selected_filter, export_format)
+        with self._lock:
+            if version != self.version:
+                self.version = version
+                self.exports = {}
+            data = self.exports.get(key)
+        if data is None:
+            data = EXPORT_FORMATS[export_format][3](build_frame())
+            with self._lock:
+                if version == self.version:
+                    self.exports[key] = data
+        return data
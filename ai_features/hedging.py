@@ -0,0 +1,109 @@
+import os
+import time
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from metrics import Histogram
+
+# Per-request deadline passed to generate_content; a timed out call is retried by the scheduler
+REQUEST_DEADLINE_SECONDS = float(os.environ.get("GEMINI_TIMEOUT", 60))
+# Fire a duplicate once a request is slower than this quantile of observed latencies
+HEDGE_QUANTILE = 0.95
+# Never hedge more than this share of requests, since both copies are billed
+MAX_HEDGE_FRACTION = 0.1
+# Latencies needed before the threshold is trusted
+MIN_HEDGE_SAMPLES = 20
+
+class HedgedCaller:
+    """Runs one request attempt with an optional hedge: a duplicate fired once the first is slower than p95
+
+    Called inside the scheduler's slot, so latencies only cover the request
+    itself, not queueing or retry backoff, and a retry is hedged afresh.
+    """
+    def __init__(self, enabled=True, quantile=HEDGE_QUANTILE, max_hedge_fraction=MAX_HEDGE_FRACTION):
+        self.enabled = enabled
+        self.quantile = quantile
+        self.max_hedge_fraction = max_hedge_fraction
+        self.histogram = Histogram(min_seconds=0.05, growth=1.25)
+        # Requests only wait on the network here; a hedge shares the slot of the request it copies
+        self._executor = ThreadPoolExecutor(max_workers=128, thread_name_prefix="gemini-request")
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def hedge_threshold(self):
+        if not self.enabled or self.histogram.count < MIN_HEDGE_SAMPLES:
+            return None
+        return self.histogram.quantile(self.quantile)
+
+    def _may_hedge(self):
+        with self._lock:
+            if self.hedged + 1 > self.max_hedge_fraction * self.requests:
+                return False
+            self.hedged += 1
+            return True
+
+    def call(self, request, on_discarded=None):
+        """Return the first successful response of request(); raises the last error if every copy fails
+
+        The slower copy is billed too: on_discarded(response) is called with
+        its response when it succeeds after the winner was returned.
+        """
+        with self._lock:
+            self.requests += 1
+        start_time = time.monotonic()
+
+        threshold = self.hedge_threshold()
+        if threshold is None:
+            response = request()
+            self.histogram.observe(time.monotonic() - start_time)
+            return response
+
+        # Each copy runs in the caller's context so its metrics land in the right job
+        context = contextvars.copy_context()
+        primary = self._executor.submit(context.copy().run, request)
+        futures = {primary}
+        done, _ = wait(futures, timeout=threshold)
+        if not done and self._may_hedge():
+            futures.add(self._executor.submit(context.copy().run, request))
+
+        last_error = None
+        while futures:
+            done, futures = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    last_error = future.exception()
+                    continue
+                # The slower copy keeps running in the background; only its usage is kept
+                self.histogram.observe(time.monotonic() - start_time)
+                if future is not primary:
+                    with self._lock:
+                        self.hedge_wins += 1
+                if on_discarded is not None:
+                    for loser in (done | futures) - {future}:
+                        loser.add_done_callback(lambda loser: self._discard(loser, context, on_discarded))
+                return future.result()
+        raise last_error
+
+    @staticmethod
+    def _discard(future, context, on_discarded):
+        if future.exception() is None:
+            try:
+                context.copy().run(on_discarded, future.result())
+            except Exception as e:
+                print(f"Could not record the discarded hedge response: {e}")
+
+    def get_summary(self):
+        summary = self.histogram.get_summary()
+        with self._lock:
+            summary.update({
+                'requests': self.requests,
+                'hedged': self.hedged,
+                'hedge_wins': self.hedge_wins,
+                'hedge_threshold': self.hedge_threshold()
+            })
+        return summary
+
+# Global instance, shared like the scheduler so the latency picture covers every batch
+hedged_caller = HedgedCaller()
@@ -0,0 +1,177 @@
+import os
+import glob
+import queue
+import zipfile
+import threading
+from io import BytesIO
+
+from video import VIDEO_EXTENSIONS
+
+SUPPORTED_EXTENSIONS = (".jpg", ".jpeg", ".png", ".pdf", *VIDEO_EXTENSIONS)
+ARCHIVE_EXTENSIONS = (".zip", ".7z")
+
+# Decoded 7z members waiting for the consumer; bounds memory on huge archives
+ARCHIVE_QUEUE_SIZE = 8
+
+def is_supported(name):
+    basename = os.path.basename(name)
+    # macOS adds "._name" resource forks next to every file it zips
+    if basename.startswith("._") or "__MACOSX/" in name:
+        return False
+    return name.lower().endswith(SUPPORTED_EXTENSIONS)
+
+def is_archive(name):
+    return name.lower().endswith(ARCHIVE_EXTENSIONS)
+
+def iter_zip_members(source, archive_name):
+    """Yield (name, data) for supported ZIP members, reading one member at a time"""
+    with zipfile.ZipFile(source) as zip_ref:
+        for info in zip_ref.infolist():
+            if info.is_dir() or not is_supported(info.filename):
+                continue
+            with zip_ref.open(info) as member:
+                yield f"{archive_name}/{info.filename}", member.read()
+
+def iter_7z_members(source, archive_name):
+    """Yield (name, data) for supported 7z members as the decoder produces them
+
+    py7zr pushes members into writer objects, so decoding runs on a helper
+    thread that hands finished members over through a bounded queue.
+    """
+    try:
+        import py7zr
+        from py7zr.io import WriterFactory, Py7zIO
+    except ImportError:
+        raise ImportError("Reading .7z archives needs py7zr>=0.22 (pip install py7zr)")
+
+    members = queue.Queue(maxsize=ARCHIVE_QUEUE_SIZE)
+    stop = threading.Event()
+    done = object()
+
+    def hand_over(entry):
+        while not stop.is_set():
+            try:
+                members.put(entry, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+        raise InterruptedError("archive reader was closed")
+
+    class MemberWriter(Py7zIO):
+        def __init__(self, filename, keep):
+            self.filename = filename
+            self.keep = keep
+            self.buffer = BytesIO()
+
+        def write(self, s):
+            return self.buffer.write(s) if self.keep else len(s)
+
+        def read(self, size=None):
+            return self.buffer.read(size)
+
+        def seek(self, offset, whence=0):
+            return self.buffer.seek(offset, whence)
+
+        def flush(self):
+            pass
+
+        def size(self):
+            return self.buffer.getbuffer().nbytes
+
+    class QueueFactory(WriterFactory):
+        # A member is complete once the decoder asks for the next writer
+        def __init__(self):
+            self.current = None
+
+        def create(self, filename):
+            self.finish()
+            self.current = MemberWriter(filename, is_supported(filename))
+            return self.current
+
+        def finish(self):
+            if self.current is not None and self.current.keep:
+                hand_over((f"{archive_name}/{self.current.filename}", self.current.buffer.getvalue()))
+            self.current = None
+
+    def decode():
+        try:
+            factory = QueueFactory()
+            with py7zr.SevenZipFile(source, mode="r") as archive:
+                archive.extractall(factory=factory)
+            factory.finish()
+            hand_over(done)
+        except InterruptedError:
+            pass
+        except Exception as e:
+            if not stop.is_set():
+                hand_over(e)
+
+    reader = threading.Thread(target=decode, daemon=True)
+    reader.start()
+    try:
+        while True:
+            entry = members.get()
+            if entry is done:
+                break
+            if isinstance(entry, Exception):
+                raise entry
+            yield entry
+    finally:
+        stop.set()
+
+def iter_archive_members(source, archive_name):
+    if archive_name.lower().endswith(".7z"):
+        return iter_7z_members(source, archive_name)
+    return iter_zip_members(source, archive_name)
+
+def iter_uploaded_files(uploaded_files):
+    """Yield (name, data) work items from Streamlit uploads, streaming archive members lazily"""
+    for uploaded_file in uploaded_files:
+        if is_archive(uploaded_file.name):
+            uploaded_file.seek(0)
+            yield from iter_archive_members(uploaded_file, uploaded_file.name)
+        elif is_supported(uploaded_file.name):
+            yield uploaded_file.name, uploaded_file.getvalue()
+
+def iter_input_paths(inputs):
+    """Yield (name, data) work items from files, directories, glob patterns and archives on disk"""
+    for pattern in inputs:
+        if glob.has_magic(pattern):
+            paths = sorted(glob.glob(pattern, recursive=True))
+        else:
+            paths = [pattern]
+
+        for path in paths:
+            if os.path.isdir(path):
+                for root, dirs, files in os.walk(path):
+                    dirs.sort()
+                    for file in sorted(files):
+                        yield from _iter_disk_file(os.path.join(root, file))
+            else:
+                yield from _iter_disk_file(path)
+
+def _iter_disk_file(path):
+    if is_archive(path):
+        yield from iter_archive_members(path, path)
+    elif is_supported(path):
+        with open(path, "rb") as f:
+            yield path, f.read()
+
+def count_uploaded_files(uploaded_files, on_unsupported=None):
+    """Count supported files from upload names and archive listings, without decoding any member"""
+    total = 0
+    for uploaded_file in uploaded_files:
+        if uploaded_file.name.lower().endswith(".zip"):
+            uploaded_file.seek(0)
+            with zipfile.ZipFile(uploaded_file) as zip_ref:
+                total += sum(1 for info in zip_ref.infolist() if not info.is_dir() and is_supported(info.filename))
+        elif uploaded_file.name.lower().endswith(".7z"):
+            import py7zr
+            uploaded_file.seek(0)
+            with py7zr.SevenZipFile(uploaded_file, mode="r") as archive:
+                total += sum(1 for info in archive.list() if not info.is_directory and is_supported(info.filename))
+        elif is_supported(uploaded_file.name):
+            total += 1
+        elif on_unsupported is not None:
+            on_unsupported(uploaded_file.name)
+    return total
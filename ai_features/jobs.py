@@ -0,0 +1,382 @@
+import os
+import sys
+import time
+import uuid
+import socket
+import sqlite3
+import hashlib
+import argparse
+import multiprocessing
+import metrics
+
+DEFAULT_JOBS_PATH = os.environ.get(
+    "JOBS_DB_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "jobs.sqlite")
+)
+# A task stuck in 'running' longer than this belongs to a dead worker and is handed out again
+DEFAULT_LEASE_SECONDS = 600
+DEFAULT_MAX_ATTEMPTS = 3
+# Finished jobs older than this are deleted by `jobs.py purge`
+DEFAULT_RETENTION_DAYS = 30
+# Tasks claimed per round trip; each claim is processed as one process_files() run
+DEFAULT_CLAIM_SIZE = 16
+INSERT_CHUNK_SIZE = 100
+
+TASK_STATES = ("pending", "running", "done", "failed")
+
+class JobQueue:
+    """Durable job table shared by any number of worker processes on one host through one SQLite file
+
+    WAL mode needs shared memory, so the file must not be shared over a network filesystem.
+    """
+    def __init__(self, path=DEFAULT_JOBS_PATH, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Autocommit mode; transactions are opened explicitly where atomicity matters
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA busy_timeout=60000")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                created_at REAL NOT NULL,
+                total INTEGER NOT NULL DEFAULT 0,
+                sealed INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id TEXT NOT NULL REFERENCES jobs (id),
+                seq INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                data BLOB NOT NULL,
+                content_hash TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                worker TEXT,
+                claimed_at REAL,
+                finished_at REAL,
+                duration REAL,
+                duplicate_of TEXT NOT NULL DEFAULT '',
+                result TEXT,
+                error TEXT NOT NULL DEFAULT ''
+            );
+            CREATE INDEX IF NOT EXISTS idx_tasks_job_state ON tasks (job_id, state);
+            CREATE INDEX IF NOT EXISTS idx_tasks_state_claimed ON tasks (state, claimed_at);
+        """)
+
+    def close(self):
+        self.conn.close()
+
+    def create_job(self, items=None, job_id=None):
+        """Create a job and return its ID; when items are given they are added and the job is sealed"""
+        job_id = job_id or uuid.uuid4().hex[:12]
+        self.conn.execute("INSERT INTO jobs (id, created_at) VALUES (?, ?)", (job_id, time.time()))
+        if items is not None:
+            self.add_tasks(job_id, items, seal=True)
+        return job_id
+
+    def add_tasks(self, job_id, items, seal=True):
+        """Store (name, data) items as pending tasks of a job
+
+        Items are inserted in chunks, so workers can start on the first ones
+        while a lazy source is still being read.
+        """
+        seq = self.conn.execute("SELECT total FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+        chunk = []
+        for name, data in items:
+            chunk.append((job_id, seq, name, data, hashlib.sha256(data).hexdigest()))
+            seq += 1
+            if len(chunk) >= INSERT_CHUNK_SIZE:
+                self._insert_tasks(job_id, chunk, seq)
+                chunk = []
+        self._insert_tasks(job_id, chunk, seq)
+        if seal:
+            self.seal(job_id)
+
+    def seal(self, job_id):
+        """Mark that no more tasks will be added, so workers stop waiting for new ones"""
+        self.conn.execute("UPDATE jobs SET sealed = 1 WHERE id = ?", (job_id,))
+
+    def is_sealed(self, job_id):
+        row = self.conn.execute("SELECT sealed FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row is None or bool(row[0])
+
+    def _insert_tasks(self, job_id, rows, total):
+        self.conn.execute("BEGIN")
+        self.conn.executemany(
+            "INSERT INTO tasks (job_id, seq, name, data, content_hash) VALUES (?, ?, ?, ?, ?)", rows
+        )
+        self.conn.execute("UPDATE jobs SET total = ? WHERE id = ?", (total, job_id))
+        self.conn.execute("COMMIT")
+
+    def job_exists(self, job_id):
+        return self.conn.execute("SELECT 1 FROM jobs WHERE id = ?", (job_id,)).fetchone() is not None
+
+    def claim(self, worker_id, job_id=None, limit=DEFAULT_CLAIM_SIZE):
+        """Atomically move up to limit claimable tasks to 'running' and return (task_id, name, data) rows"""
+        now = time.time()
+        job_filter = "AND job_id = ?" if job_id else ""
+        params = [now - self.lease_seconds, self.max_attempts] + ([job_id] if job_id else []) + [limit]
+
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers can never pick the same rows
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Tasks whose worker died on the last attempt would otherwise stay 'running' forever
+            self.conn.execute(
+                "UPDATE tasks SET state = 'failed', error = 'Worker stopped responding', data = x''"
+                " WHERE state = 'running' AND claimed_at < ? AND attempts >= ?",
+                (now - self.lease_seconds, self.max_attempts)
+            )
+            rows = self.conn.execute(
+                f"SELECT id, name, data FROM tasks"
+                f" WHERE (state = 'pending' OR (state = 'running' AND claimed_at < ?))"
+                f" AND attempts < ? {job_filter}"
+                f" ORDER BY job_id, seq LIMIT ?",
+                params
+            ).fetchall()
+            self.conn.executemany(
+                "UPDATE tasks SET state = 'running', worker = ?, claimed_at = ?, attempts = attempts + 1 WHERE id = ?",
+                [(worker_id, now, row[0]) for row in rows]
+            )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return rows
+
+    def complete(self, task_id, result, duration=0.0, duplicate_of="", error=""):
+        """Record a task outcome; failures go back to 'pending' until they run out of attempts
+
+        The file bytes are only needed to process the task, so they are
+        dropped once it is done or has failed for good.
+        """
+        if result is not None:
+            self.conn.execute(
+                "UPDATE tasks SET state = 'done', result = ?, error = '', duration = ?, duplicate_of = ?,"
+                " finished_at = ?, data = x'' WHERE id = ?",
+                (result, duration, duplicate_of, time.time(), task_id)
+            )
+        else:
+            self.conn.execute(
+                "UPDATE tasks SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,"
+                " data = CASE WHEN attempts >= ? THEN x'' ELSE data END,"
+                " error = ?, duration = ?, duplicate_of = ?, finished_at = ? WHERE id = ?",
+                (self.max_attempts, self.max_attempts, error or "Processing failed", duration, duplicate_of, time.time(), task_id)
+            )
+
+    def release(self, task_ids):
+        """Hand claimed tasks that were never started back to 'pending' without using up an attempt"""
+        self.conn.executemany(
+            "UPDATE tasks SET state = 'pending', worker = NULL, attempts = attempts - 1 WHERE id = ? AND state = 'running'",
+            [(task_id,) for task_id in task_ids]
+        )
+
+    def purge(self, older_than_days=DEFAULT_RETENTION_DAYS):
+        """Delete jobs created more than older_than_days ago that have no pending or running task; returns how many"""
+        cutoff = time.time() - older_than_days * 24 * 3600
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            job_ids = [row[0] for row in self.conn.execute(
+                "SELECT id FROM jobs WHERE created_at < ? AND sealed = 1 AND NOT EXISTS"
+                " (SELECT 1 FROM tasks WHERE tasks.job_id = jobs.id AND state IN ('pending', 'running'))",
+                (cutoff,)
+            )]
+            self.conn.executemany("DELETE FROM tasks WHERE job_id = ?", [(job_id,) for job_id in job_ids])
+            self.conn.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in job_ids])
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return len(job_ids)
+
+    def progress(self, job_id):
+        """Return {'total', 'pending', 'running', 'done', 'failed'} counts for a job"""
+        counts = dict.fromkeys(TASK_STATES, 0)
+        for state, count in self.conn.execute(
+            "SELECT state, COUNT(*) FROM tasks WHERE job_id = ? GROUP BY state", (job_id,)
+        ):
+            counts[state] = count
+        counts['total'] = sum(counts[state] for state in TASK_STATES)
+        return counts
+
+    def is_finished(self, job_id):
+        counts = self.progress(job_id)
+        return counts['pending'] == 0 and counts['running'] == 0
+
+    def results(self, job_id):
+        """Return finished tasks of a job in upload order as dicts"""
+        rows = self.conn.execute(
+            "SELECT seq, name, state, result, error, duplicate_of, duration FROM tasks"
+            " WHERE job_id = ? AND state IN ('done', 'failed') ORDER BY seq",
+            (job_id,)
+        ).fetchall()
+        return [
+            {
+                'seq': seq,
+                'name': name,
+                'state': state,
+                'result': result,
+                'error': error,
+                'duplicate_of': duplicate_of,
+                'duration': duration
+            }
+            for seq, name, state, result, error, duplicate_of, duration in rows
+        ]
+
+def make_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+def drain_job(queue, job_id=None, worker_id=None, claim_size=DEFAULT_CLAIM_SIZE, poll_interval=0.5, **process_options):
+    """Claim and process tasks until none are left, yielding each outcome once it is stored
+
+    process_options are passed to process_files (max_workers, use_cache,
+    dedupe, batch_size, use_local_ocr). Several processes can
+    drain the same job at once. When job_id is given, the worker also waits
+    for tasks that are still being added until the job is sealed, and stage
+    timings are kept in that job's metrics registry. When the usage_tracker
+    budget is reached, claimed tasks that were not started are released
+    and draining stops; the job can be resumed later.
+    """
+    # Imported here so submitting or inspecting jobs does not load the Gemini client
+    from main import process_files
+
+    worker_id = worker_id or make_worker_id()
+    if job_id:
+        process_options.setdefault('metrics_registry', metrics.job_metrics(job_id))
+    usage_tracker = process_options.get('usage_tracker')
+    try:
+        while True:
+            task_ids = []
+            claimed_ids = []
+
+            def claimed_items():
+                # Claimed lazily, so the pool stays busy across claim boundaries
+                while True:
+                    rows = queue.claim(worker_id, job_id=job_id, limit=claim_size)
+                    if not rows:
+                        if job_id and not queue.is_sealed(job_id):
+                            time.sleep(poll_interval)
+                            continue
+                        return
+                    if any(row[0] in claimed_ids for row in rows):
+                        # A task that failed earlier in this run is up again; retry it in a fresh run,
+                        # whose dedupe index has never seen it
+                        queue.release([row[0] for row in rows])
+                        return
+                    claimed_ids.extend(row[0] for row in rows)
+                    for task_id, name, data in rows:
+                        task_ids.append(task_id)
+                        yield name, data
+
+            for outcome in process_files(claimed_items(), **process_options):
+                if outcome['skipped_budget']:
+                    # Never sent, so it goes back without using up an attempt
+                    queue.release([task_ids[outcome['index']]])
+                    yield outcome
+                    continue
+                queue.complete(
+                    task_ids[outcome['index']],
+                    outcome['result'],
+                    duration=outcome['duration'],
+                    duplicate_of=outcome['duplicate_of']
+                )
+                yield outcome
+
+            if usage_tracker is not None and usage_tracker.budget_exceeded():
+                queue.release(set(claimed_ids) - set(task_ids))
+                return
+            # Failed tasks may have gone back to 'pending' for another attempt
+            if not task_ids:
+                return
+    finally:
+        # Keeps the registry for the timing panel, but lets old finished jobs be dropped
+        if job_id:
+            metrics.finish_job_metrics(job_id)
+
+def run_worker(path=DEFAULT_JOBS_PATH, job_id=None, trace=None, metrics_port=None, max_cost=None, max_tokens=None, **process_options):
+    # Each worker process appends its own spans; lines are written whole, so processes can share one file
+    if trace:
+        metrics.enable_trace(trace)
+    if metrics_port:
+        metrics.start_metrics_server(metrics_port)
+    from utils import TokenTracker
+
+    # The budget is per worker process; each one stops dispatching once its own share is spent
+    usage_tracker = TokenTracker(max_cost=max_cost, max_tokens=max_tokens)
+    queue = JobQueue(path)
+    processed = 0
+    for outcome in drain_job(queue, job_id=job_id, usage_tracker=usage_tracker, **process_options):
+        processed += 1
+        if outcome['skipped_budget']:
+            continue
+        status = "✅" if outcome['result'] is not None else "❌"
+        print(f"{status} {outcome['name']}")
+    queue.close()
+    usage_tracker.print_summary()
+    print(f"Worker {os.getpid()} finished after {processed} files")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Persistent OCR job queue.")
+    parser.add_argument("--db", default=DEFAULT_JOBS_PATH, help="Path of the shared jobs database")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    submit_parser = commands.add_parser("submit", help="Queue files, directories, globs or archives as a new job")
+    submit_parser.add_argument("inputs", nargs="+")
+
+    worker_parser = commands.add_parser("worker", help="Drain pending tasks")
+    worker_parser.add_argument("--job", help="Only work on this job ID")
+    worker_parser.add_argument("--processes", type=int, default=1, help="Worker processes to start on this machine")
+    worker_parser.add_argument("--workers", type=int, default=8, help="Concurrent requests per process")
+    worker_parser.add_argument("--batch-size", type=int, default=1, help="Images packed into one request")
+    worker_parser.add_argument("--no-cache", action="store_true")
+    worker_parser.add_argument("--no-local-ocr", action="store_true", help="Do not read rendered receipts with Tesseract")
+    worker_parser.add_argument("--max-cost", type=float, help="Stop once this worker process has spent this many USD")
+    worker_parser.add_argument("--max-tokens", type=int, help="Stop once this worker process has used this many tokens")
+    worker_parser.add_argument("--trace", help="Append per-stage timings to this JSON lines file")
+    worker_parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics on this port (single process only)")
+
+    status_parser = commands.add_parser("status", help="Show task counts of a job")
+    status_parser.add_argument("job")
+
+    purge_parser = commands.add_parser("purge", help="Delete old finished jobs and shrink the database file")
+    purge_parser.add_argument("--days", type=float, default=DEFAULT_RETENTION_DAYS, help="Keep jobs created within this many days")
+
+    args = parser.parse_args()
+
+    if args.command == "submit":
+        from ingest import iter_input_paths
+        queue = JobQueue(args.db)
+        job_id = queue.create_job(iter_input_paths(args.inputs))
+        print(job_id)
+    elif args.command == "status":
+        queue = JobQueue(args.db)
+        if not queue.job_exists(args.job):
+            sys.exit(f"Unknown job: {args.job}")
+        print(queue.progress(args.job))
+    elif args.command == "purge":
+        queue = JobQueue(args.db)
+        print(f"Deleted {queue.purge(args.days)} jobs")
+        # Deleted pages are only reused, not returned to the file system, until the file is rebuilt
+        queue.conn.execute("VACUUM")
+    else:
+        options = {
+            'path': args.db,
+            'job_id': args.job,
+            'max_workers': args.workers,
+            'batch_size': args.batch_size,
+            'use_cache': not args.no_cache,
+            'use_local_ocr': False if args.no_local_ocr else None,
+            'trace': args.trace,
+            'max_cost': args.max_cost,
+            'max_tokens': args.max_tokens
+        }
+        if args.processes <= 1:
+            run_worker(metrics_port=args.metrics_port, **options)
+        else:
+            processes = [multiprocessing.Process(target=run_worker, kwargs=options) for _ in range(args.processes)]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
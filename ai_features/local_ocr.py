@@ -0,0 +1,265 @@
+import re
+from io import BytesIO
+from PIL import Image
+from schema import InvoiceResult
+
+# Local Tesseract tier for machine-generated Pix receipts; needs pytesseract and the tesseract binary
+LOCAL_OCR_CONFIG = {
+    'enabled': True,
+    'languages': "por+eng",
+    # Every required field must reach this confidence, otherwise the image goes to Gemini
+    'min_confidence': 0.8,
+    # Tesseract reads small screenshots better after upscaling
+    'min_width': 1000
+}
+
+REQUIRED_FIELDS = (
+    "transaction_id",
+    "amount",
+    "invoice_date",
+    "sender.name",
+    "sender.institution",
+    "recipient.name",
+    "recipient.cnpj/cpf",
+    "recipient.institution",
+    # Feeds the suspicious-payment key and the archive index; confident when no "Chave" label is printed
+    "recipient.pix_key"
+)
+
+# End-to-end ID: "E", payer ISPB (8 digits), yyyyMMddHHmm (12 digits), 11 alphanumerics
+E2E_PATTERN = re.compile(r"E\d{8}\d{12}[A-Za-z0-9]{11}")
+AMOUNT_PATTERN = re.compile(r"R\$\s*(\d{1,3}(?:\.\d{3})*,\d{2})")
+DATE_PATTERN = re.compile(r"\b(\d{2}/\d{2}/\d{4})\b")
+TIME_PATTERN = re.compile(r"\b(\d{2})[:h](\d{2})(?::(\d{2}))?\b")
+CNPJ_PATTERN = re.compile(r"\d{2,3}\.\d{3}\.\d{3}/\d{4}-\d{2}")
+# Masked documents as banks print them, e.g. ***.327.923-** or .874/0001-
+MASKED_DOCUMENT_PATTERN = re.compile(r"(?=[\d*./-]*\*)(?=[\d*./-]*\d)[\d*./-]{6,}")
+CPF_PATTERN = re.compile(r"\d{3}\.\d{3}\.\d{3}-\d{2}")
+
+SENDER_HEADER = re.compile(r"^(de|origem|pagador|dados do pagador|quem pagou|dados de quem pagou|remetente)\b", re.IGNORECASE)
+RECIPIENT_HEADER = re.compile(
+    r"^(para|destino|destinat[aá]rio|dados do destinat[aá]rio|recebedor|quem recebeu|dados de quem recebeu|favorecido)\b",
+    re.IGNORECASE
+)
+# Label words are spelled out, so a value on the same line without a colon is never taken as part of the label
+NAME_LABEL = re.compile(r"^nome\b\s*:?\s*", re.IGNORECASE)
+INSTITUTION_LABEL = re.compile(
+    r"^institui[çc][ãa]o(?:\s+(?:financeira|de\s+origem|de\s+destino|do\s+pagador|do\s+recebedor))?\b\s*:?\s*",
+    re.IGNORECASE
+)
+PIX_KEY_LABEL = re.compile(r"^chave(?:\s+pix)?(?:\s+do\s+recebedor)?\b\s*:?\s*", re.IGNORECASE)
+AMOUNT_LABEL = re.compile(r"\bvalor\b", re.IGNORECASE)
+TRANSACTION_NUMBER_LABEL = re.compile(
+    r"^(c[óo]digo da transa[çc][ãa]o|id\s*/\s*transa[çc][ãa]o|n[º°o]\.? de controle|autentica[çc][ãa]o)\b\s*:?\s*",
+    re.IGNORECASE
+)
+# Other labels printed on their own line; never taken as the value of the label above them
+OTHER_LABEL = re.compile(
+    r"^(id da transa[çc][ãa]o|cpf|cnpj|ag[êe]ncia|conta|tipo de conta|data|valor|descri[çc][ãa]o)\s*:?\s*$",
+    re.IGNORECASE
+)
+LABEL_PATTERNS = (NAME_LABEL, INSTITUTION_LABEL, PIX_KEY_LABEL, TRANSACTION_NUMBER_LABEL)
+
+_tesseract_available = None
+
+def is_available():
+    """True when pytesseract and the tesseract binary can be used"""
+    global _tesseract_available
+    if _tesseract_available is None:
+        try:
+            import pytesseract
+            pytesseract.get_tesseract_version()
+            _tesseract_available = True
+        except Exception:
+            _tesseract_available = False
+    return _tesseract_available
+
+def ocr_lines(image_data):
+    """Run Tesseract and return [(text, confidence 0..1)] per text line, top to bottom"""
+    import pytesseract
+
+    image = Image.open(BytesIO(image_data)).convert("L")
+    if image.width < LOCAL_OCR_CONFIG['min_width']:
+        scale = LOCAL_OCR_CONFIG['min_width'] / image.width
+        image = image.resize((LOCAL_OCR_CONFIG['min_width'], round(image.height * scale)), Image.LANCZOS)
+
+    data = pytesseract.image_to_data(image, lang=LOCAL_OCR_CONFIG['languages'], output_type=pytesseract.Output.DICT)
+    lines = {}
+    for index, word in enumerate(data['text']):
+        confidence = float(data['conf'][index])
+        if not word.strip() or confidence < 0:
+            continue
+        key = (data['block_num'][index], data['par_num'][index], data['line_num'][index])
+        lines.setdefault(key, []).append((word, confidence / 100))
+    return [
+        (" ".join(word for word, _ in words), min(confidence for _, confidence in words))
+        for _, words in sorted(lines.items())
+    ]
+
+def is_valid_cnpj(cnpj):
+    digits = [int(c) for c in re.sub(r"\D", "", cnpj)][-14:]
+    if len(digits) != 14 or len(set(digits)) == 1:
+        return False
+    for length in (12, 13):
+        weights = list(range(length - 7, 1, -1)) + list(range(9, 1, -1))
+        remainder = sum(d * w for d, w in zip(digits[:length], weights)) % 11
+        if digits[length] != (0 if remainder < 2 else 11 - remainder):
+            return False
+    return True
+
+def is_valid_cpf(cpf):
+    digits = [int(c) for c in re.sub(r"\D", "", cpf)]
+    if len(digits) != 11 or len(set(digits)) == 1:
+        return False
+    for length in (9, 10):
+        remainder = sum(d * w for d, w in zip(digits[:length], range(length + 1, 1, -1))) * 10 % 11
+        if digits[length] != remainder % 10:
+            return False
+    return True
+
+def _document_confidence(document):
+    """Rule confidence of a CNPJ/CPF string: check digits must hold, masked values cannot be checked"""
+    if "*" in document:
+        return 0.9
+    if CNPJ_PATTERN.fullmatch(document):
+        return 1.0 if is_valid_cnpj(document) else 0.3
+    if CPF_PATTERN.fullmatch(document):
+        return 1.0 if is_valid_cpf(document) else 0.3
+    return 0.5
+
+def _is_label(text):
+    return bool(OTHER_LABEL.match(text)) or any(pattern.fullmatch(text.strip()) for pattern in LABEL_PATTERNS)
+
+def _labelled_value(lines, pattern, missing_confidence=0.0):
+    """Return (value, confidence) for "Label: value", "Label value" or a label line followed by its value line
+
+    The rest of the label's own line wins; the next line only counts when it
+    is not another label. Without the label at all missing_confidence is
+    returned, for fields that are legitimately absent from some receipts.
+    """
+    for index, (text, confidence) in enumerate(lines):
+        match = pattern.match(text)
+        if not match:
+            continue
+        value = text[match.end():].strip()
+        if value:
+            return value, confidence
+        if index + 1 < len(lines) and not _is_label(lines[index + 1][0]):
+            return lines[index + 1]
+        return "", 0.0
+    return "", missing_confidence
+
+def _split_sections(lines):
+    """Split lines into (sender_lines, recipient_lines) at the section headers"""
+    sections = {'sender': [], 'recipient': []}
+    current = None
+    for text, confidence in lines:
+        # Section titles often carry an icon that OCR reads as a dash or plus
+        text = text.lstrip("-–—+• ")
+        if SENDER_HEADER.match(text) and len(text) < 40:
+            current = 'sender'
+            remainder = SENDER_HEADER.sub("", text).lstrip(" :")
+        elif RECIPIENT_HEADER.match(text) and len(text) < 40:
+            current = 'recipient'
+            remainder = RECIPIENT_HEADER.sub("", text).lstrip(" :")
+        else:
+            if current:
+                sections[current].append((text, confidence))
+            continue
+        if remainder:
+            sections[current].append((remainder, confidence))
+    return sections['sender'], sections['recipient']
+
+def _party(lines, institution_cnpj=False):
+    party = {'name': ("", 0.0), 'cnpj/cpf': ("", 0.0), 'institution': ("", 0.0)}
+    name = _labelled_value(lines, NAME_LABEL)
+    # Without a "Nome" label the name is the first line of the section
+    party['name'] = name if name[0] else (lines[0] if lines else ("", 0.0))
+    for text, confidence in lines:
+        match = CNPJ_PATTERN.search(text) or CPF_PATTERN.search(text) or MASKED_DOCUMENT_PATTERN.search(text)
+        if match:
+            document = match.group(0)
+            party['cnpj/cpf'] = (document, confidence * _document_confidence(document))
+            break
+    party['institution'] = _labelled_value(lines, INSTITUTION_LABEL)
+    if institution_cnpj:
+        party['institution_cnpj'] = ("", 1.0)
+    else:
+        party['pix_key'] = _labelled_value(lines, PIX_KEY_LABEL, missing_confidence=1.0)
+    return party
+
+def extract_fields(lines):
+    """Fill the prompt_2 schema from OCR lines; returns (result, {dotted field: confidence})"""
+    fields = {}
+
+    for text, confidence in lines:
+        match = E2E_PATTERN.search(text.replace(" ", ""))
+        if match:
+            fields['transaction_id'] = (match.group(0), confidence)
+            break
+    else:
+        fields['transaction_id'] = ("", 0.0)
+
+    transaction_number = _labelled_value(lines, TRANSACTION_NUMBER_LABEL)
+    if transaction_number[0].replace(" ", "") == fields['transaction_id'][0]:
+        transaction_number = ("", 0.0)
+    fields['transaction_number'] = transaction_number
+
+    # Prefer the amount next to a "Valor" label; fees are printed with R$ too
+    amounts = []
+    for index, (text, confidence) in enumerate(lines):
+        for match in AMOUNT_PATTERN.finditer(text):
+            labelled = AMOUNT_LABEL.search(text) or (index > 0 and AMOUNT_LABEL.search(lines[index - 1][0]))
+            amounts.append((not labelled, match.group(1), confidence))
+    if amounts:
+        amounts.sort(key=lambda amount: amount[0])
+        unlabelled, amount, confidence = amounts[0]
+        distinct_amounts = len({value for _, value, _ in amounts})
+        fields['amount'] = (amount, confidence * (0.6 if unlabelled and distinct_amounts > 1 else 1.0))
+    else:
+        fields['amount'] = ("", 0.0)
+
+    fields['invoice_date'] = ("", 0.0)
+    fields['invoice_time'] = ("", 0.0)
+    for text, confidence in lines:
+        date_match = DATE_PATTERN.search(text)
+        if date_match and not fields['invoice_date'][0]:
+            fields['invoice_date'] = (date_match.group(1), confidence)
+        time_match = TIME_PATTERN.search(text)
+        if time_match and not fields['invoice_time'][0]:
+            hours, minutes, seconds = time_match.groups()
+            fields['invoice_time'] = (f"{hours}:{minutes}" + (f":{seconds}" if seconds else ""), confidence)
+
+    full_text = " ".join(text for text, _ in lines)
+    fields['payment_method'] = ("Pix" if re.search(r"\bpix\b", full_text, re.IGNORECASE) else "", 1.0)
+    fields['currency'] = ("R$" if fields['amount'][0] else "", 1.0)
+
+    sender_lines, recipient_lines = _split_sections(lines)
+    for key, value in _party(sender_lines, institution_cnpj=True).items():
+        fields[f"sender.{key}"] = value
+    for key, value in _party(recipient_lines).items():
+        fields[f"recipient.{key}"] = value
+
+    result = {
+        "transaction_id": fields['transaction_id'][0],
+        "transaction_number": fields['transaction_number'][0],
+        "payment_method": fields['payment_method'][0],
+        "invoice_date": fields['invoice_date'][0],
+        "invoice_time": fields['invoice_time'][0],
+        "amount": fields['amount'][0],
+        "currency": fields['currency'][0],
+        "sender": {key: fields[f"sender.{key}"][0] for key in ("name", "cnpj/cpf", "institution", "institution_cnpj")},
+        "recipient": {key: fields[f"recipient.{key}"][0] for key in ("name", "cnpj/cpf", "institution", "pix_key")},
+        "additional_data": "",
+        "image_type": ""
+    }
+    return result, {field: confidence for field, (_, confidence) in fields.items()}
+
+def extract_receipt(image_data, image_type="screenshot"):
+    """Read a standard Pix receipt locally; returns (result JSON, confidences) or None to escalate"""
+    lines = ocr_lines(image_data)
+    result, confidences = extract_fields(lines)
+    if min(confidences[field] for field in REQUIRED_FIELDS) < LOCAL_OCR_CONFIG['min_confidence']:
+        return None
+    result['image_type'] = image_type
+    return InvoiceResult.from_dict(result).to_json(), confidences
@@ -1,33 +1,531 @@
 import os
+import sys
+import json
+import time
 import argparse
+import contextlib
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from utils import *
+from prompts import prompt_2
+from cache import result_cache, make_cache_key
+from dedup import DuplicateIndex, IMAGE_EXTENSIONS
+from ingest import iter_input_paths, is_archive, SUPPORTED_EXTENSIONS
+from classifier import classify_image
+import local_ocr
+from schema import normalize_result, combine_results, SCHEMA_VERSION
+import video
+import pdf_pages
+import metrics
 
-def process_file(file_path):
+# Number of files sent to Gemini at the same time
+DEFAULT_MAX_WORKERS = 8
+# Images packed into one request; 1 sends every image on its own
+DEFAULT_BATCH_SIZE = 1
+
+def answer_locally(image_data, filename, use_local_ocr=True):
+    """Answer an image without Gemini when a local tier is confident; returns None when it needs Gemini
+
+    Rendered receipts are read with Tesseract when every required field is
+    read with enough confidence.
+    """
+    if not use_local_ocr or not local_ocr.is_available():
+        return None
+    try:
+        with metrics.span("classify", file=filename):
+            classification = classify_image(image_data)
+    except Exception as e:
+        print(f"Screenshot check failed for {filename}, sending to Gemini: {e}")
+        return None
+
+    if classification['image_type'] == "screenshot":
+        try:
+            with metrics.span("local_ocr", file=filename):
+                extraction = local_ocr.extract_receipt(image_data, image_type="screenshot")
+        except Exception as e:
+            print(f"Local OCR failed for {filename}, sending to Gemini: {e}")
+            extraction = None
+        if extraction is not None:
+            response, confidences = extraction
+            print(f"🏠 Read {filename} locally (lowest field confidence {min(confidences.values()):.2f})")
+            current_token_tracker().add_usage(filename, 0, 0, 0, file_size=len(image_data), file_type="image (local)")
+            metrics.inc("local_answers_total", tier="tesseract")
+            return response
+    return None
+
+def to_result(response, filename):
+    """Compact InvoiceResult JSON from a model answer, or None when it is missing or not valid JSON"""
+    cleaned_response = clean_text(response)
+    if not cleaned_response:
+        return None
+    try:
+        with metrics.span("parse", file=filename):
+            return normalize_result(cleaned_response)
+    except ValueError as e:
+        print(f"Invalid JSON from Gemini for {filename}: {e}")
+        return None
+
+def cached_result(cache_key, filename):
+    """The cached answer for cache_key normalized like a fresh one, or None on a miss or an unreadable entry"""
+    with metrics.span("cache", file=filename):
+        cached_response = result_cache.get(cache_key)
+    if cached_response is not None:
+        try:
+            cached_response = normalize_result(cached_response)
+        except ValueError as e:
+            print(f"Ignoring unreadable cache entry for {filename}: {e}")
+            cached_response = None
+    current_token_tracker().count_cache_lookup(cached_response is not None)
+    if cached_response is not None:
+        metrics.inc("cache_hits_total")
+    return cached_response
+
+def process_file(file_path, use_cache=True, use_local_ocr=None, batch_size=DEFAULT_BATCH_SIZE):
     _, file_extension = os.path.splitext(file_path)  # Fixed: removed the asterisk
+    if file_extension.lower() not in SUPPORTED_EXTENSIONS:
+        # print("Unsupported file type:", file_extension)
+        return None
+
+    with metrics.span("read", file=os.path.basename(file_path)), open(file_path, "rb") as f:
+        file_data = f.read()
+    return process_data(file_data, os.path.basename(file_path), use_cache=use_cache, use_local_ocr=use_local_ocr, batch_size=batch_size)
+
+def process_data(file_data, filename, use_cache=True, use_local_ocr=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Run OCR on an in-memory image, PDF or video; the extension of filename picks the path
+
+    batch_size is the number of video keyframes packed into one request.
+    """
+    use_local_ocr = local_ocr.LOCAL_OCR_CONFIG['enabled'] if use_local_ocr is None else use_local_ocr
+    _, file_extension = os.path.splitext(filename)
     file_extension = file_extension.lower()
-    filename = os.path.basename(file_path)
     response = None
-    
+
+    if file_extension not in SUPPORTED_EXTENSIONS:
+        return None
+    if file_extension in video.VIDEO_EXTENSIONS:
+        # Not cached as a whole: each keyframe's answer is cached on its own
+        return process_video(file_data, filename, use_cache=use_cache, use_local_ocr=use_local_ocr, batch_size=batch_size)
+    if file_extension == ".pdf":
+        try:
+            sizes = pdf_pages.page_sizes(file_data)
+        except Exception as e:
+            # Without poppler the whole PDF still goes to Gemini in one request
+            print(f"Could not read pages of {filename}, sending the whole PDF: {e}")
+            sizes = []
+        if len(sizes) > 1:
+            return process_pdf_pages(file_data, filename, sizes, use_cache=use_cache, use_local_ocr=use_local_ocr)
+
+    # Identical bytes with the same prompt, model and schema always give the same answer
+    cache_key = make_cache_key(file_data, prompt_2, MODEL_NAME, SCHEMA_VERSION)
+    if use_cache:
+        cached_response = cached_result(cache_key, filename)
+        if cached_response is not None:
+            return cached_response
+
     if file_extension in [".jpg", ".jpeg", ".png"]:
-        with open(file_path, "rb") as image_file:
-            image_data = image_file.read()
-        response = gemini_img_ocr(image_data, file_extension, filename)
-    elif file_extension == ".pdf":
-        with open(file_path, "rb") as pdf_file:
-            pdf_data = pdf_file.read()
-        response = gemini_pdf_ocr(pdf_data, filename)
+        # Not cached: local answers depend on thresholds, and the cache holds Gemini answers
+        local_response = answer_locally(file_data, filename, use_local_ocr)
+        if local_response is not None:
+            return local_response
+        response = gemini_img_ocr(file_data, file_extension, filename)
     else:
-        # print("Unsupported file type:", file_extension)
-        return None
-    
-    cleaned_response = clean_text(response)
+        response = gemini_pdf_ocr(file_data, filename)
+
+    cleaned_response = to_result(response, filename)
+    if use_cache and cleaned_response:
+        result_cache.put(cache_key, cleaned_response)
     return cleaned_response if cleaned_response is not None else None
 
+def process_video(video_data, filename, use_cache=True, use_local_ocr=None, batch_size=DEFAULT_BATCH_SIZE):
+    """OCR the distinct receipt keyframes of a video and merge them into one result
+
+    Keyframes go through the image path (cache, local tiers, then Gemini),
+    packed batch_size to a request like images in process_files, so a
+    scrolling recording costs a handful of image calls. Several receipts
+    come back as a JSON array.
+    """
+    if not video.is_available():
+        print(f"Skipping {filename}: reading videos needs OpenCV (pip install opencv-python-headless)")
+        return None
+    with metrics.span("keyframes", file=filename):
+        keyframes = video.extract_keyframes(video_data, filename)
+    print(f"🎞️ {filename}: {len(keyframes)} keyframes")
+    if not keyframes:
+        return None
+    batch_size = max(1, batch_size)
+    results = []
+    for start in range(0, len(keyframes), batch_size):
+        results.extend(process_image_batch(keyframes[start:start + batch_size], use_cache=use_cache, use_local_ocr=use_local_ocr))
+    return combine_results(results)
+
+def process_pdf_pages(pdf_data, filename, sizes, use_cache=True, use_local_ocr=None):
+    """OCR every page of a multi-page PDF through the image path and merge the receipts found
+
+    Pages are rendered lazily, each at the DPI its size needs, on a small
+    pool: at most max_concurrent_pages pages are rendered or in flight at
+    once, however long the PDF is. Several receipts come back as a JSON
+    array in page order.
+    """
+    def process_page(page_number):
+        page_name = f"{filename}#page-{page_number}.png"
+        page_data = pdf_pages.render_page(pdf_data, page_number, pdf_pages.adaptive_dpi(sizes[page_number - 1]))
+        return process_data(page_data, page_name, use_cache=use_cache, use_local_ocr=use_local_ocr)
+
+    print(f"📑 {filename}: {len(sizes)} pages")
+    results = [None] * len(sizes)
+    page_numbers = iter(range(1, len(sizes) + 1))
+    with ThreadPoolExecutor(max_workers=pdf_pages.PDF_CONFIG['max_concurrent_pages']) as executor:
+        pending = {}
+
+        def submit_next():
+            page_number = next(page_numbers, None)
+            if page_number is not None:
+                # Pages run in a copy of this context so their spans and tokens land with the PDF's job
+                pending[executor.submit(contextvars.copy_context().run, process_page, page_number)] = page_number
+
+        for _ in range(pdf_pages.PDF_CONFIG['max_concurrent_pages']):
+            submit_next()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                page_number = pending.pop(future)
+                try:
+                    results[page_number - 1] = future.result()
+                except BudgetExceeded:
+                    raise
+                except Exception as e:
+                    print(f"Error processing page {page_number} of {filename}: {e}")
+                submit_next()
+    # Statements list many same-day payments of one amount, so pages only merge on IDs or across a page break
+    return combine_results(results, adjacent_only=True)
+
+def process_image_batch(items, use_cache=True, use_local_ocr=None):
+    """Process several (filename, image_data) items with one Gemini request
+
+    Returns a list of results in the same order. Images the batched
+    response does not cover are retried one by one.
+    """
+    use_local_ocr = local_ocr.LOCAL_OCR_CONFIG['enabled'] if use_local_ocr is None else use_local_ocr
+    results = [None] * len(items)
+    to_send = []
+    for index, (filename, image_data) in enumerate(items):
+        cache_key = make_cache_key(image_data, prompt_2, MODEL_NAME, SCHEMA_VERSION)
+        if use_cache:
+            cached_response = cached_result(cache_key, filename)
+            if cached_response is not None:
+                results[index] = cached_response
+                continue
+        local_response = answer_locally(image_data, os.path.basename(filename), use_local_ocr)
+        if local_response is not None:
+            results[index] = local_response
+            continue
+        to_send.append((index, filename, image_data, cache_key))
+
+    responses = [None] * len(to_send)
+    if len(to_send) > 1:
+        responses = gemini_img_batch_ocr([
+            (image_data, os.path.splitext(filename)[1].lower(), os.path.basename(filename))
+            for _, filename, image_data, _ in to_send
+        ])
+
+    for (index, filename, image_data, cache_key), response in zip(to_send, responses):
+        cleaned_response = to_result(response, filename)
+        if not cleaned_response:
+            # Fall back to a single-image request for anything the batch missed
+            file_extension = os.path.splitext(filename)[1].lower()
+            cleaned_response = to_result(gemini_img_ocr(image_data, file_extension, os.path.basename(filename)), filename)
+        if use_cache and cleaned_response:
+            result_cache.put(cache_key, cleaned_response)
+        results[index] = cleaned_response
+    return results
+
+def _timed_process(items, use_cache, use_local_ocr, batch_size):
+    """Return (results, duration, refused); refused means the budget ran out before the items were sent"""
+    start_time = time.time()
+    try:
+        if len(items) == 1:
+            filename, file_data = items[0]
+            results = [process_data(file_data, os.path.basename(filename), use_cache=use_cache, use_local_ocr=use_local_ocr,
+                                    batch_size=batch_size)]
+        else:
+            results = process_image_batch(items, use_cache=use_cache, use_local_ocr=use_local_ocr)
+    except BudgetExceeded:
+        return [None] * len(items), time.time() - start_time, True
+    except Exception as e:
+        print(f"Error processing {', '.join(os.path.basename(name) for name, _ in items)}: {e}")
+        results = [None] * len(items)
+    return results, time.time() - start_time, False
+
+def _outcome(index, name, result, duration, duplicate_of="", skipped_budget=False):
+    return {
+        'index': index,
+        'name': name,
+        'result': result,
+        'duration': duration,
+        'duplicate_of': duplicate_of,
+        'skipped_budget': skipped_budget
+    }
+
+def _outcome_status(outcome):
+    if outcome['skipped_budget']:
+        return "skipped"
+    if outcome['duplicate_of']:
+        return "duplicate"
+    return "failed" if outcome['result'] is None else "ok"
+
+def process_files(items, max_workers=DEFAULT_MAX_WORKERS, use_cache=True, dedupe=True, batch_size=DEFAULT_BATCH_SIZE,
+                  use_local_ocr=None, metrics_registry=None, usage_tracker=None):
+    """Process (name, data) items on a bounded thread pool, yielding outcomes in completion order
+
+    Each outcome carries the item's position in the input as 'index'.
+
+    Items are pulled from the iterable only as workers free up, so a lazy
+    source (see ingest.py) overlaps decoding with OCR. With dedupe on,
+    near-duplicate images are sent to Gemini once and the other copies are
+    yielded with the same result and a 'duplicate_of' link. With batch_size
+    above 1, images are packed that many to a request. With use_local_ocr
+    on, rendered receipts Tesseract reads confidently never reach Gemini. Stage timings and counters go to metrics_registry (a
+    job's registry from metrics.job_metrics), or to the caller's current one.
+
+    Token usage is counted against usage_tracker (or the caller's current
+    TokenTracker). Once its budget is reached no further items are pulled
+    from the source, so unprocessed items are simply never yielded. Items
+    already handed to a worker when it ran out are yielded with
+    skipped_budget=True and no result; they were not sent and did not fail.
+    """
+    max_workers = max(1, int(max_workers))
+    batch_size = max(1, int(batch_size))
+    source = enumerate(items)
+    # Workers do not inherit the caller's context, so each task is run in a copy bound to the registry
+    registry = metrics_registry or metrics.current_metrics()
+    tracker = usage_tracker or current_token_tracker()
+    pending = {}
+    ready = deque()
+    batch_buffer = []
+    duplicate_index = DuplicateIndex() if dedupe else None
+    names = {}  # sequence number -> name, for items sent to a worker
+    followers = {}  # canonical sequence number -> (seq, name, data) of duplicates waiting for its result
+    finished = {}  # canonical sequence number -> result, for duplicates that show up later
+    retry = deque()  # (seq, (name, data)) of duplicates whose canonical image failed; they are sent themselves
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        def submit(task):
+            context = metrics.bind_metrics(registry)
+            context.run(set_token_tracker, tracker)
+            future = executor.submit(context.run, _timed_process, [(name, data) for _, name, data in task], use_cache, use_local_ocr, batch_size)
+            pending[future] = [seq for seq, _, _ in task]
+
+        def pull():
+            if retry:
+                return retry.popleft()
+            # Reading happens inside the lazy source, so time each item as it comes out
+            start_time = time.monotonic()
+            entry = next(source, None)
+            if entry is not None:
+                registry.record("read", time.monotonic() - start_time, file=entry[1][0])
+            return entry
+
+        def submit_next():
+            if tracker.budget_exceeded():
+                # Copies of a failed image that were waiting to be sent on their own
+                while retry:
+                    seq, (name, _) = retry.popleft()
+                    ready.append(_outcome(seq, name, None, 0.0, skipped_budget=True))
+            # Pull items until one task actually needs a worker; a spent budget stops pulling altogether
+            while not tracker.budget_exceeded() and (entry := pull()) is not None:
+                seq, (name, data) = entry
+                is_image = name.lower().endswith(IMAGE_EXTENSIONS)
+                canonical_seq = None
+                if duplicate_index is not None and is_image:
+                    canonical_seq = duplicate_index.match_or_add(seq, data)
+
+                if canonical_seq is not None:
+                    if canonical_seq in finished:
+                        ready.append(_outcome(seq, name, finished[canonical_seq], 0.0, os.path.basename(names[canonical_seq])))
+                    else:
+                        followers[canonical_seq].append((seq, name, data))
+                    continue
+
+                names[seq] = name
+                followers[seq] = []
+                if is_image and batch_size > 1:
+                    batch_buffer.append((seq, name, data))
+                    if len(batch_buffer) < batch_size:
+                        continue
+                    task = list(batch_buffer)
+                    batch_buffer.clear()
+                else:
+                    task = [(seq, name, data)]
+                submit(task)
+                return
+
+            # Source drained: send the last partial batch
+            if batch_buffer:
+                submit(list(batch_buffer))
+                batch_buffer.clear()
+
+        # Keep a small backlog queued so workers never wait on the caller
+        for _ in range(max_workers * 2):
+            submit_next()
+
+        while pending or ready:
+            if ready:
+                outcome = ready.popleft()
+                registry.inc("files_total", status=_outcome_status(outcome))
+                yield outcome
+                continue
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                task_seqs = pending.pop(future)
+                results, duration, refused = future.result()
+                for seq, result in zip(task_seqs, results):
+                    name = names[seq]
+                    if refused:
+                        ready.append(_outcome(seq, name, None, duration, skipped_budget=True))
+                        for duplicate_seq, duplicate_name, _ in followers.pop(seq):
+                            ready.append(_outcome(duplicate_seq, duplicate_name, None, 0.0, skipped_budget=True))
+                        continue
+                    ready.append(_outcome(seq, name, result, duration))
+                    if duplicate_index is not None and result is None:
+                        # A failure is never shared: later copies, and any waiting, are sent on their own
+                        duplicate_index.discard(seq)
+                        retry.extend((duplicate_seq, (duplicate_name, data)) for duplicate_seq, duplicate_name, data in followers.pop(seq))
+                        continue
+                    if duplicate_index is not None:
+                        finished[seq] = result
+                    for duplicate_seq, duplicate_name, _ in followers.pop(seq):
+                        ready.append(_outcome(duplicate_seq, duplicate_name, result, 0.0, os.path.basename(name)))
+                submit_next()
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+def run_batch(inputs, output=sys.stdout, max_workers=DEFAULT_MAX_WORKERS, use_cache=True, dedupe=True, batch_size=DEFAULT_BATCH_SIZE,
+              use_local_ocr=None, usage_tracker=None):
+    """Process every file found in inputs, writing one JSON line per receipt as results complete
+
+    Returns a throughput/latency/token/cost summary of the run. With a
+    usage_tracker budget, files left once it is reached are not processed.
+    """
+    usage_tracker = usage_tracker or current_token_tracker()
+    start_time = time.time()
+    durations = []
+    file_count = 0
+    failed = 0
+    skipped = 0
+
+    for outcome in process_files(iter_input_paths(inputs), max_workers=max_workers, use_cache=use_cache, dedupe=dedupe, batch_size=batch_size,
+                                 use_local_ocr=use_local_ocr, usage_tracker=usage_tracker):
+        record = {
+            'file': outcome['name'],
+            'duplicate_of': outcome['duplicate_of'],
+            'duration': round(outcome['duration'], 3),
+            'result': None,
+            'error': ""
+        }
+        if outcome['skipped_budget']:
+            # Never sent: no row, the file is left for a rerun with a higher limit
+            skipped += 1
+            continue
+        if outcome['result'] is None:
+            record['error'] = "Processing failed"
+        else:
+            try:
+                record['result'] = json.loads(outcome['result'])
+            except ValueError as e:
+                record['error'] = f"Invalid JSON: {e}"
+
+        file_count += 1
+        if record['error']:
+            failed += 1
+        if not outcome['duplicate_of']:
+            durations.append(outcome['duration'])
+
+        output.write(json.dumps(record, ensure_ascii=False) + "\n")
+        output.flush()
+
+    elapsed_time = time.time() - start_time
+    durations.sort()
+    token_summary = get_token_usage_summary(usage_tracker)
+    return {
+        'files': file_count,
+        'failed': failed,
+        'skipped': skipped,
+        'elapsed_seconds': elapsed_time,
+        'files_per_second': file_count / elapsed_time if elapsed_time else 0.0,
+        'latency_p50': _percentile(durations, 0.50),
+        'latency_p95': _percentile(durations, 0.95),
+        'latency_max': durations[-1] if durations else 0.0,
+        'total_tokens': token_summary['total_tokens'],
+        'tokens_per_file': token_summary['total_tokens'] / max(1, file_count),
+        'total_cost': token_summary['total_cost'],
+        'cache_hits': token_summary['cache_hits'],
+        'cache_misses': token_summary['cache_misses'],
+        'budget_reached': usage_tracker.budget_exceeded()
+    }
+
+def print_batch_summary(summary, stream=sys.stderr):
+    print("\n" + "="*50, file=stream)
+    print("🚀 BATCH SUMMARY", file=stream)
+    print("="*50, file=stream)
+    print(f"Files: {summary['files']:,} ({summary['failed']:,} failed)", file=stream)
+    print(f"Elapsed: {summary['elapsed_seconds']:.1f}s | Throughput: {summary['files_per_second']:.2f} files/s", file=stream)
+    print(f"Latency p50: {summary['latency_p50']:.2f}s | p95: {summary['latency_p95']:.2f}s | max: {summary['latency_max']:.2f}s", file=stream)
+    print(f"Total tokens: {summary['total_tokens']:,} | Tokens per file: {summary['tokens_per_file']:.1f}", file=stream)
+    print(f"Total cost: ${summary['total_cost']:.6f}", file=stream)
+    print(f"Cache hits: {summary['cache_hits']:,} | misses: {summary['cache_misses']:,}", file=stream)
+    if summary['budget_reached']:
+        print(f"⚠️ Budget reached: remaining files were not processed ({summary['skipped']:,} were queued but not sent)", file=stream)
+    print("="*50, file=stream)
+
 if __name__ == "__main__":  # Fixed: proper double underscores
     parser = argparse.ArgumentParser(
-        description="Process a file (PDF or image) using OCR."
+        description="Process files (PDFs or images) using OCR. Accepts files, directories, glob patterns and ZIP/7z archives."
     )
-    parser.add_argument("file_path", type=str, help="Path to the file to process")
+    parser.add_argument("inputs", nargs="+", help="Files, directories, glob patterns or archives to process")
+    parser.add_argument("--no-cache", action="store_true", help="Ignore the local result cache and always call Gemini")
+    parser.add_argument("--workers", type=int, default=DEFAULT_MAX_WORKERS, help="Number of files sent to Gemini at the same time")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Images packed into one request")
+    parser.add_argument("--no-dedupe", action="store_true", help="Send near-duplicate images to Gemini as well")
+    parser.add_argument("--no-local-ocr", action="store_true", help="Send rendered receipts to Gemini instead of reading them with Tesseract")
+    parser.add_argument("--output", "-o", help="Write JSON lines to this file instead of stdout")
+    parser.add_argument("--max-cost", type=float, help="Stop sending requests once the batch has cost this many USD")
+    parser.add_argument("--max-tokens", type=int, help="Stop sending requests once the batch has used this many tokens")
+    parser.add_argument("--trace", default=os.environ.get("METRICS_TRACE_PATH"), help="Append per-stage timings to this JSON lines file")
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics on this port while the batch runs")
     args = parser.parse_args()
-    response = process_file(args.file_path)
-    print(response)
\ No newline at end of file
+
+    if args.trace:
+        metrics.enable_trace(args.trace)
+    if args.metrics_port:
+        metrics.start_metrics_server(args.metrics_port)
+
+    # A single plain file keeps the original behaviour of printing its raw result
+    if len(args.inputs) == 1 and os.path.isfile(args.inputs[0]) and not is_archive(args.inputs[0]) and not args.output:
+        response = process_file(args.inputs[0], use_cache=not args.no_cache,
+                                use_local_ocr=False if args.no_local_ocr else None, batch_size=args.batch_size)
+        print(response)
+    else:
+        # Per-file diagnostics go to stderr so stdout stays valid JSON lines
+        output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+        try:
+            with contextlib.redirect_stdout(sys.stderr):
+                summary = run_batch(
+                    args.inputs,
+                    output=output,
+                    max_workers=args.workers,
+                    use_cache=not args.no_cache,
+                    dedupe=not args.no_dedupe,
+                    batch_size=args.batch_size,
+                    use_local_ocr=False if args.no_local_ocr else None,
+                    usage_tracker=TokenTracker(max_cost=args.max_cost, max_tokens=args.max_tokens)
+                )
+                print_batch_summary(summary)
+                print_stage_summary()
+        finally:
+            if args.output:
+                output.close()
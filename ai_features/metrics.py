@@ -0,0 +1,304 @@
+import os
+import json
+import math
+import time
+import threading
+import contextvars
+from collections import OrderedDict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Pipeline stages timed with span(), in the order a file goes through them
+STAGES = ("read", "keyframes", "cache", "classify", "local_ocr", "preprocess", "build_request", "model", "parse", "flatten")
+METRIC_PREFIX = "invoice_ocr"
+# Registries of finished jobs kept for their timing panels; older ones are dropped, the process totals remain
+MAX_FINISHED_JOB_METRICS = 20
+# The endpoint is unauthenticated, so it only listens on loopback unless METRICS_HOST says otherwise
+DEFAULT_METRICS_HOST = "127.0.0.1"
+
+class Histogram:
+    """Thread-safe histogram with log-spaced buckets"""
+    def __init__(self, min_seconds=0.001, max_seconds=600.0, growth=2.0):
+        self.bounds = []
+        bound = min_seconds
+        while bound < max_seconds:
+            self.bounds.append(bound)
+            bound *= growth
+        self.bounds.append(math.inf)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counts = [0] * len(self.bounds)
+            self.count = 0
+            self.total = 0.0
+
+    def observe(self, seconds):
+        index = next(i for i, bound in enumerate(self.bounds) if seconds <= bound)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += seconds
+
+    def quantile(self, fraction):
+        """Upper bound of the bucket holding the given quantile, or None without samples"""
+        with self._lock:
+            if self.count == 0:
+                return None
+            target = fraction * self.count
+            running = 0
+            for bound, count in zip(self.bounds, self.counts):
+                running += count
+                if running >= target:
+                    return bound if bound != math.inf else self.bounds[-2]
+        return None
+
+    def get_summary(self):
+        with self._lock:
+            buckets = [
+                {'le': bound, 'count': count}
+                for bound, count in zip(self.bounds, self.counts) if count
+            ]
+            count = self.count
+            total = self.total
+        return {
+            'count': count,
+            'total': total,
+            'mean': total / count if count else 0.0,
+            'p50': self.quantile(0.50),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'buckets': buckets
+        }
+
+    def cumulative_buckets(self):
+        with self._lock:
+            running = 0
+            cumulative = []
+            for bound, count in zip(self.bounds, self.counts):
+                running += count
+                cumulative.append((bound, running))
+            return cumulative, self.count, self.total
+
+class TraceWriter:
+    """Appends one JSON line per finished span"""
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def write(self, event):
+        line = json.dumps(event, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+class MetricsRegistry:
+    """Counters and per-stage timing histograms; a job registry also feeds its parent"""
+    def __init__(self, job_id=None, parent=None):
+        self.job_id = job_id
+        self.parent = parent
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.stages = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        if self.parent is not None:
+            self.parent.inc(name, value, **labels)
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram()
+        histogram.observe(seconds)
+        if self.parent is not None:
+            self.parent.observe(stage, seconds)
+
+    def record(self, stage, seconds, file=None, error=None):
+        """Count one pass through stage that was timed elsewhere, and trace it"""
+        self.observe(stage, seconds)
+        if error is not None:
+            self.inc("errors_total", stage=stage)
+        if _trace_writer is not None:
+            _trace_writer.write({
+                'ts': time.time(),
+                'job': self.job_id,
+                'stage': stage,
+                'file': file,
+                'seconds': round(seconds, 6),
+                'error': type(error).__name__ if error is not None else None
+            })
+
+    @contextmanager
+    def span(self, stage, file=None):
+        """Time a block as one pass through stage; failures are counted and traced too"""
+        start_time = time.monotonic()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.record(stage, time.monotonic() - start_time, file=file, error=error)
+
+    def counter(self, name, **labels):
+        with self._lock:
+            return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def stage_summary(self):
+        """Rows of {'stage', 'count', 'total', 'mean', 'p50', 'p95', 'p99'} in pipeline order"""
+        with self._lock:
+            stages = dict(self.stages)
+        order = {stage: index for index, stage in enumerate(STAGES)}
+        rows = []
+        for stage in sorted(stages, key=lambda stage: order.get(stage, len(order))):
+            summary = stages[stage].get_summary()
+            summary.pop('buckets')
+            rows.append({'stage': stage, **summary})
+        return rows
+
+    def snapshot(self):
+        with self._lock:
+            counters = [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in sorted(self.counters.items())
+            ]
+        return {'job': self.job_id, 'stages': self.stage_summary(), 'counters': counters}
+
+    def to_prometheus(self):
+        """Render the registry in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            stages = sorted(self.stages.items())
+
+        names_seen = set()
+        for (name, labels), value in counters:
+            metric = f"{METRIC_PREFIX}_{name}"
+            if metric not in names_seen:
+                lines.append(f"# TYPE {metric} counter")
+                names_seen.add(metric)
+            lines.append(f"{metric}{_format_labels(labels)} {value}")
+
+        metric = f"{METRIC_PREFIX}_stage_seconds"
+        if stages:
+            lines.append(f"# TYPE {metric} histogram")
+        for stage, histogram in stages:
+            buckets, count, total = histogram.cumulative_buckets()
+            for bound, running in buckets:
+                le = "+Inf" if bound == math.inf else f"{bound:g}"
+                lines.append(f"{metric}_bucket{_format_labels((('stage', stage), ('le', le)))} {running}")
+            lines.append(f"{metric}_sum{_format_labels((('stage', stage),))} {total}")
+            lines.append(f"{metric}_count{_format_labels((('stage', stage),))} {count}")
+        return "\n".join(lines) + "\n"
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+# Process-wide totals; job registries feed into it
+pipeline_metrics = MetricsRegistry()
+_current_metrics = contextvars.ContextVar("current_metrics", default=None)
+_job_metrics = {}
+_finished_jobs = OrderedDict()  # job_id -> None, oldest finished first
+_job_metrics_lock = threading.Lock()
+_trace_writer = None
+
+def current_metrics():
+    """The registry of the job running in this context, or the process-wide one"""
+    return _current_metrics.get() or pipeline_metrics
+
+def bind_metrics(registry):
+    """Return a copy of the current context with registry as current, for executor.submit(context.run, ...)"""
+    context = contextvars.copy_context()
+    context.run(_current_metrics.set, registry)
+    return context
+
+def job_metrics(job_id, create=True):
+    """The registry of one job, created on first use; with create=False None once it was dropped"""
+    with _job_metrics_lock:
+        registry = _job_metrics.get(job_id)
+        if create:
+            # A resumed job records again, so it is not finished any more
+            _finished_jobs.pop(job_id, None)
+            if registry is None:
+                registry = _job_metrics[job_id] = MetricsRegistry(job_id=job_id, parent=pipeline_metrics)
+        return registry
+
+def finish_job_metrics(job_id):
+    """Mark a job's registry as finished; only the last MAX_FINISHED_JOB_METRICS finished ones are kept"""
+    with _job_metrics_lock:
+        if job_id not in _job_metrics:
+            return
+        _finished_jobs[job_id] = None
+        _finished_jobs.move_to_end(job_id)
+        while len(_finished_jobs) > MAX_FINISHED_JOB_METRICS:
+            oldest, _ = _finished_jobs.popitem(last=False)
+            _job_metrics.pop(oldest, None)
+
+def span(stage, file=None):
+    return current_metrics().span(stage, file=file)
+
+def inc(name, value=1, **labels):
+    current_metrics().inc(name, value, **labels)
+
+def enable_trace(path):
+    """Write every span to path as JSON lines from now on"""
+    global _trace_writer
+    if _trace_writer is not None:
+        _trace_writer.close()
+    _trace_writer = TraceWriter(path)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = pipeline_metrics.to_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+_metrics_server = None
+
+def start_metrics_server(port, host=None):
+    """Serve /metrics for Prometheus on a daemon thread; later calls reuse the running server
+
+    Binds METRICS_HOST, or loopback when it is not set; set it to 0.0.0.0 to
+    let a Prometheus on another machine scrape this process.
+    """
+    global _metrics_server
+    host = host or os.environ.get("METRICS_HOST") or DEFAULT_METRICS_HOST
+    if _metrics_server is None:
+        _metrics_server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        threading.Thread(target=_metrics_server.serve_forever, daemon=True).start()
+    return _metrics_server
+
+def configure_from_env():
+    """Honour METRICS_PORT and METRICS_TRACE_PATH"""
+    if os.environ.get("METRICS_TRACE_PATH") and _trace_writer is None:
+        enable_trace(os.environ["METRICS_TRACE_PATH"])
+    if os.environ.get("METRICS_PORT"):
+        start_metrics_server(int(os.environ["METRICS_PORT"]))
@@ -0,0 +1,56 @@
+import re
+from io import BytesIO
+from preprocess import PREPROCESS_CONFIG
+
+# Defaults for reading multi-page PDFs page by page
+PDF_CONFIG = {
+    # Pages are rendered just large enough for the image path's long edge, within these bounds
+    'min_dpi': 100,
+    'max_dpi': 300,
+    'max_concurrent_pages': 4  # Pages rendered and in flight at once per PDF; bounds memory on long statements
+}
+
+POINTS_PER_INCH = 72
+_PAGE_SIZE_KEY = re.compile(r"^Page\s+(\d+)\s+size$")
+_PAGE_SIZE_VALUE = re.compile(r"([\d.]+)\s*x\s*([\d.]+)\s*pts")
+
+def page_sizes(pdf_data):
+    """[(width, height)] in points for every page, read with pdfinfo without rendering anything
+
+    Raises when poppler is not installed or the file is not a readable PDF.
+    """
+    from pdf2image import pdfinfo_from_bytes
+
+    info = pdfinfo_from_bytes(pdf_data)
+    page_count = info["Pages"]
+    if page_count <= 1:
+        match = _PAGE_SIZE_VALUE.search(info.get("Page size", ""))
+        return [(float(match.group(1)), float(match.group(2))) if match else None] * page_count
+    # With a page range pdfinfo reports "Page    N size: W x H pts" for each page
+    info = pdfinfo_from_bytes(pdf_data, first_page=1, last_page=page_count)
+    sizes = [None] * page_count
+    for key, value in info.items():
+        key_match = _PAGE_SIZE_KEY.match(key)
+        value_match = _PAGE_SIZE_VALUE.search(str(value))
+        if key_match and value_match and 1 <= int(key_match.group(1)) <= page_count:
+            sizes[int(key_match.group(1)) - 1] = (float(value_match.group(1)), float(value_match.group(2)))
+    return sizes
+
+def adaptive_dpi(size, config=None):
+    """DPI that renders a page at about the image path's max long edge; narrow receipts get more, A4 statements less"""
+    config = {**PDF_CONFIG, **(config or {})}
+    if not size:
+        return config['max_dpi']
+    long_edge_inches = max(size) / POINTS_PER_INCH
+    dpi = PREPROCESS_CONFIG['max_long_edge'] / long_edge_inches if long_edge_inches else config['max_dpi']
+    return int(min(config['max_dpi'], max(config['min_dpi'], dpi)))
+
+def render_page(pdf_data, page_number, dpi):
+    """PNG bytes of one page (1-based); only this page is rasterized"""
+    from pdf2image import convert_from_bytes
+
+    images = convert_from_bytes(pdf_data, dpi=dpi, first_page=page_number, last_page=page_number, fmt="png")
+    buffer = BytesIO()
+    images[0].save(buffer, "PNG")
+    images[0].close()
+    return buffer.getvalue()
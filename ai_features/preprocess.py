@@ -0,0 +1,99 @@
+from io import BytesIO
+import numpy as np
+from PIL import Image, ImageOps
+
+# Defaults for shrinking images before they are uploaded to Gemini.
+# Gemini bills large images per 768px tile, so a receipt does not need more
+# than ~1600px on its long edge to stay readable.
+PREPROCESS_CONFIG = {
+    'enabled': True,
+    'max_long_edge': 1600,
+    'format': 'JPEG',  # JPEG or WEBP
+    'quality': 85,
+    'auto_crop': False,
+}
+
+MIME_TYPES = {
+    'JPEG': "image/jpeg",
+    'WEBP': "image/webp",
+}
+
+# Auto-crop: a pixel belongs to the document when it differs this much from the border colour
+CROP_THRESHOLD = 40
+# Rows/columns with less than this share of document pixels count as background
+CROP_MIN_FRACTION = 0.02
+CROP_MARGIN = 0.02
+CROP_ANALYSIS_SIZE = 256
+
+def find_document_box(image):
+    """Estimate the bounding box of the document by comparing every pixel with the border colour"""
+    scale = max(image.size) / CROP_ANALYSIS_SIZE
+    small = image.convert("L")
+    if scale > 1:
+        small = small.resize((max(1, round(image.width / scale)), max(1, round(image.height / scale))), Image.BILINEAR)
+    else:
+        scale = 1
+    pixels = np.asarray(small, dtype=np.int16)
+
+    border = np.concatenate([pixels[0], pixels[-1], pixels[:, 0], pixels[:, -1]])
+    foreground = np.abs(pixels - np.median(border)) > CROP_THRESHOLD
+
+    rows = np.flatnonzero(foreground.mean(axis=1) > CROP_MIN_FRACTION)
+    cols = np.flatnonzero(foreground.mean(axis=0) > CROP_MIN_FRACTION)
+    if rows.size == 0 or cols.size == 0:
+        return None
+
+    margin_x = CROP_MARGIN * small.width
+    margin_y = CROP_MARGIN * small.height
+    left = max(0, int((cols[0] - margin_x) * scale))
+    top = max(0, int((rows[0] - margin_y) * scale))
+    right = min(image.width, int((cols[-1] + 1 + margin_x) * scale))
+    bottom = min(image.height, int((rows[-1] + 1 + margin_y) * scale))
+
+    # Not worth it when the document already fills the frame
+    if (right - left) * (bottom - top) > 0.9 * image.width * image.height:
+        return None
+    return left, top, right, bottom
+
+def preprocess_image(image_data, max_long_edge=None, image_format=None, quality=None, auto_crop=None):
+    """Downscale, re-encode and strip metadata from an image
+
+    Returns (image_bytes, mime_type). The original bytes are returned
+    unchanged (mime_type None) when re-encoding would not make them smaller.
+    """
+    max_long_edge = max_long_edge or PREPROCESS_CONFIG['max_long_edge']
+    image_format = (image_format or PREPROCESS_CONFIG['format']).upper()
+    quality = quality or PREPROCESS_CONFIG['quality']
+    auto_crop = PREPROCESS_CONFIG['auto_crop'] if auto_crop is None else auto_crop
+
+    image = Image.open(BytesIO(image_data))
+    original_size = image.size
+    # Decode big JPEGs at a reduced scale straight away
+    image.draft("RGB", (max_long_edge, max_long_edge))
+    # Bake the EXIF rotation into the pixels since the metadata is dropped below
+    image = ImageOps.exif_transpose(image)
+
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        image = background
+    elif image.mode != "RGB":
+        image = image.convert("RGB")
+
+    if auto_crop:
+        box = find_document_box(image)
+        if box is not None:
+            image = image.crop(box)
+
+    if max(image.size) > max_long_edge:
+        image.thumbnail((max_long_edge, max_long_edge), Image.LANCZOS)
+
+    buffer = BytesIO()
+    # Saving without an exif argument leaves all metadata behind
+    image.save(buffer, format=image_format, quality=quality, optimize=True)
+    processed_data = buffer.getvalue()
+
+    if len(processed_data) >= len(image_data) and image.size == original_size:
+        return image_data, None
+    return processed_data, MIME_TYPES[image_format]
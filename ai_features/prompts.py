@@ -80,3 +80,16 @@ prompt_2 = f"""
     }}
 
     """
+
+# Several receipts share one request: each image is preceded by an "Image <n>:" label
+batch_prompt_2 = prompt_2 + """
+    You are given several images in this request. Each image is preceded by a label "Image <n>:".
+    Extract the fields above for every image independently.
+    Return a JSON array only, with exactly one object per image, in the same format as above plus
+    an "image_index" field holding the number <n> from the image's label, for example:
+
+    [
+      {"image_index": 0, "transaction_id": "", ...},
+      {"image_index": 1, "transaction_id": "", ...}
+    ]
+    """
@@ -0,0 +1,127 @@
+import threading
+import numpy as np
+import pandas as pd
+from schema import IMAGE_TYPES
+from validation import validate_frame
+
+# Image types the filter names; anything else lands under "Others"
+NAMED_IMAGE_TYPES = ("replay", "screenshot", "live")
+# Typed columns derived from the model's text fields; the text columns are kept as exported
+AMOUNT_COLUMN = "amount_value"
+DATETIME_COLUMN = "invoice_datetime"
+
+def parse_amounts(values):
+    """Parse amounts like "6.790,00", "R$ 1.234,56", "1,234.56" or "1.500" to floats in one vectorized pass; NaN when unreadable
+
+    When both separators appear the last one is the decimal mark. A lone
+    comma is the Brazilian decimal mark; dots followed by groups of exactly
+    three digits ("1.500", "1.234.567") group thousands.
+    """
+    text = values.astype("string").str.replace(r"[^\d,.\-]", "", regex=True)
+    last_comma = text.str.rfind(",")
+    last_dot = text.str.rfind(".")
+    comma_groups = text.str.match(r"^-?\d{1,3}(,\d{3}){2,}$").fillna(False)
+    decimal_comma = ((last_comma > last_dot).fillna(False) & ~comma_groups)
+    dot_groups = text.str.match(r"^-?[1-9]\d{0,2}(\.\d{3})+$").fillna(False)
+    text = text.where(
+        decimal_comma,
+        text.str.replace(",", "", regex=False).where(~dot_groups, text.str.replace(".", "", regex=False))
+    )
+    text = text.where(~decimal_comma, text.str.replace(".", "", regex=False).str.replace(",", ".", regex=False))
+    return pd.to_numeric(text, errors="coerce").astype("float64")
+
+def parse_datetimes(dates, times):
+    """Combine DD/MM/YYYY dates and HH:MM[:SS] times into datetimes; NaT when the date is unreadable"""
+    day = pd.to_datetime(dates.astype("string").str.strip(), format="%d/%m/%Y", errors="coerce")
+    clock = times.astype("string").str.strip().fillna("")
+    clock = clock.where(clock.str.count(":") != 1, clock + ":00")
+    offset = pd.to_timedelta(clock.where(clock.str.match(r"^\d{1,2}:\d{2}:\d{2}$"), "00:00:00"), errors="coerce")
+    return day + offset.fillna(pd.Timedelta(0))
+
+def normalize_frame(df):
+    """Add typed and validation columns to a chunk of flattened rows and make image_type categorical"""
+    for column in ("image_type", "amount", "invoice_date", "invoice_time"):
+        if column not in df.columns:
+            df[column] = ""
+    image_types = df["image_type"].astype("string").str.strip().str.lower().fillna("")
+    df["image_type"] = pd.Categorical(image_types, categories=sorted(set(IMAGE_TYPES) | set(image_types.unique()) | {""}))
+    df[AMOUNT_COLUMN] = parse_amounts(df["amount"])
+    df[DATETIME_COLUMN] = parse_datetimes(df["invoice_date"], df["invoice_time"])
+    return validate_frame(df)
+
+class ResultStore:
+    """Columnar store of flattened result rows
+
+    Rows are appended to a small buffer and normalized chunk by chunk when
+    the frame is next read, so the full table is never rebuilt from dicts.
+    version changes with every append or reset.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._frame = pd.DataFrame()
+            self._pending = []
+            self.version = getattr(self, "version", 0) + 1
+
+    def append(self, rows):
+        rows = list(rows)
+        if not rows:
+            return
+        with self._lock:
+            self._pending.extend(rows)
+            self.version += 1
+
+    def __len__(self):
+        with self._lock:
+            return len(self._frame) + len(self._pending)
+
+    def frame(self):
+        """The full typed DataFrame, with any buffered rows folded in"""
+        with self._lock:
+            if self._pending:
+                chunk = normalize_frame(pd.DataFrame(self._pending))
+                self._pending = []
+                if self._frame.empty:
+                    self._frame = chunk.reset_index(drop=True)
+                else:
+                    self._frame = _concat(self._frame, chunk)
+            return self._frame
+
+    def annotate(self, annotate):
+        """Run annotate(frame) on the full frame to add columns that depend on every row, e.g. duplicate flags"""
+        frame = self.frame()
+        with self._lock:
+            self._frame = annotate(frame)
+            self.version += 1
+
+    def filtered(self, selected_filter):
+        """Rows whose image_type matches the filter ("All", "Replay", "Screenshot", "Live" or "Others")"""
+        df = self.frame()
+        if selected_filter == "All" or df.empty:
+            return df
+        if selected_filter == "Others":
+            return df[~df["image_type"].isin(NAMED_IMAGE_TYPES)]
+        return df[df["image_type"] == selected_filter.lower()]
+
+    @staticmethod
+    def totals(df):
+        """Row count, summed amount and the date range of a (filtered) frame"""
+        amounts = df[AMOUNT_COLUMN] if AMOUNT_COLUMN in df.columns else pd.Series(dtype="float64")
+        dates = df[DATETIME_COLUMN] if DATETIME_COLUMN in df.columns else pd.Series(dtype="datetime64[ns]")
+        return {
+            'rows': len(df),
+            'amount_total': float(np.nansum(amounts.to_numpy(dtype="float64"))) if len(amounts) else 0.0,
+            'amounts_parsed': int(amounts.notna().sum()),
+            'first_date': dates.min() if dates.notna().any() else None,
+            'last_date': dates.max() if dates.notna().any() else None
+        }
+
+def _concat(frame, chunk):
+    # Categories differ between chunks when a new image type shows up; union them so the column stays categorical
+    categories = frame["image_type"].cat.categories.union(chunk["image_type"].cat.categories)
+    frame["image_type"] = frame["image_type"].cat.set_categories(categories)
+    chunk["image_type"] = chunk["image_type"].cat.set_categories(categories)
+    return pd.concat([frame, chunk], ignore_index=True)
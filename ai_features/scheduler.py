@@ -0,0 +1,164 @@
+import os
+import time
+import random
+import threading
+
+# Gemini 2.0 Flash paid tier 1 limits; override for other tiers
+DEFAULT_REQUESTS_PER_MINUTE = int(os.environ.get("GEMINI_RPM", 2000))
+DEFAULT_TOKENS_PER_MINUTE = int(os.environ.get("GEMINI_TPM", 4_000_000))
+DEFAULT_MAX_CONCURRENCY = 32
+DEFAULT_INITIAL_CONCURRENCY = 8
+DEFAULT_MAX_RETRIES = 5
+BASE_BACKOFF_SECONDS = 1.0
+MAX_BACKOFF_SECONDS = 60.0
+# Starting guess for a receipt request until real usage_metadata arrives
+DEFAULT_TOKENS_PER_REQUEST = 1500
+
+def is_rate_limit_error(error):
+    try:
+        from google.api_core import exceptions
+        if isinstance(error, (exceptions.TooManyRequests, exceptions.ResourceExhausted)):
+            return True
+    except ImportError:
+        pass
+    message = str(error).lower()
+    return "429" in message or "quota" in message or "rate limit" in message or "resource exhausted" in message
+
+def is_retryable_error(error):
+    if is_rate_limit_error(error):
+        return True
+    try:
+        from google.api_core import exceptions
+        if isinstance(error, (exceptions.ServiceUnavailable, exceptions.InternalServerError,
+                              exceptions.DeadlineExceeded, exceptions.GatewayTimeout)):
+            return True
+    except ImportError:
+        pass
+    return isinstance(error, (TimeoutError, ConnectionError))
+
+class TokenBucket:
+    """Per-minute budget that refills continuously; reservations may overdraw and wait it off"""
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def reserve(self, amount):
+        """Take amount from the bucket and return how long to wait before using it"""
+        self._refill()
+        self.level -= amount
+        return max(0.0, -self.level / self.rate)
+
+    def adjust(self, amount):
+        """Correct an earlier reservation once the real cost is known"""
+        self._refill()
+        self.level = min(self.capacity, self.level - amount)
+
+class AdaptiveScheduler:
+    """Gates generate_content calls by RPM/TPM budgets and an AIMD concurrency limit
+
+    The concurrency limit grows by about one slot per limit-many successes
+    and halves on a rate-limit error. Retryable errors are retried with
+    jittered exponential backoff.
+    """
+    def __init__(self, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE,
+                 max_concurrency=DEFAULT_MAX_CONCURRENCY, initial_concurrency=DEFAULT_INITIAL_CONCURRENCY,
+                 max_retries=DEFAULT_MAX_RETRIES):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.limit = float(min(initial_concurrency, max_concurrency))
+        self.max_retries = max_retries
+        self.tokens_per_request = float(DEFAULT_TOKENS_PER_REQUEST)
+        self.in_flight = 0
+        self.last_decrease = 0.0
+        self.retries = 0
+        self.rate_limited = 0
+        self.throttled_seconds = 0.0
+        self._condition = threading.Condition()
+
+    def _acquire_slot(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+            request_wait = self.requests.reserve(1)
+            token_wait = self.tokens.reserve(self.tokens_per_request)
+            wait = max(request_wait, token_wait)
+            self.throttled_seconds += wait
+            return self.tokens_per_request, wait
+
+    def _release_slot(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def _on_success(self, response, reserved_tokens):
+        with self._condition:
+            self.limit = min(self.max_concurrency, self.limit + 1.0 / self.limit)
+            usage = getattr(response, 'usage_metadata', None)
+            actual_tokens = getattr(usage, 'total_token_count', None) if usage else None
+            if actual_tokens:
+                self.tokens.adjust(actual_tokens - reserved_tokens)
+                self.tokens_per_request = 0.8 * self.tokens_per_request + 0.2 * actual_tokens
+            self._condition.notify_all()
+
+    def _on_rate_limit(self, started_at):
+        with self._condition:
+            self.rate_limited += 1
+            # Requests sent before the last decrease failed under the old limit; halve once per window
+            if started_at >= self.last_decrease:
+                self.limit = max(1.0, self.limit / 2)
+                self.last_decrease = time.monotonic()
+
+    def call(self, request):
+        """Run request() within the budgets, retrying retryable errors; re-raises anything else"""
+        attempt = 0
+        while True:
+            reserved_tokens, wait = self._acquire_slot()
+            try:
+                if wait > 0:
+                    time.sleep(wait)
+                started_at = time.monotonic()
+                response = request()
+            except Exception as e:
+                self._release_slot()
+                if not is_retryable_error(e) or attempt >= self.max_retries:
+                    raise
+                if is_rate_limit_error(e):
+                    self._on_rate_limit(started_at)
+                # Full jitter keeps the workers that failed together from retrying together
+                delay = random.uniform(0, min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * 2 ** attempt))
+                attempt += 1
+                self.retries += 1
+                print(f"Retrying Gemini request in {delay:.1f}s (attempt {attempt}/{self.max_retries}): {e}")
+                time.sleep(delay)
+                continue
+            self._release_slot()
+            self._on_success(response, reserved_tokens)
+            return response
+
+    def add_tokens(self, count):
+        """Charge tokens spent outside a slot's own reservation, e.g. by a discarded hedge copy"""
+        with self._condition:
+            self.tokens.adjust(count)
+
+    def get_summary(self):
+        with self._condition:
+            return {
+                'concurrency_limit': int(self.limit),
+                'in_flight': self.in_flight,
+                'retries': self.retries,
+                'rate_limited': self.rate_limited,
+                'throttled_seconds': self.throttled_seconds,
+                'tokens_per_request': self.tokens_per_request
+            }
+
+# Global instance: provider limits apply to the whole process, not to one batch
+request_scheduler = AdaptiveScheduler()
@@ -0,0 +1,207 @@
+import json
+from dataclasses import dataclass, field, fields
+
+IMAGE_TYPES = ("replay", "screenshot", "live", "others")
+# Part of every result cache key; bump it when InvoiceResult or its normalization changes
+SCHEMA_VERSION = 2
+
+# Attribute name -> JSON key where the key is not a valid identifier
+_JSON_KEYS = {"cnpj_cpf": "cnpj/cpf"}
+
+def _json_key(name):
+    return _JSON_KEYS.get(name, name)
+
+def _text(value):
+    """Schema fields are strings; tolerate numbers and nulls from older cached answers"""
+    if value is None:
+        return ""
+    return value if isinstance(value, str) else str(value)
+
+class _Party:
+    __slots__ = ()
+
+    @classmethod
+    def from_dict(cls, data):
+        data = data if isinstance(data, dict) else {}
+        return cls(**{f.name: _text(data.get(_json_key(f.name))) for f in fields(cls)})
+
+    def to_dict(self):
+        return {_json_key(f.name): getattr(self, f.name) for f in fields(self)}
+
+@dataclass(slots=True)
+class Sender(_Party):
+    name: str = ""
+    cnpj_cpf: str = ""
+    institution: str = ""
+    institution_cnpj: str = ""
+
+@dataclass(slots=True)
+class Recipient(_Party):
+    name: str = ""
+    cnpj_cpf: str = ""
+    institution: str = ""
+    pix_key: str = ""
+
+@dataclass(slots=True)
+class InvoiceResult:
+    """One extracted receipt in the prompt_2 schema"""
+    transaction_id: str = ""
+    transaction_number: str = ""
+    payment_method: str = ""
+    invoice_date: str = ""
+    invoice_time: str = ""
+    amount: str = ""
+    currency: str = ""
+    sender: Sender = field(default_factory=Sender)
+    recipient: Recipient = field(default_factory=Recipient)
+    additional_data: str = ""
+    image_type: str = ""
+
+    @classmethod
+    def from_dict(cls, data):
+        if not isinstance(data, dict):
+            raise ValueError(f"Expected a JSON object, got {type(data).__name__}")
+        values = {
+            f.name: _text(data.get(f.name))
+            for f in fields(cls) if f.name not in ("sender", "recipient")
+        }
+        return cls(sender=Sender.from_dict(data.get("sender")), recipient=Recipient.from_dict(data.get("recipient")), **values)
+
+    @classmethod
+    def from_json(cls, text):
+        return cls.from_dict(json.loads(text))
+
+    def to_dict(self):
+        data = {f.name: getattr(self, f.name) for f in fields(self)}
+        data["sender"] = self.sender.to_dict()
+        data["recipient"] = self.recipient.to_dict()
+        return data
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), ensure_ascii=False, separators=(",", ":"))
+
+    def flatten(self):
+        """Flat row for the results table, with sender_/recipient_ prefixed columns"""
+        row = {f.name: getattr(self, f.name) for f in fields(self) if f.name not in ("sender", "recipient")}
+        for prefix, party in (("sender", self.sender), ("recipient", self.recipient)):
+            for f in fields(party):
+                row[f"{prefix}_{f.name}"] = getattr(party, f.name)
+        return row
+
+def normalize_result(text):
+    """Parse a model answer into InvoiceResult and return its compact JSON; raises ValueError when it is not one"""
+    return InvoiceResult.from_json(text).to_json()
+
+def result_entries(result):
+    """InvoiceResults in a stored result: one for a single receipt, one per entry for a merged JSON array"""
+    data = json.loads(result) if isinstance(result, str) else result
+    return [InvoiceResult.from_dict(entry) for entry in (data if isinstance(data, list) else [data])]
+
+def flatten_result(result, filename, source=None):
+    """Flat rows of a stored result; entries of a merged array are named filename#1, filename#2, ...
+
+    source is the full item name (e.g. "chats.zip/Media/IMG-1.jpg") and goes
+    in the source column with the same suffix; it defaults to filename.
+    """
+    entries = result_entries(result)
+    source = source or filename
+    rows = []
+    for number, entry in enumerate(entries, start=1):
+        suffix = "" if len(entries) == 1 else f"#{number}"
+        row = entry.flatten()
+        row["filename"] = filename + suffix
+        row["source"] = source + suffix
+        rows.append(row)
+    return rows
+
+def _fill_missing(target, source):
+    for f in fields(target):
+        value = getattr(target, f.name)
+        if isinstance(value, _Party):
+            _fill_missing(value, getattr(source, f.name))
+        elif not value:
+            setattr(target, f.name, getattr(source, f.name))
+
+def _same_transaction(a, b):
+    """True/False when both receipts carry a transaction ID, None when one of them lacks it"""
+    id_a = a.transaction_id.replace(" ", "")
+    id_b = b.transaction_id.replace(" ", "")
+    if id_a and id_b:
+        return id_a == id_b
+    return None
+
+def _same_receipt(a, b):
+    if a == b:
+        return True
+    same = _same_transaction(a, b)
+    if same is not None:
+        return same
+    return bool(a.amount and a.invoice_date) and (a.amount, a.invoice_date) == (b.amount, b.invoice_date)
+
+def combine_results(results, adjacent_only=False):
+    """Merge the results read from parts of one file (video frames, PDF pages) into one stored result
+
+    Parts showing the same receipt (same transaction_id, or the same amount
+    and date when an ID is missing) are folded together, each filling the
+    other's empty fields. With adjacent_only, as for PDF pages, only matching
+    IDs merge anywhere; otherwise just the first receipt of a part can
+    continue the last one of the previous part (a receipt running over a
+    page break), since a statement can list several same-day payments of
+    one amount. Parts without a receipt are dropped. Returns None when
+    nothing is left, the compact object for one receipt and a JSON array
+    for several.
+    """
+    receipts = []
+    previous_last = None  # (part, receipt) last seen at the end of a part
+    for part, result in enumerate(results):
+        if not result:
+            continue
+        entries = [receipt for receipt in result_entries(result) if not (receipt.image_type == "others" and not receipt.amount)]
+        for position, receipt in enumerate(entries):
+            if adjacent_only:
+                match = next((known for known in receipts if _same_transaction(known, receipt)), None)
+                continues = position == 0 and previous_last is not None and previous_last[0] == part - 1
+                if match is None and continues and _same_transaction(previous_last[1], receipt) is None and _same_receipt(previous_last[1], receipt):
+                    match = previous_last[1]
+            else:
+                match = next((known for known in receipts if _same_receipt(known, receipt)), None)
+            if match is None:
+                receipts.append(receipt)
+                match = receipt
+            else:
+                _fill_missing(match, receipt)
+            if position == len(entries) - 1:
+                previous_last = (part, match)
+    if not receipts:
+        return None
+    if len(receipts) == 1:
+        return receipts[0].to_json()
+    return "[" + ",".join(receipt.to_json() for receipt in receipts) + "]"
+
+def _object_schema(properties):
+    return {"type": "object", "properties": properties, "required": list(properties)}
+
+def _string_schema(names):
+    return {name: {"type": "string"} for name in names}
+
+_PARTY_SCHEMA = {
+    "sender": _object_schema(_string_schema(("name", "cnpj/cpf", "institution", "institution_cnpj"))),
+    "recipient": _object_schema(_string_schema(("name", "cnpj/cpf", "institution", "pix_key")))
+}
+
+_RESULT_PROPERTIES = {
+    **_string_schema(("transaction_id", "transaction_number", "payment_method", "invoice_date",
+                      "invoice_time", "amount", "currency")),
+    **_PARTY_SCHEMA,
+    "additional_data": {"type": "string"},
+    "image_type": {"type": "string", "format": "enum", "enum": list(IMAGE_TYPES)}
+}
+
+# response_schema for one receipt per request
+RESPONSE_SCHEMA = _object_schema(_RESULT_PROPERTIES)
+
+# response_schema for gemini_img_batch_ocr: one entry per image, tagged with its position
+BATCH_RESPONSE_SCHEMA = {
+    "type": "array",
+    "items": _object_schema({"image_index": {"type": "integer"}, **_RESULT_PROPERTIES})
+}
@@ -0,0 +1,26 @@
+from archive import InvoiceArchive
+from schema import InvoiceResult, Recipient
+
+def _result(transaction_id, amount):
+    return InvoiceResult(
+        transaction_id=transaction_id, invoice_date="2024-05-02", amount=amount, currency="BRL",
+        recipient=Recipient(name="Loja Central", pix_key="loja@example.com"), image_type="screenshot"
+    ).to_json()
+
+def test_same_basename_in_one_batch_is_kept_apart(tmp_path):
+    archive = InvoiceArchive(str(tmp_path / "archive.sqlite"))
+    results = [
+        ("a.zip/IMG-WA0001.jpg", _result("E1", "10,00")),
+        ("b.zip/IMG-WA0001.jpg", _result("E2", "20,00")),
+        ("WhatsApp Images/X.jpg", _result("E3", "30,00")),
+        ("WhatsApp Images/Sent/X.jpg", _result("E4", "40,00")),
+    ]
+    assert archive.ingest_results(results, "batch") == 4
+    for transaction_id in ("E1", "E2", "E3", "E4"):
+        assert len(archive.search(transaction_id=transaction_id)) == 1
+    assert sorted(archive.search(text="loja")["source"]) == sorted(name for name, _ in results)
+
+    # Ingesting the batch again updates rows in place
+    assert archive.ingest_results(results[:1], "batch") == 1
+    assert len(archive.search()) == 4
+    archive.close()
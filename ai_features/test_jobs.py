@@ -0,0 +1,95 @@
+import io
+import os
+import types
+import threading
+import numpy as np
+from PIL import Image
+
+# utils configures the Gemini client on import; requests go to the fake backend below
+os.environ.setdefault("GEMINI_API_KEY", "test")
+import utils
+from jobs import JobQueue, drain_job
+
+def _image(seed):
+    buffer = io.BytesIO()
+    Image.fromarray((np.random.RandomState(seed).rand(120, 80, 3) * 255).astype("uint8")).save(buffer, "PNG")
+    return buffer.getvalue()
+
+class _FlakyBackend:
+    """Fails the first request, then answers every request with one receipt"""
+    def __init__(self):
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, contents, **kwargs):
+        with self._lock:
+            self.calls += 1
+            call = self.calls
+        if call == 1:
+            raise ValueError("bad request")
+        usage = types.SimpleNamespace(prompt_token_count=100, candidates_token_count=10, total_token_count=110)
+        return types.SimpleNamespace(text='{"amount":"1,00","transaction_id":"E%d"}' % call, usage_metadata=usage)
+
+def test_failed_task_is_retried_with_dedupe_on(tmp_path, monkeypatch):
+    backend = _FlakyBackend()
+    monkeypatch.setattr(utils, "ocr_backend", backend)
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"))
+    job_id = queue.create_job([(f"screenshot ({number}).png", _image(number)) for number in range(1, 7)])
+
+    list(drain_job(queue, job_id=job_id, claim_size=2, max_workers=1, batch_size=1, dedupe=True,
+                   use_cache=False, use_local_ocr=False))
+
+    assert queue.progress(job_id)['done'] == 6
+    assert all(not row['duplicate_of'] for row in queue.results(job_id))
+    # One failed request plus one per file
+    assert backend.calls == 7
+    queue.close()
+
+def test_duplicate_of_failed_image_is_sent_itself(monkeypatch):
+    from main import process_files
+
+    backend = _FlakyBackend()
+    monkeypatch.setattr(utils, "ocr_backend", backend)
+    image = _image(1)
+    outcomes = list(process_files([("a.png", image), ("copy of a.png", image)], max_workers=1, batch_size=1,
+                                  use_cache=False, use_local_ocr=False))
+
+    by_name = {outcome['name']: outcome for outcome in outcomes}
+    assert by_name["a.png"]['result'] is None
+    assert by_name["copy of a.png"]['result'] is not None
+    assert by_name["copy of a.png"]['duplicate_of'] == ""
+
+def test_finished_tasks_drop_their_bytes_and_old_jobs_are_purged(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "ocr_backend", _FlakyBackend())
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"), max_attempts=1)
+    job_id = queue.create_job([(f"{number}.png", _image(number)) for number in range(3)])
+    list(drain_job(queue, job_id=job_id, max_workers=1, batch_size=1, use_cache=False, use_local_ocr=False))
+
+    states = dict(queue.conn.execute("SELECT state, COUNT(*) FROM tasks GROUP BY state").fetchall())
+    assert states == {'done': 2, 'failed': 1}
+    assert queue.conn.execute("SELECT MAX(LENGTH(data)) FROM tasks").fetchone()[0] == 0
+
+    running_job = queue.create_job([("pending.png", _image(9))])
+    assert queue.purge(older_than_days=1) == 0
+    assert queue.purge(older_than_days=0) == 1
+    assert not queue.job_exists(job_id) and queue.job_exists(running_job)
+    queue.close()
+
+def test_budget_refusals_are_not_failures(tmp_path, monkeypatch):
+    from utils import TokenTracker
+
+    backend = _FlakyBackend()
+    backend.calls = 1  # No failing first request
+    monkeypatch.setattr(utils, "ocr_backend", backend)
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"))
+    job_id = queue.create_job([(f"{number}.png", _image(number)) for number in range(20)])
+
+    for _ in range(3):
+        outcomes = list(drain_job(queue, job_id=job_id, claim_size=4, max_workers=4, batch_size=1, use_cache=False,
+                                  use_local_ocr=False, usage_tracker=TokenTracker(max_tokens=1)))
+        assert any(outcome['skipped_budget'] for outcome in outcomes)
+
+    rows = queue.conn.execute("SELECT state, attempts, error FROM tasks").fetchall()
+    assert {state for state, _, _ in rows} == {'done', 'pending'}
+    assert all(attempts == 0 and not error for state, attempts, error in rows if state == 'pending')
+    queue.close()
@@ -0,0 +1,52 @@
+from local_ocr import extract_fields
+
+def _lines(*texts):
+    return [(text, 0.95) for text in texts]
+
+def test_labels_without_colon_keep_their_same_line_value():
+    result, confidences = extract_fields(_lines(
+        "Comprovante de transferência Pix",
+        "Valor R$ 150,00",
+        "Data 02/05/2024 14:30",
+        "De",
+        "Nome Maria Silva",
+        "CPF ***.327.923-**",
+        "Instituição Banco Inter",
+        "Para",
+        "Nome Loja TRK",
+        "CNPJ 11.222.333/0001-81",
+        "Instituição Nu Pagamentos",
+        "Chave Pix @trkbit.co",
+        "ID da transação",
+        "E12345678202405021430abcdefghijk",
+    ))
+    assert result["sender"]["institution"] == "Banco Inter"
+    assert result["recipient"]["institution"] == "Nu Pagamentos"
+    assert result["recipient"]["pix_key"] == "@trkbit.co"
+    assert result["transaction_id"] == "E12345678202405021430abcdefghijk"
+    assert min(confidences[field] for field in ("sender.institution", "recipient.institution", "recipient.pix_key")) > 0.9
+
+def test_label_followed_by_another_label_is_left_empty():
+    result, confidences = extract_fields(_lines(
+        "Para",
+        "Nome Loja TRK",
+        "Instituição financeira",
+        "Chave Pix",
+        "ID da transação",
+    ))
+    assert result["recipient"]["institution"] == ""
+    assert result["recipient"]["pix_key"] == ""
+    assert confidences["recipient.institution"] == 0.0
+    assert confidences["recipient.pix_key"] == 0.0
+
+def test_label_with_value_on_the_next_line():
+    result, _ = extract_fields(_lines(
+        "Para",
+        "Nome",
+        "Loja TRK",
+        "Instituição de destino:",
+        "Nu Pagamentos",
+    ))
+    assert result["recipient"]["name"] == "Loja TRK"
+    assert result["recipient"]["institution"] == "Nu Pagamentos"
+    assert result["recipient"]["pix_key"] == ""
@@ -0,0 +1,18 @@
+import math
+import pandas as pd
+from result_store import parse_amounts
+
+def _parse(*values):
+    return parse_amounts(pd.Series(list(values), dtype="string")).tolist()
+
+def test_brazilian_amounts():
+    assert _parse("6.790,00", "R$ 1.234,56", "10,5", "1.234.567,89") == [6790.0, 1234.56, 10.5, 1234567.89]
+
+def test_dot_thousands_without_decimals():
+    assert _parse("1.500", "R$ 12.000", "1.234.567") == [1500.0, 12000.0, 1234567.0]
+
+def test_us_amounts():
+    assert _parse("1,234.56", "1234.56", "12.50", "1,234,567") == [1234.56, 1234.56, 12.5, 1234567.0]
+
+def test_unreadable_amounts_are_nan():
+    assert all(math.isnan(value) for value in _parse("", "abc", None))
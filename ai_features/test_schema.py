@@ -0,0 +1,28 @@
+import json
+from schema import InvoiceResult, combine_results
+
+def _receipt(**values):
+    return InvoiceResult(image_type="screenshot", **values).to_json()
+
+def _count(combined):
+    if combined is None:
+        return 0
+    return len(json.loads(combined)) if combined.startswith("[") else 1
+
+def test_pdf_pages_keep_same_day_same_amount_payments_apart():
+    payment = _receipt(amount="10,00", invoice_date="01/04/2025")
+    assert _count(combine_results([payment, None, payment], adjacent_only=True)) == 2
+    assert _count(combine_results([f"[{payment},{payment}]"], adjacent_only=True)) == 2
+
+def test_pdf_pages_merge_on_ids_and_page_breaks():
+    first = _receipt(transaction_id="E1", amount="10,00")
+    assert _count(combine_results([first, None, _receipt(transaction_id="E 1", currency="BRL")], adjacent_only=True)) == 1
+    continued = combine_results([
+        _receipt(amount="10,00", invoice_date="01/04/2025"),
+        _receipt(amount="10,00", invoice_date="01/04/2025", currency="BRL")
+    ], adjacent_only=True)
+    assert json.loads(continued)["currency"] == "BRL"
+
+def test_video_frames_merge_on_amount_and_date():
+    frame = _receipt(amount="10,00", invoice_date="01/04/2025")
+    assert _count(combine_results([frame, None, frame])) == 1
@@ -0,0 +1,23 @@
+import os
+
+# utils configures the Gemini client on import; no request is made here
+os.environ.setdefault("GEMINI_API_KEY", "test")
+import main
+import video
+
+def _process_video(monkeypatch, batch_size, frames=5):
+    requests = []
+    def process_image_batch(items, use_cache=True, use_local_ocr=None):
+        requests.append([name for name, _ in items])
+        return ['{"transaction_id":"E%s"}' % name for name, _ in items]
+    monkeypatch.setattr(video, "is_available", lambda: True)
+    monkeypatch.setattr(video, "extract_keyframes", lambda data, filename: [(f"f{i}.jpg", b"") for i in range(frames)])
+    monkeypatch.setattr(main, "process_image_batch", process_image_batch)
+    main.process_video(b"", "clip.mp4", use_cache=False, use_local_ocr=False, batch_size=batch_size)
+    return requests
+
+def test_keyframes_are_sent_one_per_request_by_default(monkeypatch):
+    assert _process_video(monkeypatch, 1) == [["f0.jpg"], ["f1.jpg"], ["f2.jpg"], ["f3.jpg"], ["f4.jpg"]]
+
+def test_keyframes_are_chunked_by_batch_size(monkeypatch):
+    assert _process_video(monkeypatch, 2) == [["f0.jpg", "f1.jpg"], ["f2.jpg", "f3.jpg"], ["f4.jpg"]]
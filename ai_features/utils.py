@@ -1,46 +1,130 @@
-from prompts import prompt_2
+from prompts import prompt_2, batch_prompt_2
+import json
 import google.generativeai as genai
-from pdf2image import convert_from_path
+from preprocess import preprocess_image, PREPROCESS_CONFIG
+from scheduler import request_scheduler
+from hedging import hedged_caller, REQUEST_DEADLINE_SECONDS
+from schema import InvoiceResult, RESPONSE_SCHEMA, BATCH_RESPONSE_SCHEMA
+import metrics
+import re
 import streamlit as st
-vision_model = genai.GenerativeModel(model_name="models/gemini-2.0-flash")
-genai.configure(api_key=st.secrets["key"])
+import threading
+import contextvars
+from contextlib import contextmanager
+import os
+MODEL_NAME = "models/gemini-2.0-flash"
+vision_model = genai.GenerativeModel(model_name=MODEL_NAME)
+# Every request goes through this backend; benchmarks swap in a recorder or replay stand-in (see backends.py)
+ocr_backend = vision_model
+# Headless runs (CLI, workers) can pass the key through the environment instead of Streamlit secrets
+genai.configure(api_key=os.environ.get("GEMINI_API_KEY") or st.secrets["key"])
 
-# Global token tracking
+# Gemini 2.0 Flash paid-tier prices in USD per 1M tokens (text, image and PDF input are billed alike)
+INPUT_PRICE_PER_MILLION = 0.10
+OUTPUT_PRICE_PER_MILLION = 0.40
+
+def token_cost(input_tokens, output_tokens):
+    """Cost in USD of one request from its usage_metadata token counts"""
+    return (input_tokens * INPUT_PRICE_PER_MILLION + output_tokens * OUTPUT_PRICE_PER_MILLION) / 1_000_000
+
+class BudgetExceeded(RuntimeError):
+    """Raised instead of sending a request once the batch's spend or token budget is used up"""
+
+# Token and cost tracking, one tracker per session or job
 class TokenTracker:
-    def __init__(self):
+    """Token usage and cost of one batch, with an optional budget
+
+    max_cost (USD) and max_tokens of None mean no limit. Once either is
+    reached, no new Gemini request is dispatched for this tracker; requests
+    already in flight still finish and are counted.
+    """
+    def __init__(self, max_cost=None, max_tokens=None):
+        # OCR calls run on worker threads, so every update goes through the lock
+        self._lock = threading.Lock()
+        self.max_cost = max_cost
+        self.max_tokens = max_tokens
         self.reset()
     
     def reset(self):
-        self.total_input_tokens = 0
-        self.total_output_tokens = 0
-        self.total_tokens = 0
-        self.file_count = 0
-        self.file_details = []
+        with self._lock:
+            self.total_input_tokens = 0
+            self.total_output_tokens = 0
+            self.total_tokens = 0
+            self.total_cost = 0.0
+            self.file_count = 0
+            self.refused_requests = 0
+            self.discarded_cost = 0.0
+            self.cache_hits = 0
+            self.cache_misses = 0
+            self.file_details = []
     
-    def add_usage(self, filename, input_tokens, output_tokens, total_tokens, file_size=0, file_type=""):
-        self.total_input_tokens += input_tokens
-        self.total_output_tokens += output_tokens
-        self.total_tokens += total_tokens
-        self.file_count += 1
-        
-        self.file_details.append({
-            'filename': filename,
-            'input_tokens': input_tokens,
-            'output_tokens': output_tokens,
-            'total_tokens': total_tokens,
-            'file_size': file_size,
-            'file_type': file_type
-        })
+    def add_usage(self, filename, input_tokens, output_tokens, total_tokens, file_size=0, file_type="", original_file_size=None):
+        cost = token_cost(input_tokens, output_tokens)
+        with self._lock:
+            self.total_input_tokens += input_tokens
+            self.total_output_tokens += output_tokens
+            self.total_tokens += total_tokens
+            self.total_cost += cost
+            self.file_count += 1
+            
+            self.file_details.append({
+                'filename': filename,
+                'input_tokens': input_tokens,
+                'output_tokens': output_tokens,
+                'total_tokens': total_tokens,
+                'cost': cost,
+                'file_size': file_size,
+                'file_type': file_type,
+                'original_file_size': original_file_size if original_file_size is not None else file_size,
+                'bytes_saved': (original_file_size - file_size) if original_file_size is not None else 0
+            })
     
+    def count_cache_lookup(self, hit):
+        with self._lock:
+            if hit:
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+
+    def add_discarded_usage(self, input_tokens, output_tokens, total_tokens):
+        """Count a response that was paid for but not used (the slower hedge copy); it adds to no file"""
+        cost = token_cost(input_tokens, output_tokens)
+        with self._lock:
+            self.total_input_tokens += input_tokens
+            self.total_output_tokens += output_tokens
+            self.total_tokens += total_tokens
+            self.total_cost += cost
+            self.discarded_cost += cost
+
+    def budget_exceeded(self):
+        with self._lock:
+            return ((self.max_cost is not None and self.total_cost >= self.max_cost)
+                    or (self.max_tokens is not None and self.total_tokens >= self.max_tokens))
+
+    def check_budget(self):
+        """Raise BudgetExceeded when the budget is used up, so the request is never sent"""
+        if self.budget_exceeded():
+            with self._lock:
+                self.refused_requests += 1
+            raise BudgetExceeded(f"Budget reached (${self.total_cost:.4f}, {self.total_tokens:,} tokens)")
+
     def get_summary(self):
-        return {
-            'total_input_tokens': self.total_input_tokens,
-            'total_output_tokens': self.total_output_tokens,
-            'total_tokens': self.total_tokens,
-            'file_count': self.file_count,
-            'avg_tokens_per_file': self.total_tokens / max(1, self.file_count),
-            'details': self.file_details
-        }
+        with self._lock:
+            return {
+                'total_input_tokens': self.total_input_tokens,
+                'total_output_tokens': self.total_output_tokens,
+                'total_tokens': self.total_tokens,
+                'total_cost': self.total_cost,
+                'file_count': self.file_count,
+                'avg_tokens_per_file': self.total_tokens / max(1, self.file_count),
+                'max_cost': self.max_cost,
+                'max_tokens': self.max_tokens,
+                'refused_requests': self.refused_requests,
+                'discarded_cost': self.discarded_cost,
+                'cache_hits': self.cache_hits,
+                'cache_misses': self.cache_misses,
+                'details': list(self.file_details)
+            }
     
     def print_summary(self):
         print("\n" + "="*50)
@@ -51,16 +135,81 @@ class TokenTracker:
         print(f"Total output tokens: {self.total_output_tokens:,}")
         print(f"Total tokens used: {self.total_tokens:,}")
         print(f"Average tokens per file: {self.total_tokens / max(1, self.file_count):.1f}")
+        print(f"Total cost: ${self.total_cost:.6f}")
+        if self.discarded_cost:
+            print(f"  of which discarded hedge copies: ${self.discarded_cost:.6f}")
+        if self.cache_hits or self.cache_misses:
+            print(f"Cache hits: {self.cache_hits:,} | misses: {self.cache_misses:,} | "
+                  f"hit rate: {self.cache_hits / (self.cache_hits + self.cache_misses):.1%}")
+        if self.refused_requests:
+            print(f"Budget reached: {self.refused_requests:,} requests were not sent")
         print("="*50)
 
-# Global instance
+# Process-wide fallback for the CLI; the app and workers bind their own tracker with use_token_tracker()
 token_tracker = TokenTracker()
+_current_token_tracker = contextvars.ContextVar("current_token_tracker", default=None)
 
-def pdf_to_images(pdf_path, output_folder, dpi=300):
-    images = convert_from_path(pdf_path, dpi=dpi)
-    for i, image in enumerate(images):
-        image_path = f"{output_folder}/page_{i+1}.png"
-        image.save(image_path, "PNG")
+def current_token_tracker():
+    """The tracker of the batch running in this context, or the process-wide one"""
+    return _current_token_tracker.get() or token_tracker
+
+def set_token_tracker(tracker):
+    """Make tracker current for the rest of this context, e.g. context.run(set_token_tracker, tracker)"""
+    _current_token_tracker.set(tracker)
+
+@contextmanager
+def use_token_tracker(tracker):
+    """Count usage in this context against tracker; process_files carries it over to its workers"""
+    token = _current_token_tracker.set(tracker)
+    try:
+        yield tracker
+    finally:
+        _current_token_tracker.reset(token)
+
+def _record_usage(usage, file_type, uploaded_bytes, original_bytes=None):
+    """Count one request's tokens and upload size in the current job's metrics"""
+    metrics.inc("requests_total", file_type=file_type)
+    metrics.inc("tokens_total", usage.prompt_token_count, kind="input")
+    metrics.inc("tokens_total", usage.candidates_token_count, kind="output")
+    metrics.inc("uploaded_bytes_total", uploaded_bytes)
+    if original_bytes is not None:
+        metrics.inc("bytes_saved_total", original_bytes - uploaded_bytes)
+
+def generate_content(contents, response_schema=RESPONSE_SCHEMA):
+    """Send a request through the shared scheduler so rate limits are respected and retried
+
+    The answer is constrained to response_schema JSON. Each attempt has a
+    deadline, and a slow attempt may be hedged with a second copy inside the
+    same scheduler slot; whichever answers first is used and the tokens of
+    the other still count against the batch's budget.
+    """
+    tracker = current_token_tracker()
+    # Checked before queueing, so a spent budget stops dispatch instead of waiting for a slot first
+    tracker.check_budget()
+    generation_config = {"response_mime_type": "application/json", "response_schema": response_schema}
+
+    def record_discarded(response):
+        usage = getattr(response, 'usage_metadata', None)
+        if usage is None:
+            return
+        tracker.add_discarded_usage(usage.prompt_token_count, usage.candidates_token_count, usage.total_token_count)
+        request_scheduler.add_tokens(usage.total_token_count)
+        metrics.inc("tokens_total", usage.prompt_token_count, kind="input")
+        metrics.inc("tokens_total", usage.candidates_token_count, kind="output")
+
+    return request_scheduler.call(lambda: hedged_caller.call(
+        lambda: ocr_backend.generate_content(
+            contents,
+            generation_config=generation_config,
+            request_options={"timeout": REQUEST_DEADLINE_SECONDS}
+        ),
+        on_discarded=record_discarded
+    ))
+
+def set_ocr_backend(backend):
+    """Route generate_content through backend; pass vision_model to go back to Gemini"""
+    global ocr_backend
+    ocr_backend = backend
 
 def clean_text(response):
     # Check if response is None or empty
@@ -71,25 +220,41 @@ def clean_text(response):
     if not isinstance(response, str):
         response = str(response)
     
-    # Clean the text
-    response = response.replace("`", "")
-    response = response.replace("json", "")
+    # Strip a surrounding Markdown code fence; the JSON itself is left untouched
+    response = re.sub(r"^\s*```(?:json)?\s*|\s*```\s*$", "", response)
     return response.strip()
 
-def gemini_img_ocr(image_data, file_extension, filename="unknown"):
+def _prepare_image(image_data, file_extension, filename, preprocess=None):
+    """Return (image_data, mime_type) ready to upload"""
+    mime_type = None
+    if file_extension == ".jpg" or file_extension == ".jpeg":
+        mime_type = "image/jpeg"
+    elif file_extension == ".png":
+        mime_type = "image/png"
+
+    preprocess = PREPROCESS_CONFIG['enabled'] if preprocess is None else preprocess
+    if preprocess:
+        try:
+            with metrics.span("preprocess", file=filename):
+                image_data, processed_mime_type = preprocess_image(image_data)
+            mime_type = processed_mime_type or mime_type
+        except Exception as e:
+            print(f"Preprocessing failed for {filename}, uploading original: {e}")
+    return image_data, mime_type
+
+def gemini_img_ocr(image_data, file_extension, filename="unknown", preprocess=None):
     try:
-        mime_type = None
-        if file_extension == ".jpg" or file_extension == ".jpeg":
-            mime_type = "image/jpeg"
-        elif file_extension == ".png":
-            mime_type = "image/png"
+        original_size = len(image_data)
+        image_data, mime_type = _prepare_image(image_data, file_extension, filename, preprocess)
         
-        contents = [
-            {"mime_type": mime_type, "data": image_data},
-            {"text": prompt_2},
-        ]
+        with metrics.span("build_request", file=filename):
+            contents = [
+                {"mime_type": mime_type, "data": image_data},
+                {"text": prompt_2},
+            ]
         
-        response = vision_model.generate_content(contents)
+        with metrics.span("model", file=filename):
+            response = generate_content(contents)
         
         # Track token usage
         if response and hasattr(response, 'usage_metadata'):
@@ -99,21 +264,16 @@ def gemini_img_ocr(image_data, file_extension, filename="unknown"):
             total_tokens = usage.total_token_count
             
             # Add to tracker
-            token_tracker.add_usage(
+            current_token_tracker().add_usage(
                 filename=filename,
                 input_tokens=input_tokens,
                 output_tokens=output_tokens,
                 total_tokens=total_tokens,
                 file_size=len(image_data),
-                file_type="image"
+                file_type="image",
+                original_file_size=original_size
             )
-            
-            print(f"📊 {filename} - IMAGE TOKEN USAGE:")
-            print(f"   Input tokens: {input_tokens:,}")
-            print(f"   Output tokens: {output_tokens:,}")
-            print(f"   Total tokens: {total_tokens:,}")
-            print(f"   Image size: {len(image_data):,} bytes")
-            print("-" * 40)
+            _record_usage(usage, "image", len(image_data), original_size)
         
         # Check if response and response.text exist
         if response and hasattr(response, 'text') and response.text:
@@ -122,19 +282,96 @@ def gemini_img_ocr(image_data, file_extension, filename="unknown"):
             print(f"Warning: Empty or invalid response from Gemini for image: {filename}")
             return None
             
+    except BudgetExceeded:
+        # Not a failure of this file: it was never sent and stays for a resume
+        raise
     except Exception as e:
         print(f"Error in gemini_img_ocr for {filename}: {e}")
         return None
 
+def _split_tokens(tokens, count, index):
+    # The first image absorbs the rounding remainder so totals stay exact
+    return tokens // count + (tokens % count if index == 0 else 0)
+
+def gemini_img_batch_ocr(images, preprocess=None):
+    """Extract several images with a single request so the prompt is only sent once
+
+    images is a list of (image_data, file_extension, filename). Returns a list
+    with one JSON text per image, or None for images missing from the response.
+    """
+    filenames = [filename for _, _, filename in images]
+    results = [None] * len(images)
+    try:
+        prepared = []
+        original_sizes = []
+        for image_data, file_extension, filename in images:
+            original_sizes.append(len(image_data))
+            prepared.append(_prepare_image(image_data, file_extension, filename, preprocess))
+        uploaded_sizes = [len(image_data) for image_data, _ in prepared]
+
+        batch_name = ", ".join(filenames)
+        with metrics.span("build_request", file=batch_name):
+            contents = []
+            for index, (image_data, mime_type) in enumerate(prepared):
+                contents.append({"text": f"Image {index}:"})
+                contents.append({"mime_type": mime_type, "data": image_data})
+            contents.append({"text": batch_prompt_2})
+
+        with metrics.span("model", file=batch_name):
+            response = generate_content(contents, response_schema=BATCH_RESPONSE_SCHEMA)
+
+        # Track token usage, split evenly over the images in the request
+        if response and hasattr(response, 'usage_metadata'):
+            usage = response.usage_metadata
+            count = len(images)
+            for index, filename in enumerate(filenames):
+                current_token_tracker().add_usage(
+                    filename=filename,
+                    input_tokens=_split_tokens(usage.prompt_token_count, count, index),
+                    output_tokens=_split_tokens(usage.candidates_token_count, count, index),
+                    total_tokens=_split_tokens(usage.total_token_count, count, index),
+                    file_size=uploaded_sizes[index],
+                    file_type="image (batch)",
+                    original_file_size=original_sizes[index]
+                )
+            _record_usage(usage, "image (batch)", sum(uploaded_sizes), sum(original_sizes))
+
+        if not (response and hasattr(response, 'text') and response.text):
+            print(f"Warning: Empty or invalid response from Gemini for batch: {', '.join(filenames)}")
+            return results
+
+        with metrics.span("parse", file=batch_name):
+            entries = json.loads(clean_text(response.text))
+            if isinstance(entries, dict):
+                entries = [entries]
+            for entry in entries:
+                if not isinstance(entry, dict):
+                    continue
+                try:
+                    index = int(entry.pop("image_index"))
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if 0 <= index < len(images) and results[index] is None:
+                    results[index] = InvoiceResult.from_dict(entry).to_json()
+        return results
+
+    except BudgetExceeded:
+        raise
+    except Exception as e:
+        print(f"Error in gemini_img_batch_ocr for {', '.join(filenames)}: {e}")
+        return results
+
 def gemini_pdf_ocr(pdf_data, filename="unknown"):
     try:
         mime_type = "application/pdf"
-        contents = [
-            {"mime_type": mime_type, "data": pdf_data},
-            {"text": prompt_2},
-        ]
+        with metrics.span("build_request", file=filename):
+            contents = [
+                {"mime_type": mime_type, "data": pdf_data},
+                {"text": prompt_2},
+            ]
         
-        response = vision_model.generate_content(contents)
+        with metrics.span("model", file=filename):
+            response = generate_content(contents)
         
         # Track token usage
         if response and hasattr(response, 'usage_metadata'):
@@ -144,7 +381,7 @@ def gemini_pdf_ocr(pdf_data, filename="unknown"):
             total_tokens = usage.total_token_count
             
             # Add to tracker
-            token_tracker.add_usage(
+            current_token_tracker().add_usage(
                 filename=filename,
                 input_tokens=input_tokens,
                 output_tokens=output_tokens,
@@ -152,13 +389,7 @@ def gemini_pdf_ocr(pdf_data, filename="unknown"):
                 file_size=len(pdf_data),
                 file_type="pdf"
             )
-            
-            print(f"📊 {filename} - PDF TOKEN USAGE:")
-            print(f"   Input tokens: {input_tokens:,}")
-            print(f"   Output tokens: {output_tokens:,}")
-            print(f"   Total tokens: {total_tokens:,}")
-            print(f"   PDF size: {len(pdf_data):,} bytes")
-            print("-" * 40)
+            _record_usage(usage, "pdf", len(pdf_data))
         
         # Check if response and response.text exist
         if response and hasattr(response, 'text') and response.text:
@@ -167,18 +398,45 @@ def gemini_pdf_ocr(pdf_data, filename="unknown"):
             print(f"Warning: Empty or invalid response from Gemini for PDF: {filename}")
             return None
             
+    except BudgetExceeded:
+        raise
     except Exception as e:
         print(f"Error in gemini_pdf_ocr for {filename}: {e}")
         return None
 
-def get_token_usage_summary():
+def get_token_usage_summary(tracker=None):
     """Get token usage summary for display in Streamlit"""
-    return token_tracker.get_summary()
+    return (tracker or current_token_tracker()).get_summary()
 
 def reset_token_tracker():
-    """Reset token tracking (useful when starting new batch)"""
+    """Reset the process-wide tracker (useful when starting a new CLI batch)"""
     token_tracker.reset()
 
-def print_token_summary():
+def print_token_summary(tracker=None):
     """Print token usage summary to console"""
-    token_tracker.print_summary()
\ No newline at end of file
+    (tracker or current_token_tracker()).print_summary()
+    scheduler_summary = request_scheduler.get_summary()
+    print(f"Scheduler: concurrency limit {scheduler_summary['concurrency_limit']} | "
+          f"retries {scheduler_summary['retries']:,} ({scheduler_summary['rate_limited']:,} rate limited) | "
+          f"throttled {scheduler_summary['throttled_seconds']:.1f}s")
+    latency_summary = get_latency_summary()
+    if latency_summary['count']:
+        print(f"Request latency: p50 {latency_summary['p50']:.2f}s | p95 {latency_summary['p95']:.2f}s | "
+              f"p99 {latency_summary['p99']:.2f}s | hedged {latency_summary['hedged']:,} "
+              f"({latency_summary['hedge_wins']:,} won)")
+    print_stage_summary()
+
+def print_stage_summary(registry=None):
+    """Print per-stage timings of a job registry, or of the whole process"""
+    registry = registry or metrics.pipeline_metrics
+    for row in registry.stage_summary():
+        print(f"Stage {row['stage']}: {row['count']:,} calls | total {row['total']:.2f}s | "
+              f"mean {row['mean'] * 1000:.1f}ms | p95 {row['p95'] * 1000:.0f}ms")
+
+def get_latency_summary():
+    """Get the Gemini request latency histogram and hedging counters"""
+    return hedged_caller.get_summary()
+
+def get_stage_summary(registry=None):
+    """Get per-stage timings for display in Streamlit"""
+    return (registry or metrics.pipeline_metrics).stage_summary()
\ No newline at end of file
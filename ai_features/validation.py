@@ -0,0 +1,191 @@
+import os
+import time
+import sqlite3
+import threading
+import numpy as np
+import pandas as pd
+from local_ocr import E2E_PATTERN
+
+DEFAULT_PAYMENTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "payments.sqlite")
+DOCUMENT_COLUMNS = ("sender_cnpj_cpf", "recipient_cnpj_cpf")
+INSERT_CHUNK_SIZE = 10_000
+# Fixed categories, so chunks of results concatenate without falling back to object columns
+DOCUMENT_STATUSES = ("valid", "invalid", "masked", "missing")
+TRANSACTION_ID_STATUSES = ("valid", "not_e2e", "missing")
+
+# Check digit weights (Receita Federal); CPF weights count down from 10 and 11
+CPF_WEIGHTS = (np.arange(10, 1, -1), np.arange(11, 1, -1))
+CNPJ_WEIGHTS = (np.array([5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2]), np.array([6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2]))
+
+def _digit_matrix(digits, length):
+    """Stack equal-length digit strings into an (n, length) int matrix without a Python loop per row"""
+    return (np.frombuffer("".join(digits).encode("ascii"), dtype=np.uint8).reshape(-1, length) - 48).astype(np.int64)
+
+def _cpf_ok(matrix):
+    first = (matrix[:, :9] @ CPF_WEIGHTS[0]) * 10 % 11 % 10
+    second = (matrix[:, :10] @ CPF_WEIGHTS[1]) * 10 % 11 % 10
+    return (first == matrix[:, 9]) & (second == matrix[:, 10])
+
+def _cnpj_ok(matrix):
+    ok = np.ones(len(matrix), dtype=bool)
+    for length, weights in zip((12, 13), CNPJ_WEIGHTS):
+        remainder = (matrix[:, :length] @ weights) % 11
+        ok &= np.where(remainder < 2, 0, 11 - remainder) == matrix[:, length]
+    return ok
+
+def document_status(values):
+    """Classify CNPJ/CPF strings as 'valid', 'invalid', 'masked' (bank-printed with *) or 'missing'"""
+    text = values.astype("string").fillna("").str.strip()
+    digits = text.str.replace(r"[^0-9]", "", regex=True)
+    lengths = digits.str.len().to_numpy()
+    status = np.full(len(text), "invalid", dtype=object)
+    status[(text == "").to_numpy()] = "missing"
+    masked = text.str.contains("*", regex=False).to_numpy()
+
+    for length, check in ((11, _cpf_ok), (14, _cnpj_ok)):
+        rows = np.flatnonzero((lengths == length) & ~masked)
+        if len(rows):
+            matrix = _digit_matrix(digits.iloc[rows].tolist(), length)
+            # All-equal numbers such as 000.000.000-00 pass the arithmetic but are never issued
+            ok = check(matrix) & ~(matrix == matrix[:, :1]).all(axis=1)
+            status[rows[ok]] = "valid"
+    status[masked] = "masked"
+    return pd.Series(pd.Categorical(status, categories=DOCUMENT_STATUSES), index=values.index)
+
+def transaction_id_status(values):
+    """'valid' for a Pix end-to-end ID, 'not_e2e' for any other identifier, 'missing' when empty"""
+    text = values.astype("string").fillna("").str.replace(" ", "", regex=False)
+    status = np.where(text.str.fullmatch(E2E_PATTERN.pattern).fillna(False).to_numpy(), "valid", "not_e2e")
+    status[(text == "").to_numpy()] = "missing"
+    return pd.Series(pd.Categorical(status, categories=TRANSACTION_ID_STATUSES), index=values.index)
+
+def validate_frame(df):
+    """Add <column>_status for the CNPJ/CPF columns and transaction_id in one vectorized pass"""
+    for column in DOCUMENT_COLUMNS:
+        if column in df.columns:
+            df[f"{column}_status"] = document_status(df[column])
+    if "transaction_id" in df.columns:
+        df["transaction_id_status"] = transaction_id_status(df["transaction_id"])
+    return df
+
+def _payment_keys(df):
+    """(transaction key, amount+date+Pix key) per row; empty strings where the row has too little to match on"""
+    def column(name):
+        return df[name].astype("string").fillna("").str.strip() if name in df.columns else pd.Series("", index=df.index, dtype="string")
+
+    transaction_keys = column("transaction_id").str.replace(" ", "", regex=False).str.upper()
+    amounts = df["amount_value"] if "amount_value" in df.columns else pd.Series(np.nan, index=df.index)
+    dates = column("invoice_date")
+    pix_keys = column("recipient_pix_key").str.lower()
+    complete = amounts.notna() & (dates != "") & (pix_keys != "")
+    payment_keys = (amounts.round(2).astype("string") + "|" + dates + "|" + pix_keys).where(complete, "").fillna("")
+    return transaction_keys, payment_keys
+
+class PaymentIndex:
+    """Hash index of every payment seen, kept in SQLite so resubmissions are caught across batches
+
+    flag() compares a result frame against itself and earlier batches;
+    record() adds the frame's payments for later batches.
+    """
+    def __init__(self, path=DEFAULT_PAYMENTS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        # key -> (batch, filename) of the first sighting, loaded once from disk
+        self._transactions = None
+        self._payments = None
+
+    def _load(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            # Lookups go through the in-memory dicts, so the table only needs to find a batch to replace it
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS payments ("
+                " batch TEXT NOT NULL,"
+                " filename TEXT NOT NULL,"
+                " transaction_key TEXT NOT NULL,"
+                " payment_key TEXT NOT NULL,"
+                " seen_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_payments_batch ON payments (batch)")
+            self._transactions = {}
+            self._payments = {}
+            for batch, filename, transaction_key, payment_key in self._conn.execute(
+                "SELECT batch, filename, transaction_key, payment_key FROM payments ORDER BY seen_at"
+            ):
+                if transaction_key:
+                    self._transactions.setdefault(transaction_key, (batch, filename))
+                if payment_key:
+                    self._payments.setdefault(payment_key, (batch, filename))
+
+    @staticmethod
+    def _earlier(keys, seen, batch):
+        """'batch/filename' of an earlier batch's sighting of each key, or ''"""
+        earlier = {}
+        for key in keys[keys != ""].unique().tolist():
+            sighting = seen.get(key)
+            if sighting is not None and sighting[0] != batch:
+                earlier[key] = f"{sighting[0]}/{sighting[1]}"
+        return keys.map(earlier).fillna("").astype("string")
+
+    def flag(self, df, batch):
+        """Add payment_flag ('duplicate', 'suspicious' or '') and payment_flag_source to df
+
+        'duplicate' means the same transaction ID was seen before, in this
+        batch or an earlier one. 'suspicious' means a different transaction ID
+        with the same amount, date and recipient Pix key.
+        """
+        transaction_keys, payment_keys = _payment_keys(df)
+        filenames = df["filename"].astype("string") if "filename" in df.columns else pd.Series("", index=df.index, dtype="string")
+
+        with self._lock:
+            self._load()
+            earlier_transaction = self._earlier(transaction_keys, self._transactions, batch)
+            earlier_payment = self._earlier(payment_keys, self._payments, batch)
+
+        # Later copies within this batch point at the first row with the same key
+        first_transaction = filenames.groupby(transaction_keys).transform("first").where(
+            (transaction_keys != "") & transaction_keys.duplicated(), "")
+        first_payment = filenames.groupby(payment_keys).transform("first").where(
+            (payment_keys != "") & payment_keys.duplicated(), "")
+
+        transaction_source = earlier_transaction.where(earlier_transaction != "", first_transaction.astype("string")).fillna("")
+        payment_source = earlier_payment.where(earlier_payment != "", first_payment.astype("string")).fillna("")
+
+        duplicate = (transaction_source != "").to_numpy()
+        suspicious = (payment_source != "").to_numpy() & ~duplicate
+        df["payment_flag"] = pd.Categorical(
+            np.select([duplicate, suspicious], ["duplicate", "suspicious"], ""),
+            categories=["", "duplicate", "suspicious"]
+        )
+        df["payment_flag_source"] = np.select([duplicate, suspicious], [transaction_source, payment_source], "")
+        return df
+
+    def record(self, df, batch):
+        """Remember the frame's payments; recording a batch again replaces its earlier rows"""
+        transaction_keys, payment_keys = _payment_keys(df)
+        filenames = df["filename"].astype("string").fillna("") if "filename" in df.columns else pd.Series("", index=df.index, dtype="string")
+        useful = ((transaction_keys != "") | (payment_keys != "")).to_numpy()
+        # tolist() converts whole Arrow columns at once; iterating a Series goes element by element
+        rows = list(zip(filenames[useful].tolist(), transaction_keys[useful].tolist(), payment_keys[useful].tolist()))
+        now = time.time()
+        with self._lock:
+            self._load()
+            self._conn.execute("DELETE FROM payments WHERE batch = ?", (batch,))
+            for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+                self._conn.executemany(
+                    "INSERT INTO payments (batch, filename, transaction_key, payment_key, seen_at) VALUES (?, ?, ?, ?, ?)",
+                    [(batch, filename, transaction_key, payment_key, now) for filename, transaction_key, payment_key in rows[start:start + INSERT_CHUNK_SIZE]]
+                )
+            self._conn.commit()
+            for filename, transaction_key, payment_key in rows:
+                if transaction_key:
+                    self._transactions.setdefault(transaction_key, (batch, filename))
+                if payment_key:
+                    self._payments.setdefault(payment_key, (batch, filename))
+
+# Global instance, shared like the result cache
+payment_index = PaymentIndex()
@@ -0,0 +1,127 @@
+import os
+import tempfile
+import numpy as np
+from dedup import DuplicateIndex
+
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".3gp")
+
+# Defaults for picking receipt keyframes out of a screen recording or phone video
+VIDEO_CONFIG = {
+    'sample_fps': 5.0,  # Frames analysed per second of video; the rest are only grabbed, not decoded
+    # Mean absolute thumbnail difference (0-255) above which the picture is moving; hand-held
+    # phone videos of a screen jitter by 5-10 even when the view holds still
+    'motion_threshold': 10.0,
+    'min_stable_seconds': 0.4,  # A view must hold still this long to count as a receipt on screen
+    'min_sharpness': 150.0,  # Laplacian variance below which a frame is too blurry to read
+    'max_keyframes': 12
+}
+
+# Frame differences are measured on a tiny grayscale thumbnail, sharpness on a mid-sized one
+MOTION_THUMBNAIL = (90, 160)
+SHARPNESS_LONG_EDGE = 960
+
+_cv2_available = None
+
+def is_available():
+    """True when OpenCV can be imported to decode videos"""
+    global _cv2_available
+    if _cv2_available is None:
+        try:
+            import cv2
+            _cv2_available = True
+        except ImportError:
+            _cv2_available = False
+    return _cv2_available
+
+def _sharpness(cv2, gray):
+    """Variance of the Laplacian: high for crisp text, low for motion blur and defocus"""
+    scale = SHARPNESS_LONG_EDGE / max(gray.shape)
+    if scale < 1:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+def iter_stable_frames(video_path, config=None):
+    """Yield (timestamp, sharpness, BGR frame) for the sharpest frame of each stretch where the picture holds still
+
+    Frames are decoded one at a time, so memory does not grow with the
+    length of the video. A stretch ends when the thumbnail difference to
+    the previous analysed frame jumps above motion_threshold (a scroll or
+    a scene change).
+    """
+    import cv2
+
+    config = {**VIDEO_CONFIG, **(config or {})}
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        raise ValueError("Could not open video")
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+    step = max(1, round(fps / config['sample_fps']))
+    min_stable_samples = max(1, round(config['min_stable_seconds'] * fps / step))
+
+    previous = None
+    best = None  # (sharpness, index, frame) of the current stretch
+    stable_samples = 0
+    index = 0
+    try:
+        while True:
+            # grab() skips frames without converting them; only sampled ones are retrieved
+            if not capture.grab():
+                break
+            if index % step:
+                index += 1
+                continue
+            ok, frame = capture.retrieve()
+            if not ok:
+                break
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            thumbnail = cv2.resize(gray, MOTION_THUMBNAIL, interpolation=cv2.INTER_AREA).astype(np.int16)
+            moving = previous is not None and float(np.abs(thumbnail - previous).mean()) > config['motion_threshold']
+            previous = thumbnail
+
+            if moving:
+                if best is not None and stable_samples >= min_stable_samples and best[0] >= config['min_sharpness']:
+                    yield best[1] / fps, best[0], best[2]
+                best = None
+                stable_samples = 0
+            else:
+                stable_samples += 1
+                sharpness = _sharpness(cv2, gray)
+                if best is None or sharpness > best[0]:
+                    best = (sharpness, index, frame)
+            index += 1
+        if best is not None and stable_samples >= min_stable_samples and best[0] >= config['min_sharpness']:
+            yield best[1] / fps, best[0], best[2]
+    finally:
+        capture.release()
+
+def extract_keyframes(video_data, filename, config=None):
+    """Return [(frame name, PNG bytes)] for the distinct, sharp, stable views in a video
+
+    Near-identical keyframes (the same receipt shown twice) are dropped with
+    the same dHash index used for duplicate uploads.
+    """
+    import cv2
+
+    config = {**VIDEO_CONFIG, **(config or {})}
+    # OpenCV only decodes from a path, so the upload is spilled to a temporary file
+    suffix = os.path.splitext(filename)[1] or ".mp4"
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
+        f.write(video_data)
+        video_path = f.name
+    try:
+        duplicate_index = DuplicateIndex()
+        keyframes = []
+        for timestamp, sharpness, frame in iter_stable_frames(video_path, config):
+            ok, encoded = cv2.imencode(".png", frame)
+            if not ok:
+                continue
+            frame_name = f"{filename}@{timestamp:06.2f}s.png"
+            if duplicate_index.match_or_add(frame_name, encoded.tobytes()) is not None:
+                continue
+            keyframes.append((frame_name, encoded.tobytes()))
+            if len(keyframes) >= config['max_keyframes']:
+                print(f"🎞️ {filename}: stopped at {config['max_keyframes']} keyframes")
+                break
+        return keyframes
+    finally:
+        os.remove(video_path)
@@ -0,0 +1,274 @@
+import os
+import sys
+import time
+import queue
+import sqlite3
+import hashlib
+import argparse
+from ingest import is_supported, is_archive, iter_input_paths
+from archive import invoice_archive
+
+DEFAULT_MANIFEST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "watch_manifest.sqlite")
+
+# Defaults for the watch-folder daemon
+WATCH_CONFIG = {
+    'debounce_seconds': 2.0,  # A file must keep its size and mtime this long before it is read
+    'batch_size': 16,  # Files handed to process_files at once
+    'poll_seconds': 5.0,  # Rescan interval when watchdog is not available
+    'tick_seconds': 0.5
+}
+
+def _wanted(path):
+    return is_supported(path) or is_archive(path)
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class Manifest:
+    """(path, size, mtime, hash) of every file already processed, so restarts only pick up new or changed files"""
+    def __init__(self, path=DEFAULT_MANIFEST_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " path TEXT PRIMARY KEY,"
+            " size INTEGER NOT NULL,"
+            " mtime REAL NOT NULL,"
+            " content_hash TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " processed_at REAL NOT NULL)"
+        )
+        # path -> (size, mtime, hash, status); loaded once so checking a file never queries SQLite.
+        # Failed files are left out, so a restart gives them another try
+        self.entries = {
+            path: (size, mtime, content_hash, status)
+            for path, size, mtime, content_hash, status in self.conn.execute(
+                "SELECT path, size, mtime, content_hash, status FROM files WHERE status != 'failed'"
+            )
+        }
+
+    def close(self):
+        self.conn.close()
+
+    def is_current(self, path, size, mtime):
+        entry = self.entries.get(path)
+        return entry is not None and entry[0] == size and entry[1] == mtime
+
+    def same_content(self, path, content_hash):
+        """True when path was archived with exactly these bytes; a failed file never counts, so touching it retries it"""
+        entry = self.entries.get(path)
+        return entry is not None and entry[2] == content_hash and entry[3] == "done"
+
+    def record(self, rows):
+        """Store (path, size, mtime, hash, status) rows in one transaction"""
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO files (path, size, mtime, content_hash, status, processed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [(*row, now) for row in rows]
+            )
+        for path, size, mtime, content_hash, status in rows:
+            self.entries[path] = (size, mtime, content_hash, status)
+
+class FolderWatcher:
+    """Watches a folder and archives the receipts of new or changed files in micro-batches
+
+    Change events come from watchdog (inotify on Linux) when it is
+    installed; otherwise the folder is rescanned every poll_seconds, which
+    only stats files. A file is read once its size and mtime have held still
+    for debounce_seconds, so half-copied media is never sent.
+    """
+    def __init__(self, folder, manifest=None, batch=None, config=None, **process_options):
+        self.folder = os.path.abspath(folder)
+        self.manifest = manifest or Manifest()
+        self.batch = batch or f"watch:{os.path.basename(self.folder)}"
+        self.config = {**WATCH_CONFIG, **(config or {})}
+        self.process_options = process_options
+        self.events = queue.Queue()
+        self.pending = {}  # path -> (size, mtime, time the stat last changed)
+        self.observer = None
+        self.processed = 0
+
+    def start_observer(self, force_polling=False):
+        """Subscribe to file events; returns False when the folder has to be polled instead"""
+        if force_polling:
+            return False
+        try:
+            from watchdog.observers import Observer
+            from watchdog.events import FileSystemEventHandler
+        except ImportError:
+            print("watchdog is not installed, polling the folder instead (pip install watchdog)")
+            return False
+
+        events = self.events
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if not event.is_directory:
+                    # Moves into the folder (e.g. a finished download renamed in place) carry the new path
+                    events.put(getattr(event, "dest_path", "") or event.src_path)
+
+        self.observer = Observer()
+        self.observer.schedule(Handler(), self.folder, recursive=True)
+        self.observer.start()
+        return True
+
+    def scan(self):
+        """Queue every file the manifest does not know in its current size and mtime"""
+        for root, dirs, files in os.walk(self.folder):
+            dirs.sort()
+            for name in sorted(files):
+                self.events.put(os.path.join(root, name))
+
+    def _collect_events(self):
+        now = time.time()
+        while True:
+            try:
+                path = self.events.get_nowait()
+            except queue.Empty:
+                return
+            path = os.fsdecode(path)
+            if not _wanted(path):
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                self.pending.pop(path, None)
+                continue
+            if self.manifest.is_current(path, stat.st_size, stat.st_mtime):
+                self.pending.pop(path, None)
+                continue
+            known = self.pending.get(path)
+            if known is None or known[:2] != (stat.st_size, stat.st_mtime):
+                # Files already older than the debounce window (e.g. found by the startup scan) are ready at once
+                changed_at = min(now, stat.st_mtime) if known is None else now
+                self.pending[path] = (stat.st_size, stat.st_mtime, changed_at)
+
+    def _ready_paths(self):
+        """Pending files whose size and mtime have not moved for debounce_seconds"""
+        now = time.time()
+        ready = []
+        for path, (size, mtime, changed_at) in list(self.pending.items()):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                del self.pending[path]
+                continue
+            if (stat.st_size, stat.st_mtime) != (size, mtime):
+                self.pending[path] = (stat.st_size, stat.st_mtime, now)
+            elif now - changed_at >= self.config['debounce_seconds']:
+                ready.append(path)
+        return ready
+
+    def process_batch(self, paths):
+        """OCR a micro-batch of settled files, archive their receipts and mark them in the manifest"""
+        # Imported here so the manifest and scanning work without loading the Gemini client
+        from main import process_files
+
+        stats = {}
+        for path in list(paths):
+            try:
+                stat = os.stat(path)
+                content_hash = file_hash(path)
+            except FileNotFoundError:
+                continue
+            self.pending.pop(path, None)
+            stats[path] = (stat.st_size, stat.st_mtime, content_hash)
+        # A touched file with the same bytes as its archived version only needs its manifest entry refreshed
+        unchanged = [path for path, (_, _, content_hash) in stats.items() if self.manifest.same_content(path, content_hash)]
+        changed = [path for path in stats if path not in unchanged]
+
+        sources = []  # item position -> file it came from; archives expand into several items
+        def items():
+            for path in changed:
+                for item in iter_input_paths([path]):
+                    sources.append(path)
+                    yield item
+
+        results = []
+        failed = set()
+        skipped = set()  # Left out of the manifest, so they are picked up again
+        for outcome in process_files(items(), **self.process_options):
+            source = sources[outcome['index']]
+            if outcome['skipped_budget']:
+                skipped.add(source)
+                continue
+            status = "✅" if outcome['result'] is not None else "❌"
+            print(f"{status} {os.path.relpath(outcome['name'], self.folder)}")
+            if outcome['result'] is None:
+                failed.add(source)
+            else:
+                results.append((outcome['name'], outcome['result']))
+
+        archived = invoice_archive.ingest_results(results, self.batch) if results else 0
+        self.manifest.record(
+            [(path, *stats[path], "failed" if path in failed else "done") for path in changed if path not in skipped]
+            + [(path, *stats[path], "done") for path in unchanged]
+        )
+        self.processed += len(changed)
+        if changed:
+            print(f"📦 Archived {archived} receipts from {len(changed)} files as {self.batch}")
+        return archived
+
+    def run(self, once=False, force_polling=False):
+        """Process whatever is new, then keep watching until interrupted (or return at once with once=True)"""
+        watching = False if once else self.start_observer(force_polling)
+        print(f"👀 Watching {self.folder} ({'events' if watching else 'polling'})" if not once else f"🔎 Scanning {self.folder}")
+        self.scan()
+        last_scan = time.time()
+        try:
+            while True:
+                self._collect_events()
+                ready = self._ready_paths()
+                for start in range(0, len(ready), self.config['batch_size']):
+                    self.process_batch(ready[start:start + self.config['batch_size']])
+                if once and not self.pending and self.events.empty():
+                    return
+                if not watching and not once and time.time() - last_scan >= self.config['poll_seconds']:
+                    self.scan()
+                    last_scan = time.time()
+                time.sleep(self.config['tick_seconds'])
+        finally:
+            if self.observer is not None:
+                self.observer.stop()
+                self.observer.join()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive receipts from new files in a folder (e.g. WhatsApp media) as they arrive.")
+    parser.add_argument("folder", help="Folder to watch, including subfolders")
+    parser.add_argument("--manifest", default=DEFAULT_MANIFEST_PATH, help="Path of the processed-files manifest")
+    parser.add_argument("--batch", help="Archive batch name (defaults to watch:<folder name>)")
+    parser.add_argument("--once", action="store_true", help="Process new files and exit instead of watching")
+    parser.add_argument("--poll", action="store_true", help="Rescan the folder instead of using file system events")
+    parser.add_argument("--debounce", type=float, default=WATCH_CONFIG['debounce_seconds'], help="Seconds a file must stay unchanged before it is read")
+    parser.add_argument("--batch-size", type=int, default=WATCH_CONFIG['batch_size'], help="Files processed per micro-batch")
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent requests")
+    parser.add_argument("--no-cache", action="store_true")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.folder):
+        print(f"Not a folder: {args.folder}", file=sys.stderr)
+        sys.exit(1)
+    watcher = FolderWatcher(
+        args.folder,
+        manifest=Manifest(args.manifest),
+        batch=args.batch,
+        config={'debounce_seconds': args.debounce, 'batch_size': args.batch_size},
+        max_workers=args.workers,
+        use_cache=not args.no_cache
+    )
+    try:
+        watcher.run(once=args.once, force_polling=args.poll)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.manifest.close()
+        from utils import print_token_summary
+        print_token_summary()
+        print(f"Processed {watcher.processed} files", file=sys.stderr)